@@ -48,6 +48,19 @@ function App() {
     startSession();
   }, []);
 
+  const showQuestion = useCallback((data) => {
+    setQuestionData(data);
+    setIsLastQuestion(data.last);
+    setIsMultipleQuestion(data.multiple);
+    setDialogHistory(prev => {
+      if (prev.length === 0 || prev[prev.length - 1].content !== data.question) {
+        return [...prev, { type: 'question', content: data.question }];
+      }
+      return prev;
+    });
+    setTimeout(() => setCanAnswer(true), 500);
+  }, []);
+
   const fetchQuestion = useCallback(async () => {
     if (fetchInProgressRef.current || !userId) return;
     fetchInProgressRef.current = true;
@@ -58,23 +71,14 @@ function App() {
       });
       console.log("GET Response:", response.data);
       if (response.data) {
-        setQuestionData(response.data);
-        setIsLastQuestion(response.data.last);
-        setIsMultipleQuestion(response.data.multiple);
-        setDialogHistory(prev => {
-          if (prev.length === 0 || prev[prev.length - 1].content !== response.data.question) {
-            return [...prev, { type: 'question', content: response.data.question }];
-          }
-          return prev;
-        });
-        setTimeout(() => setCanAnswer(true), 500);
+        showQuestion(response.data);
       }
     } catch (error) {
       console.error("Error fetching question:", error.message);
     } finally {
       fetchInProgressRef.current = false;
     }
-  }, [userId]);
+  }, [userId, showQuestion]);
 
   useEffect(() => {
     if (userId && !isResetting && showIntro) {
@@ -104,9 +108,11 @@ function App() {
       }
       setIsTyping(true);
 
+      // with_question: the next question comes back with the answer, no separate /question call
       const response = await axiosInstance.post(`${API_BASE_URL}/answer?code=${HOST_KEY}`, {
         user_id: userId,
-        answer: answerString
+        answer: answerString,
+        with_question: true
       });
       console.log("POST Response:", response.data);
 
@@ -115,6 +121,7 @@ function App() {
         const ai_response = response.data.response;
         const drinkData = response.data.drink;
         const systemBolagetData = response.data.systembolaget_drink;
+        const nextQuestion = response.data.next_question;
 
         setTimeout(() => {
           if (drinkData && systemBolagetData) {
@@ -142,7 +149,11 @@ function App() {
             if (isLastQuestion) {
               setShowSummary(true);
             } else {
-              fetchQuestion();
+              if (nextQuestion) {
+                showQuestion(nextQuestion);
+              } else {
+                fetchQuestion();
+              }
             }
           }, typingDelay);
         }, 100);
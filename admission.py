@@ -0,0 +1,132 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+
+class RateLimiter:
+    """
+    Token buckets per key (a client IP, a session): on average `rate` requests per second,
+    in bursts of up to `burst`. Only the `max_keys` most recently seen keys are kept; a
+    key dropped past that starts over with a full bucket.
+    """
+
+    def __init__(self, rate, burst, max_keys=100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()  # key -> (tokens, last refill), least recently seen first
+        self.allowed = 0
+        self.limited = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, key):
+        # Takes a token for `key`: 0 when the request may go ahead, else the seconds until it may retry
+        if not self.rate:
+            return 0.0
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+                self.allowed += 1
+            else:
+                wait = (1 - tokens) / self.rate
+                self.limited += 1
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        return wait
+
+    def stats(self):
+        with self.lock:
+            return {
+                'rate_per_second': self.rate,
+                'burst': self.burst,
+                'keys': len(self.buckets),
+                'allowed': self.allowed,
+                'limited': self.limited,
+            }
+
+
+class ConcurrencyGate:
+    """
+    At most `limit` calls at a time, with a short queue in front.
+
+    A caller that finds every slot taken waits in the queue for up to its timeout;
+    when `queue_size` callers are already waiting it is turned away right away, so
+    under overload requests are shed fast instead of piling up. `acquire` returns
+    (True, None) or (False, reason); every admitted caller must `release`.
+    """
+
+    def __init__(self, limit, queue_size):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.shed = {}  # reason -> count
+        self.cond = threading.Condition()
+
+    def _shed(self, reason):
+        self.shed[reason] = self.shed.get(reason, 0) + 1
+        return False, reason
+
+    def acquire(self, timeout):
+        with self.cond:
+            if self.active < self.limit:
+                self.active += 1
+                self.admitted += 1
+                return True, None
+            if self.waiting >= self.queue_size or timeout <= 0:
+                return self._shed('queue_full')
+            self.waiting += 1
+            self.queued += 1
+            try:
+                give_up_at = time.monotonic() + timeout
+                while self.active >= self.limit:
+                    remaining = give_up_at - time.monotonic()
+                    if remaining <= 0:
+                        return self._shed('queue_timeout')
+                    self.cond.wait(remaining)
+                self.active += 1
+                self.admitted += 1
+                return True, None
+            finally:
+                self.waiting -= 1
+
+    async def acquire_async(self, timeout):
+        # A free slot is taken right away; waiting in the queue blocks a thread of the
+        # default executor, which is fine as the queue is short
+        with self.cond:
+            if self.active < self.limit:
+                self.active += 1
+                self.admitted += 1
+                return True, None
+        waiting = asyncio.get_running_loop().run_in_executor(None, self.acquire, timeout)
+        try:
+            return await asyncio.shield(waiting)
+        except asyncio.CancelledError:
+            # The client went away; a slot the wait still gets is given back
+            waiting.add_done_callback(lambda done: done.result()[0] and self.release())
+            raise
+
+    def release(self):
+        with self.cond:
+            self.active -= 1
+            self.cond.notify()
+
+    def stats(self):
+        with self.cond:
+            return {
+                'limit': self.limit,
+                'queue_size': self.queue_size,
+                'active': self.active,
+                'queue_depth': self.waiting,
+                'admitted': self.admitted,
+                'queued': self.queued,
+                'shed': dict(self.shed),
+            }
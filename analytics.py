@@ -0,0 +1,224 @@
+# Analytics of the answered questions and finished or abandoned sessions.
+#
+# The backend appends one compact JSON record per answer (and per reset) to gzipped JSONL
+# files; this module's command line reads them back and aggregates them:
+#
+#   python analytics.py analytics/                          # report on every file
+#   python analytics.py analytics/ --popularity popular.json  # also write the answer-space popularity
+#
+# Records: {"t": unix time, "e": "answer", "s": session, "i": step, "a": answer, "ms": latency,
+# "src": where the GPT text came from (cache, speculation, coalesced, live, fallback)}; the
+# last answer of a session also has "answers" and the chosen "drink" and "sb_drink". A reset
+# is {"t", "e": "reset", "s", "answers": the answers so far}.
+import argparse
+import glob
+import gzip
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import zlib
+from collections import Counter, defaultdict
+
+
+class AnalyticsWriter:
+    """
+    Appends analytics records to rotated, gzipped JSONL files from a background thread.
+
+    `record` only puts the record on a bounded in-memory queue, dropping it when the queue
+    is full, so requests never wait on the disk. The writer thread takes what is queued in
+    batches (up to `batch_size` records, at least every `flush_interval` seconds) and
+    appends every batch as a gzip member of the current file, so a file is readable up to
+    its last complete batch even when the process dies. A new file is started every
+    `rotate_seconds` or once the current one reaches `rotate_bytes`. Every process writes
+    its own files, named analytics-<UTC time>-<pid>.jsonl.gz.
+    """
+
+    def __init__(self, directory, queue_size=10000, batch_size=500, flush_interval=5.0,
+                 rotate_seconds=3600, rotate_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rotate_seconds = rotate_seconds
+        self.rotate_bytes = rotate_bytes
+        self.path = None
+        self.opened_at = None
+        self.thread = None
+        self.stopping = threading.Event()
+        self.written = 0
+        self.dropped = 0
+        self.files = 0
+        self.last_error = None
+
+    def record(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self._run, name='analytics-writer', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        # Writes out what is still queued
+        self.stopping.set()
+        if self.thread is not None and self.thread.is_alive():
+            try:
+                self.queue.put_nowait(None)  # wakes the writer up
+            except queue.Full:
+                pass
+            self.thread.join(timeout=5)
+
+    def after_fork(self):
+        # Records queued in the parent are the parent's to write
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self.path = None
+        self.thread = None
+
+    def _take_batch(self):
+        batch = []
+        try:
+            batch.append(self.queue.get(timeout=self.flush_interval))
+            while len(batch) < self.batch_size:
+                batch.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return [record for record in batch if record is not None]
+
+    def _current_path(self, now):
+        if self.path is not None and (now - self.opened_at >= self.rotate_seconds or
+                                      os.path.getsize(self.path) >= self.rotate_bytes):
+            self.path = None
+        if self.path is None:
+            os.makedirs(self.directory, exist_ok=True)
+            stamp = time.strftime('%Y%m%d-%H%M%S', time.gmtime(now))
+            self.path = os.path.join(self.directory, f"analytics-{stamp}-{os.getpid()}.jsonl.gz")
+            self.opened_at = now
+            self.files += 1
+        return self.path
+
+    def write_batch(self, batch):
+        lines = ''.join(json.dumps(record, separators=(',', ':'), ensure_ascii=False) + '\n' for record in batch)
+        with open(self._current_path(time.time()), 'ab') as out:
+            out.write(gzip.compress(lines.encode('utf-8'), compresslevel=6))
+        self.written += len(batch)
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch:
+                try:
+                    self.write_batch(batch)
+                except Exception as e:
+                    self.dropped += len(batch)
+                    self.last_error = f"{type(e).__name__}: {e}"
+                    logging.error("Could not write analytics records: %s", self.last_error)
+            if self.stopping.is_set() and self.queue.empty():
+                return
+
+    def stats(self):
+        return {
+            'queued': self.queue.qsize(),
+            'written': self.written,
+            'dropped': self.dropped,
+            'files': self.files,
+            'current_file': os.path.basename(self.path) if self.path else None,
+            'last_error': self.last_error,
+            'writing': self.thread is not None and self.thread.is_alive(),
+        }
+
+
+def read_records(paths):
+    """Yields the records of the given files in order, up to the last complete batch of each."""
+    for path in paths:
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as file:
+                for line in file:
+                    yield json.loads(line)
+        except (EOFError, gzip.BadGzipFile, zlib.error, ValueError) as e:
+            # A batch cut short by a crash (maybe mid-line), or a file still being written
+            logging.warning("Skipping the rest of %s: %s", path, e)
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else None
+
+
+def aggregate(records):
+    sessions = Counter()
+    answer_tuples = Counter()
+    drinks = Counter()
+    abandoned_at = Counter()
+    latencies = defaultdict(list)  # step -> [ms]
+    sources = defaultdict(Counter)  # step -> source -> count
+    for record in records:
+        if record.get('e') == 'answer':
+            latencies[record['i']].append(record['ms'])
+            sources[record['i']][record.get('src')] += 1
+            if 'answers' in record:
+                sessions['completed'] += 1
+                answer_tuples[tuple(record['answers'])] += 1
+                drinks[record.get('drink')] += 1
+        elif record.get('e') == 'reset':
+            sessions['reset'] += 1
+            if record.get('answers') and len(record['answers']) < 4:
+                abandoned_at[len(record['answers'])] += 1
+
+    steps = {}
+    for step in sorted(latencies):
+        answered = len(latencies[step])
+        steps[step] = {
+            'answers': answered,
+            'p50_ms': _percentile(latencies[step], 0.5),
+            'p95_ms': _percentile(latencies[step], 0.95),
+            'sources': {source: count / answered for source, count in sources[step].most_common()},
+        }
+    return {
+        'sessions': dict(sessions),
+        'abandoned_after_answers': dict(sorted(abandoned_at.items())),
+        'steps': steps,
+        'answer_tuples': [{'answers': list(answers), 'count': count} for answers, count in answer_tuples.most_common()],
+        'drinks': [{'drink': drink, 'count': count} for drink, count in drinks.most_common()],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregate the backend's analytics files.")
+    parser.add_argument('paths', nargs='+', help="analytics files or directories")
+    parser.add_argument('--top', type=int, default=10, help="how many answer tuples and drinks to list (default: 10)")
+    parser.add_argument('--popularity', help="write the answer tuples by popularity to this JSON file")
+    args = parser.parse_args(argv)
+
+    files = []
+    for path in args.paths:
+        files.extend(sorted(glob.glob(os.path.join(path, '*.jsonl.gz'))) if os.path.isdir(path) else [path])
+    report = aggregate(read_records(files))
+
+    print(f"{len(files)} files, sessions: {report['sessions']}, abandoned after n answers: {report['abandoned_after_answers']}")
+    for step, summary in report['steps'].items():
+        sources = ', '.join(f"{source} {share:.0%}" for source, share in summary['sources'].items())
+        print(f"  step {step}: {summary['answers']} answers, p50 {summary['p50_ms']} ms, "
+              f"p95 {summary['p95_ms']} ms ({sources})")
+    print("Most popular answers:")
+    for item in report['answer_tuples'][:args.top]:
+        print(f"  {item['count']:6d}  {' | '.join(map(str, item['answers']))}")
+    print("Most recommended drinks:")
+    for item in report['drinks'][:args.top]:
+        print(f"  {item['count']:6d}  {item['drink']}")
+
+    if args.popularity:
+        with open(args.popularity, 'w') as out:
+            json.dump({'generated': time.time(), 'answer_tuples': report['answer_tuples']}, out, indent=1, ensure_ascii=False)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
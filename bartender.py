@@ -1,14 +1,34 @@
-from flask import Flask, request, jsonify
-from openai import OpenAI
+from flask import Flask, request, jsonify, Response, stream_with_context, g, send_file
+from openai import OpenAI, APIStatusError
 import os
+import time
 from flask_cors import CORS
-import uuid
-import re
 import logging
+import signal
+import threading
 from concurrent.futures import ThreadPoolExecutor
 import json
-
-logging.basicConfig(level=logging.DEBUG)
+import itertools
+import math
+import atexit
+import hmac
+from admission import ConcurrencyGate, RateLimiter
+from analytics import AnalyticsWriter
+from catalog import normalize_flavor_tokens
+from catalog_snapshot import CatalogSnapshot, CatalogReloader, read_catalog, file_version
+from gpt_cache import ResponseCache
+from image_manifest import ImageManifest
+from log_pipeline import configure_logging
+from metrics import Registry
+from profiling import RequestProfiles, StackSampler
+from quip_pool import QuipWarmer
+from resilience import CircuitBreaker, ResilientCaller
+from sessions import make_session_store
+from single_flight import SingleFlight
+from speculation import Speculator
+
+# LOG_MODE=json moves formatting and writing to a background thread (see log_pipeline.py)
+log_pipeline = configure_logging()
 
 # Suppress excessive debug logging from libraries like httpx and httpcore
 logging.getLogger("httpx").setLevel(logging.WARNING)
@@ -17,47 +37,246 @@ logging.getLogger("openai").setLevel(logging.WARNING)
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=True)
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Initialize OpenAI client. Interactive GPT calls get OPENAI_DEADLINE seconds in total (retries
+# are the resilient caller's job: it hedges slow calls and stops calling while the circuit
+# breaker is open); past that the user gets a templated text instead.
+OPENAI_DEADLINE = float(os.getenv("OPENAI_DEADLINE", "8"))
+client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), timeout=OPENAI_DEADLINE, max_retries=0)
+openai_executor = ThreadPoolExecutor(max_workers=int(os.getenv("OPENAI_WORKERS", "32")))
+openai_guard = ResilientCaller(
+    openai_executor,
+    deadline=OPENAI_DEADLINE,
+    hedge_percentile=float(os.getenv("OPENAI_HEDGE_PERCENTILE", "0.95")),  # 0 turns hedging off
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.getenv("OPENAI_BREAKER_FAILURES", "5")),
+        reset_timeout=float(os.getenv("OPENAI_BREAKER_RESET", "30")),
+    ),
+)
+
+# Admission control, per worker process. Interactive OpenAI calls (not the quip warmer or
+# speculation) take a slot of the gate; past OPENAI_MAX_CONCURRENT calls they wait in a short
+# queue, and when that is full or the wait takes longer than OPENAI_QUEUE_TIMEOUT the answer
+# goes out right away with the templated text. Clients that send too many requests get a 429.
+OPENAI_QUEUE_TIMEOUT = float(os.getenv("OPENAI_QUEUE_TIMEOUT", "1"))
+openai_gate = ConcurrencyGate(
+    limit=int(os.getenv("OPENAI_MAX_CONCURRENT", "16")),
+    queue_size=int(os.getenv("OPENAI_QUEUE_SIZE", "32")),
+)
+ip_limiter = RateLimiter(rate=float(os.getenv("IP_RATE_LIMIT", "5")),  # 0 turns the limit off
+                         burst=int(os.getenv("IP_RATE_BURST", "30")))
+session_limiter = RateLimiter(rate=float(os.getenv("SESSION_RATE_LIMIT", "1")),
+                              burst=int(os.getenv("SESSION_RATE_BURST", "5")))
+ADMISSION_ROUTES = {'/api/start', '/api/answer', '/api/answer/stream', '/api/recommend/batch'}
+# Peers whose X-Real-IP header is believed (nginx)
+TRUSTED_PROXIES = set(os.getenv("TRUSTED_PROXIES", "127.0.0.1,::1").split(','))
+
+# Identical prompts in flight at the same time (a crowd at an event answering "Beer" together)
+# share one OpenAI call. OPENAI_COALESCE lists the kinds of prompts this applies to.
+COALESCE_KINDS = {kind for kind in os.getenv("OPENAI_COALESCE", "quip,final").split(',') if kind}
+single_flight = SingleFlight()
+
+# Prometheus metrics, served on /api/metrics. With METRICS_DIR (set by gunicorn.conf.py) every
+# worker process writes its samples there and a scrape of any worker adds them all up.
+metrics = Registry(directory=os.getenv("METRICS_DIR") or None)
+request_seconds = metrics.histogram('bartender_request_seconds', "Time to serve a request, until the last byte of the body", ('method', 'route'))
+recommend_seconds = metrics.histogram('bartender_recommend_seconds', "Time spent in recommend_drinks",
+                                      buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1))
+openai_seconds = metrics.histogram('bartender_openai_seconds', "OpenAI chat completion latency", ('kind',))
+openai_tokens = metrics.histogram('bartender_openai_tokens', "Tokens used per OpenAI call", ('kind', 'type'),
+                                  buckets=(10, 25, 50, 100, 150, 200, 300, 500, 1000, 2000))
+errors = metrics.counter('bartender_errors_total', "Errors by where they happened and their type", ('source', 'type'))
+metrics.gauge('bartender_active_sessions', "Sessions that have not expired", lambda: user_sessions.count())
+metrics.gauge('bartender_openai_circuit_open', "1 while the OpenAI circuit breaker refuses calls",
+              lambda: int(openai_guard.breaker.state != 'closed'))
+fallbacks = metrics.counter('bartender_openai_fallbacks_total', "Answers served with templated text instead of GPT", ('kind',))
+metrics.gauge('bartender_log_queue_depth', "Log records waiting for the writer thread (LOG_MODE=json)",
+              lambda: log_pipeline.queue.qsize() if log_pipeline else None)
+metrics.gauge('bartender_log_records_dropped', "Log records dropped because the log queue was full (LOG_MODE=json)",
+              lambda: log_pipeline.handler.dropped if log_pipeline else None)
+metrics.gauge('bartender_analytics_queue_depth', "Analytics records waiting for the writer thread",
+              lambda: analytics.queue.qsize() if analytics else None)
+metrics.gauge('bartender_analytics_records_dropped', "Analytics records dropped because the queue was full or the write failed",
+              lambda: analytics.dropped if analytics else None)
+metrics.gauge('bartender_openai_queue_depth', "Interactive OpenAI calls waiting for a slot", lambda: openai_gate.waiting)
+metrics.gauge('bartender_openai_active_calls', "Interactive OpenAI calls holding a slot", lambda: openai_gate.active)
+coalesced = metrics.counter('bartender_openai_coalesced_total', "Interactive GPT calls that waited for an identical call in flight instead", ('kind',))
+shed = metrics.counter('bartender_shed_total', "Requests turned away (429) or answered without GPT because of load", ('reason',))
+
+# Final bartender texts, keyed by the GPT prompt (which is built from the drink and the occasion)
+final_response_cache = ResponseCache(os.getenv("GPT_CACHE_PATH", "gpt_cache.sqlite3"))
+
+# Comments on the intermediate answers only depend on the answer itself, so a pool of them is
+# generated in the background (see quip_warmer) and any stocked variant is served right away
+quip_pool = ResponseCache(os.getenv("QUIP_POOL_PATH", "quip_pool.sqlite3"), max_keys=1000,
+                          variants=int(os.getenv("QUIP_VARIANTS", "5")), min_variants=1)
+
+# Once the alcohol level is answered the drink is known, so the final texts for the most
+# popular occasions are generated in the background while the user picks one
+speculation_executor = ThreadPoolExecutor(max_workers=int(os.getenv("SPECULATION_WORKERS", "4")))
+speculator = Speculator(
+    speculation_executor,
+    max_inflight=int(os.getenv("SPECULATION_MAX_INFLIGHT", "8")),
+    max_calls_per_minute=int(os.getenv("SPECULATION_CALLS_PER_MINUTE", "60")),
+    keep=final_response_cache.put,  # speculation for an occasion the user didn't pick still fills the cache
+)
+speculate_occasions = int(os.getenv("SPECULATE_OCCASIONS", "2"))
+
+# One record per answered question and reset session, written to rotated gzipped JSONL files
+# by a background thread (see analytics.py, which also reads them). ANALYTICS_DIR= turns it off.
+ANALYTICS_DIR = os.getenv("ANALYTICS_DIR", "analytics")
+analytics = AnalyticsWriter(ANALYTICS_DIR, queue_size=int(os.getenv("ANALYTICS_QUEUE_SIZE", "10000")),
+                            rotate_seconds=float(os.getenv("ANALYTICS_ROTATE_MINUTES", "60")) * 60) if ANALYTICS_DIR else None
+if analytics:
+    atexit.register(analytics.stop)
+
+# Occasion popularity from earlier traffic (`analytics.py --popularity`) ranks the final texts
+# worth speculating on before this process has seen any choices of its own
+ANALYTICS_POPULARITY = os.getenv("ANALYTICS_POPULARITY")
+if ANALYTICS_POPULARITY:
+    try:
+        with open(ANALYTICS_POPULARITY, 'r') as file:
+            occasion_counts = {}
+            for item in json.load(file)['answer_tuples']:
+                occasion = str(item['answers'][-1])
+                occasion_counts[occasion] = occasion_counts.get(occasion, 0) + item['count']
+        speculator.seed_choices(occasion_counts)
+    except (OSError, ValueError, KeyError, IndexError) as e:
+        logging.error("Could not read answer popularity %s: %s", ANALYTICS_POPULARITY, e)
+
+# Profiling (profiling.py), only for requests carrying ADMIN_KEY in X-Admin-Key; without a key it is off.
+# The sampler runs all the time at PROFILE_SAMPLE_HZ (0 turns it off).
+ADMIN_KEY = os.getenv("ADMIN_KEY")
+PROFILE_SAMPLE_HZ = float(os.getenv("PROFILE_SAMPLE_HZ", "25"))
+stack_sampler = StackSampler(interval=1 / PROFILE_SAMPLE_HZ) if ADMIN_KEY and PROFILE_SAMPLE_HZ > 0 else None
+request_profiles = RequestProfiles(os.getenv("PROFILE_DIR", "profiles"), keep=int(os.getenv("PROFILE_KEEP", "50")))
+PROFILE_SORTS = ('cumulative', 'tottime', 'calls')
+ADMIN_ONLY = {'error': 'Needs the admin key in X-Admin-Key'}
 
 # Define a simple filter function for Werkzeug logs
 def werkzeug_filter(record):
-    # Suppress 'Bad request' messages and malformed binary sequences
+    # Runs for every werkzeug record, so it sticks to substring checks, the most common case first
     message = record.getMessage()
-    
-    # Suppress specific bad request versions or malformed binary sequences
-    if 'code 400, message Bad request' in message:
-        return False
-    
-    # Suppress messages with non-ASCII characters (which are common in binary junk requests)
-    if re.search(r'\\x[0-9a-fA-F]{2}', message):
-        return False
-    
-    # Suppress regular HTTP GET and POST request logs
-    if 'GET' in message or 'POST' in message:
-        return False 
-    return True
+    return not (
+        'GET' in message or 'POST' in message  # regular HTTP GET and POST request logs
+        or 'code 400, message Bad request' in message  # bad request versions
+        or '\\x' in message  # escaped binary junk requests
+    )
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    method = request.method
+    if response.status_code >= 400:
+        errors.inc('http', str(response.status_code))
+    if started is not None:
+        # Observed once the body is sent, so streamed answers count in full
+        response.call_on_close(lambda: request_seconds.observe(time.perf_counter() - started, method, route))
+    if request.path.endswith('-stats'):
+        # The stats endpoints describe the worker process that answered
+        response.headers['X-Worker-Pid'] = str(os.getpid())
+    return response
+
+@app.teardown_request
+def record_request_exception(exception):
+    if exception is not None:
+        errors.inc('exception', type(exception).__name__)
+
+def is_admin(headers):
+    return bool(ADMIN_KEY) and hmac.compare_digest(headers.get('X-Admin-Key', '').encode(), ADMIN_KEY.encode())
+
+def start_request_profile(method, path, headers):
+    # (profile id, profiler) when the request asks to be profiled with X-Profile: 1, None otherwise
+    # or while another request is being profiled
+    if headers.get('X-Profile') != '1' or not is_admin(headers):
+        return None
+    return request_profiles.start(f"{method} {path}")
+
+def finish_request_profile(profile):
+    profile_id, profiler = profile
+    try:
+        request_profiles.finish(profile_id, profiler)
+    except OSError as e:
+        logging.error("Could not save profile %s: %s", profile_id, e)
+
+@app.before_request
+def profile_request():
+    g.profile = start_request_profile(request.method, request.path, request.headers)
+
+@app.after_request
+def profile_response(response):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        # Finished once the body is sent, so streamed answers are profiled in full
+        response.headers['X-Profile-Id'] = profile[0]
+        response.call_on_close(lambda: finish_request_profile(profile))
+    elif request.headers.get('X-Profile') == '1' and is_admin(request.headers):
+        response.headers['X-Profile-Id'] = 'busy'
+    return response
+
+@app.teardown_request
+def profile_teardown(exception):
+    # A request that never got to its response still stops its profile
+    profile = g.pop('profile', None)
+    if profile is not None:
+        finish_request_profile(profile)
+
+def client_ip(remote_addr, headers):
+    # Behind nginx the peer is the proxy, which passes the client's address in X-Real-IP
+    if remote_addr in TRUSTED_PROXIES and headers.get('X-Real-IP'):
+        return headers['X-Real-IP']
+    return remote_addr
+
+def admit(ip, user_id):
+    # Takes a token from the client's and the session's bucket; None when the request may go
+    # ahead, else the 429 payload and the seconds after which the client may retry
+    for limiter, key, reason in ((ip_limiter, ip, 'ip_rate'), (session_limiter, user_id, 'session_rate')):
+        if key is None:
+            continue
+        retry_after = limiter.acquire(key)
+        if retry_after:
+            shed.inc(reason)
+            return {'error': 'Too many requests, please slow down.'}, retry_after
+    return None
+
+def rate_limited_headers(retry_after):
+    return {'Retry-After': str(max(1, math.ceil(retry_after)))}
+
+@app.before_request
+def admission_control():
+    if request.path not in ADMISSION_ROUTES:
+        return None
+    body = request.get_json(silent=True) if request.method == 'POST' else None
+    user_id = body.get('user_id') if isinstance(body, dict) else None
+    rejected = admit(client_ip(request.remote_addr, request.headers), user_id)
+    if rejected:
+        payload, retry_after = rejected
+        return jsonify(payload), 429, rate_limited_headers(retry_after)
 
 # Apply the filter to Werkzeug logger
 werkzeug_logger = logging.getLogger('werkzeug')
 werkzeug_logger.addFilter(werkzeug_filter)
 
-logging.basicConfig(level=logging.DEBUG, format='%(levelname)s:%(name)s:%(message)s')
 
-app_logger = logging.getLogger('root')  # application logs
-app_logger.setLevel(logging.DEBUG)
-logging.basicConfig(level=logging.DEBUG)
+# Drinks dictionaries deployed next to the nginx config
+CATALOG_DIR = os.getenv("CATALOG_DIR", "/etc/nginx/sites-available")
+SYSTEMBOLAGET_PATH = os.path.join(CATALOG_DIR, "systembolagetdict.json")
+MAIN_DRINKS_PATH = os.path.join(CATALOG_DIR, "main_drinks.json")
 
 
 def load_systembolaget_data():
     try:
-        with open('/etc/nginx/sites-available/systembolagetdict.json', 'r') as file:
+        with open(SYSTEMBOLAGET_PATH, 'r') as file:
             systembolaget_data = json.load(file)
             
         # Validate the data to ensure every entry has "Style_Name"
         for item in systembolaget_data:
             if 'Style_Name' not in item or not item['Style_Name']:
-                logging.error(f"Invalid entry found: {item}")
+                logging.error("Invalid entry found: %s", item)
         
         return systembolaget_data
     except FileNotFoundError:
@@ -70,12 +289,12 @@ def load_systembolaget_data():
 # Current inventory of drinks 
 def load_main_drinks_data():
     try:
-        with open('/etc/nginx/sites-available/main_drinks.json', 'r') as f:
+        with open(MAIN_DRINKS_PATH, 'r') as f:
             data = json.load(f)
 
         for item in data:
             if 'Style_Name' not in item or not item['Style_Name']:
-                logging.error(f"Invalid main_drink entry (missing Style_Name): {item}")
+                logging.error("Invalid main_drink entry (missing Style_Name): %s", item)
         return data
     except FileNotFoundError:
         logging.error("Main drinks JSON file not found.")
@@ -84,8 +303,79 @@ def load_main_drinks_data():
         logging.error("Error decoding main drinks JSON file.")
         return []
 
-main_drinks = load_main_drinks_data()
-system_bolaget_dictionary = load_systembolaget_data()
+# Optional artifact from catalog_compiler.py, memory-mapped instead of parsing the JSON files
+CATALOG_COMPILED = os.getenv("CATALOG_COMPILED")
+CATALOG_PATHS = [CATALOG_COMPILED] if CATALOG_COMPILED else [MAIN_DRINKS_PATH, SYSTEMBOLAGET_PATH]
+# MATCHING=exact (the default) counts flavor profile substrings; MATCHING=semantic ranks drinks by
+# how close their flavor profile, description and pairing text is to the picked flavors
+# (text_index.py). Semantic changes most picks, so it is opt-in until the analytics back it.
+SEMANTIC_MATCHING = os.getenv("MATCHING", "exact") == "semantic"
+
+
+def catalog_versions():
+    return {path: file_version(path) for path in (MAIN_DRINKS_PATH, SYSTEMBOLAGET_PATH)}
+
+
+def build_catalog():
+    # Parse and validate both files, then build the indexes, all off the request path
+    if CATALOG_COMPILED:
+        snapshot = CatalogSnapshot.from_compiled(CATALOG_COMPILED)
+    else:
+        snapshot = CatalogSnapshot(read_catalog(MAIN_DRINKS_PATH), read_catalog(SYSTEMBOLAGET_PATH), catalog_versions())
+    if SEMANTIC_MATCHING:
+        # The engines build their text indexes on first use, which shouldn't be a request
+        snapshot.main_drinks_engine.text_index
+        snapshot.system_bolaget_engine.text_index
+    return snapshot
+
+
+def load_catalog():
+    if CATALOG_COMPILED:
+        try:
+            return CatalogSnapshot.from_compiled(CATALOG_COMPILED)
+        except (OSError, ValueError) as e:
+            logging.error("Could not load compiled catalog %s, falling back to JSON: %s", CATALOG_COMPILED, e)
+    return CatalogSnapshot(load_main_drinks_data(), load_systembolaget_data(), catalog_versions())
+
+
+# Both dictionaries plus their indexes and scoring engines. Replaced as a whole on reload,
+# so read it once per request (`snapshot = catalog`) rather than attribute by attribute.
+catalog = load_catalog()
+
+# Resized, content-hashed drink images built by image_manifest.py; rebuild it before
+# changing the dictionaries, it is re-read along with them
+image_manifest = ImageManifest(os.getenv("IMAGE_MANIFEST", "/var/www/html/images/dist/manifest.json"))
+
+
+def swap_catalog(snapshot):
+    global catalog
+    catalog = snapshot
+    image_manifest.refresh()
+
+
+def with_images(drink):
+    # A copy of the drink with the URLs of its photo and icon derivatives, when they were built
+    return {**drink, 'images': image_manifest.images_for(drink)}
+
+
+# Polls the files every CATALOG_RELOAD_INTERVAL seconds (0 = only on SIGHUP)
+catalog_reloader = CatalogReloader(
+    CATALOG_PATHS, build_catalog, swap_catalog, lambda: catalog,
+    interval=float(os.getenv("CATALOG_RELOAD_INTERVAL", "5")),
+)
+
+
+def install_reload_signal():
+    # `kill -HUP <pid>` reloads the catalog right away. gunicorn workers reset their signal
+    # handlers after post_fork, so gunicorn.conf.py installs it again in post_worker_init.
+    try:
+        signal.signal(signal.SIGHUP, lambda signum, frame: catalog_reloader.request_reload())
+    except (ValueError, AttributeError):
+        # Not the main thread, or no SIGHUP on this platform
+        pass
+
+
+install_reload_signal()
 
 
 questions_with_answers = [
@@ -124,109 +414,190 @@ questions_with_answers = [
     }
 ]
 
+# Answers of the flavor and alcohol questions, per drink type
+FLAVOR_ANSWERS = {
+    "beer": ["Light", "Fruity", "Malty", "Dark", "Sour", "Wheat beer"],
+    "red wine": ["Fruity", "Spicy", "Oaked", "Tannic", "Acidic", "Earthy"],
+    "white wine": ["Fruity", "Floral", "Mineral", "Spicy", "Acidic", "Buttery"],
+}
+LEVEL_ANSWERS = {
+    "beer": ["Low", "Medium", "High", "Non-alcoholic"],
+    "red wine": ["Low", "Medium", "High"],
+    "white wine": ["Low", "Medium", "High"],
+}
+
+
+def question_payloads(drink_type):
+    # {question index: payload} of the questions shown to a user who picked `drink_type`
+    # (lowercase; None before the first answer or for a drink type we don't know)
+    payloads = {}
+    for question in sorted(questions_with_answers, key=lambda q: q['index']):
+        # Conditional questions all depend on the drink type (question 0)
+        if "conditional" in question:
+            if drink_type not in [answer.lower() for answer in question['depends_on']['answer']]:
+                continue
+
+        answers = question['answers']
+        if question['index'] == 1 and drink_type in FLAVOR_ANSWERS:
+            answers = FLAVOR_ANSWERS[drink_type]
+        # Set alcohol-level answers based on drink type (beer or wine) after flavor question
+        if question['index'] == 2 and drink_type in LEVEL_ANSWERS:
+            answers = LEVEL_ANSWERS[drink_type]
+
+        text = question['question']
+        if question['index'] == 3:
+            if drink_type == "beer":
+                text = "Where do you prefer to drink your beer?"
+            elif drink_type in ["red wine", "white wine"]:
+                text = f"Where do you prefer to drink your {drink_type}?"
+
+        payloads[question['index']] = {
+            'question': text,
+            'answers': list(answers),
+            'requiredSelections': question.get('requiredSelections', 1),
+            'multiple': question['multiple'],
+            'last': question.get('last', False),
+        }
+    return payloads
+
+
+def dump_json(payload):
+    return json.dumps(payload, sort_keys=True, separators=(',', ':')).encode()
+
+
+def compile_questions():
+    """
+    The question flow never changes at runtime, so every payload is built and serialized
+    once at startup. Returns (steps, questionnaires):
+
+    steps: (drink type, question index) -> (index of the question shown, payload, JSON body),
+        where questions that don't apply to the drink type resolve to the next one that does.
+    questionnaires: drink type -> JSON body with all of its questions in order, and
+        None -> the questions of every drink type.
+    """
+    steps = {}
+    flows = {}
+    for drink_type in [None] + [answer.lower() for answer in questions_with_answers[0]['answers']]:
+        payloads = question_payloads(drink_type)
+        shown = None
+        for index in reversed(range(len(questions_with_answers))):
+            if index in payloads:
+                shown = index
+            if shown is not None:
+                steps[(drink_type, index)] = (shown, payloads[shown], dump_json(payloads[shown]))
+        if drink_type is not None:
+            flows[drink_type] = [{'index': index, **payload} for index, payload in sorted(payloads.items())]
 
+    questionnaires = {drink_type: dump_json({'drink_type': drink_type, 'questions': questions})
+                      for drink_type, questions in flows.items()}
+    questionnaires[None] = dump_json({'drink_types': flows})
+    return steps, questionnaires
 
-user_sessions = {}
+
+QUESTION_STEPS, QUESTIONNAIRES = compile_questions()
+
+
+
+# Sessions idle for two hours expire; past the size limit the least recently used one is dropped.
+# SESSION_BACKEND=sqlite or redis shares sessions between worker processes.
+user_sessions = make_session_store(
+    backend=os.getenv("SESSION_BACKEND", "memory"),
+    max_sessions=int(os.getenv("MAX_SESSIONS", "10000")),
+    ttl=int(os.getenv("SESSION_TTL", str(2 * 3600))),
+    path=os.getenv("SESSION_DB_PATH", "sessions.sqlite3"),
+    url=os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0"),
+)
 
 
 # Utility functions to manage session state for each user
 def get_session(user_id):
-    if user_id not in user_sessions:
-        user_sessions[user_id] = {'question_index': 0, 'enable_speech': True}  # Default enable_speech to True
-    return user_sessions[user_id]
+    # Returns None for unknown or expired sessions
+    return user_sessions.get(user_id)
+
+# The route bodies below return plain (payload, status) pairs so the Flask routes here and the
+# async routes in bartender_async.py share the same session handling and JSON contract.
+def new_session():
+    # Generate a unique user session ID with speech enabled and no responses yet
+    user_id, _ = user_sessions.create()
+    return {'user_id': user_id, 'enable_speech': True}, 200  # Return user_id and enable_speech status
 
 @app.route('/api/start', methods=['GET'])
 def start_session():
-    user_id = str(uuid.uuid4())  # Generate a unique user session ID
-    # Initialize session data including an empty list for user_responses
-    user_sessions[user_id] = {'question_index': 0, 'enable_speech': True, 'user_responses': []}  
-    return jsonify({'user_id': user_id, 'enable_speech': True}), 200  # Return user_id and enable_speech status
+    payload, status = new_session()
+    return jsonify(payload), status
 
-@app.route('/api/toggle-speech', methods=['POST'])
-def toggle_speech():
-    user_data = request.json
+
+def update_speech(user_data):
     user_id = user_data.get('user_id')
     enable_speech = user_data.get('enable_speech')
 
-    if not user_id or user_id not in user_sessions:
-        return jsonify({'error': 'Invalid session or user_id'}), 400
+    session_data = get_session(user_id)
+    if session_data is None:
+        return {'error': 'Invalid session or user_id'}, 400
 
     # Update the session's enable_speech status
-    user_sessions[user_id]['enable_speech'] = enable_speech
-    return jsonify({'status': 'Speech toggle updated successfully!', 'enable_speech': enable_speech}), 200
+    session_data.enable_speech = enable_speech
+    user_sessions.save(session_data)
+    return {'status': 'Speech toggle updated successfully!', 'enable_speech': enable_speech}, 200
+
+@app.route('/api/toggle-speech', methods=['POST'])
+def toggle_speech():
+    payload, status = update_speech(request.json)
+    return jsonify(payload), status
+
 
 
+def json_response(payload, status):
+    # Precompiled payloads are already serialized
+    if isinstance(payload, bytes):
+        return Response(payload, status=status, mimetype='application/json')
+    return jsonify(payload), status
+
 
 @app.route('/api/question', methods=['GET'])
 def get_question():
-    user_id = request.args.get('user_id')
-    if not user_id or user_id not in user_sessions:
-        return jsonify({'error': 'Invalid session or user_id'}), 400
+    return json_response(*next_question(request.args.get('user_id')))
+
 
+def resolve_question(session_data):
+    # (payload, JSON body) of the question the session is at, or None past the last one.
+    # Moves the session past conditional questions that don't apply to its drink type;
+    # saving it is up to the caller.
+    question_index = session_data.question_index
+    drink_type = str(session_data.user_responses[0]).lower() if session_data.user_responses else None
+
+    # Unknown drink types get the generic flow
+    step = QUESTION_STEPS.get((drink_type, question_index)) or QUESTION_STEPS.get((None, question_index))
+    if step is None:
+        return None
+    session_data.question_index, payload, body = step
+    return payload, body
+
+
+def next_question(user_id):
     session_data = get_session(user_id)
-    question_index = session_data['question_index']
-
-    # Sort the questions based on the 'index' field
-    sorted_questions = sorted(questions_with_answers, key=lambda q: q['index'])
-
-    # Ensure we do not exceed the bounds of the sorted_questions list
-    if question_index >= len(sorted_questions):
-        return jsonify({'error': 'No more questions available.'}), 400
-
-    # Get the current question based on the question index
-    current_question_data = sorted_questions[question_index]
-
-
-    if question_index == 1:
-        previous_answer = session_data['user_responses'][0]  # Get the drink type
-        if previous_answer.lower() == "beer":
-            current_question_data['answers'] = ["Light", "Fruity", "Malty", "Dark", "Sour", "Wheat beer"]
-        elif previous_answer.lower() == "red wine":
-            current_question_data['answers'] = ["Fruity", "Spicy", "Oaked", "Tannic", "Acidic", "Earthy"]
-        elif previous_answer.lower() == "white wine":
-            current_question_data['answers'] = ["Fruity", "Floral", "Mineral", "Spicy", "Acidic", "Buttery"]
-    # Set alcohol-level answers based on drink type (beer or wine) after flavor question
-    if question_index == 2:
-        previous_answer = session_data['user_responses'][0]
-        if previous_answer.lower() == "beer":
-            current_question_data['answers'] = ["Low", "Medium", "High", "Non-alcoholic"]
-        elif previous_answer.lower() in ["red wine", "white wine"]:
-            current_question_data['answers'] = ["Low", "Medium", "High"]
-
-
-    # Check for conditionally skipped questions (Flavors for beer, red wine, or white wine)
-    if "conditional" in current_question_data:
-        condition = current_question_data.get('depends_on')
-        previous_answer = session_data['user_responses'][condition['index']]
-
-        # Skip this question if the condition is not met
-        if previous_answer.lower() not in [ans.lower() for ans in condition['answer']]:
-            session_data['question_index'] += 1  # Increment the question index
-            return get_question()  # Recursively call to get the next valid question
-
-    if question_index == 3:
-        drink_type = session_data['user_responses'][0].lower()
-        if drink_type == "beer":
-            current_question_data['question'] = "Where do you prefer to drink your beer?"
-        elif drink_type in ["red wine", "white wine"]:
-            current_question_data['question'] = f"Where do you prefer to drink your {drink_type}?"
-
-    # Prepare the response
-    current_question = current_question_data["question"]
-    current_answers = current_question_data["answers"]
-    required_selections = current_question_data.get("requiredSelections", 1)  # Get requiredSelections or default to 1
-    multiple = current_question_data["multiple"]
-    last_question = current_question_data.get("last", False)
-
-    return jsonify({
-        'question': current_question,
-        'answers': current_answers,
-        'requiredSelections': required_selections,
-        'multiple': multiple,
-        'last': last_question
-    })
+    if session_data is None:
+        return {'error': 'Invalid session or user_id'}, 400
+
+    question_index = session_data.question_index
+    question = resolve_question(session_data)
+    if question is None:
+        return {'error': 'No more questions available.'}, 400
+    if session_data.question_index != question_index:
+        user_sessions.save(session_data)
+    return question[1], 200
+
 
+def questionnaire(drink_type):
+    # Every question of a drink type's flow in one response, or of all drink types without one
+    body = QUESTIONNAIRES.get(drink_type.lower().strip() if drink_type else None)
+    if body is None:
+        return {'error': f"Unknown drink type: {drink_type}"}, 400
+    return body, 200
 
+@app.route('/api/questionnaire', methods=['GET'])
+def get_questionnaire():
+    return json_response(*questionnaire(request.args.get('drink_type')))
 
 
 def generate_gpt_prompt(main_recommendation, occasion_preference):
@@ -278,201 +649,524 @@ def generate_gpt_prompt(main_recommendation, occasion_preference):
 
 
 
-@app.route('/api/answer', methods=['POST'])
-def post_answer():
-    user_data = request.json
-    user_id = user_data.get('user_id')
-    answer = user_data.get('answer')
+def final_completion_request(gpt_prompt):
+    # Arguments for the final recommendation completion
+    return {
+        'model': "gpt-3.5-turbo",
+        'messages': [
+            {"role": "system", "content": "You are a professional friendly and fun bartender who loves recommending drinks."},
+            {"role": "user", "content": gpt_prompt}
+        ],
+        'temperature': 0.7,
+        'max_tokens': 300,
+    }
+
 
-    if not user_id or user_id not in user_sessions:
-        return jsonify({'error': 'Invalid session or user_id'}), 400
+def quip_completion_request(prompt):
+    # Arguments for the short bartender comment after each intermediate answer
+    return {
+        'model': "gpt-3.5-turbo",
+        'messages': [
+            {"role": "system", "content": "You are a friendly bartender."},
+            {"role": "user", "content": prompt}
+        ],
+        'temperature': 0.7,
+        'max_tokens': 100,
+    }
 
 
-#question_index = session_data['question_index']
-    session_data = get_session(user_id)  # Fetch the session data
-    question_index = session_data['question_index']  # Now access the question_index
+def record_completion(kind, started, usage):
+    openai_seconds.observe(time.perf_counter() - started, kind)
+    if usage is not None:
+        openai_tokens.observe(usage.prompt_tokens, kind, 'prompt')
+        openai_tokens.observe(usage.completion_tokens, kind, 'completion')
+
+
+def create_completion(kind, completion_request):
+    # Every non-streaming GPT call goes through here so its latency, tokens and errors are recorded
+    started = time.perf_counter()
+    try:
+        chat_completion = client.chat.completions.create(**completion_request)
+    except Exception as e:
+        errors.inc('openai', type(e).__name__)
+        raise
+    record_completion(kind, started, chat_completion.usage)
+    return chat_completion.choices[0].message.content
+
+
+def fallback_final_text(main_recommendation, occasion_preference):
+    # Served when GPT can't answer in time; built from the same details as generate_gpt_prompt
+    drink_name = main_recommendation['Style_Name']
+    flavors = ', '.join(normalize_flavor_tokens(main_recommendation.get('flavor_profile') or '')) or 'flavorful'
+    pairing = str(main_recommendation.get('pairing') or 'any meal').strip().rstrip('.')
+    return (f"A {drink_name} it is for {occasion_preference.lower()}! "
+            f"Its {flavors} character makes it just right for the occasion. "
+            f"Pairing tip: {pairing}. Cheers!")
+
+
+def fallback_quip_text(question_index, answer):
+    if question_index == 0:
+        return f"{answer}? Solid choice. Let's find you the perfect one."
+    elif question_index == 1:
+        return f"{answer}, now we're talking. A bartender could get used to customers like you."
+    return f"{answer} it is. Noted, and no judgement... mostly."
+
+
+def generate_quip_prompt(question_index, answer, drink_type):
+    # Generate a fun GPT response based on the user's answer so far
+    if question_index == 0:
+        return f"Be a cheeky sarcastic intelligent bartender and respond to the user's {answer} drink preference. Make it fun and intelligent! Don't provide a recommendation yet. no more than two lines of response"
+    elif question_index == 1:
+        return f"The user prefers flavor profile {answer}. Give a sarcastic and naugthy response. but don't provide a recommendation yet. no more than two lines of response"
+    elif question_index == 2:
+        if drink_type == "beer":
+            return f"The user prefers a beer with {answer} alcohol content. Give a sarcastic response but don't provide a recommendation yet. Don't ask any further questions.  no more than two lines of response"
+        elif drink_type in ["red wine", "white wine"]:
+            return f"The user selected wine, and they prefer {answer} wine. Be charming and fun but don't recommend a specific drink yet. Don't ask any further questions.  no more than two lines of response"
+#    elif question_index == 3:
+#        return f"The user prefers to drink at {answer}. Respond with a witty and engaging comment!"
+
+
+def canonical_quip_answer(question_index, answer, drink_type):
+    # Flavors can be picked in any order; the pool keeps one prompt per combination, in answer order
+    if question_index == 1 and drink_type in FLAVOR_ANSWERS:
+        order = FLAVOR_ANSWERS[drink_type]
+        picks = [pick.strip() for pick in str(answer).split(',')]
+        if all(pick in order for pick in picks):
+            return ', '.join(sorted(picks, key=order.index))
+    return answer
+
+
+def all_quip_prompts():
+    # Every prompt an intermediate answer of the questionnaire can produce
+    prompts = []
+    required_flavors = questions_with_answers[1]['requiredSelections']
+    for drink_type in questions_with_answers[0]['answers']:
+        key = drink_type.lower()
+        prompts.append(generate_quip_prompt(0, drink_type, key))
+        for flavors in itertools.combinations(FLAVOR_ANSWERS[key], required_flavors):
+            prompts.append(generate_quip_prompt(1, ', '.join(flavors), key))
+        for level in LEVEL_ANSWERS[key]:
+            prompts.append(generate_quip_prompt(2, level, key))
+    return list(dict.fromkeys(prompts))
+
+
+QUIP_PROMPTS = all_quip_prompts()
+QUIP_PROMPT_SET = frozenset(QUIP_PROMPTS)
+
+quip_warmer = QuipWarmer(
+    quip_pool,
+    lambda: QUIP_PROMPTS,
+    lambda prompt: create_completion('quip_pool', quip_completion_request(prompt)),
+    refresh_after=float(os.getenv("QUIP_REFRESH_HOURS", "6")) * 3600,
+    calls_per_minute=int(os.getenv("QUIP_POOL_CALLS_PER_MINUTE", "30")),
+    # Live answers come first: no warming while OpenAI is failing
+    paused=lambda: openai_guard.breaker.state != 'closed',
+    # One worker of the prefork server warms; the others read its texts from the shared file
+    lock_path=quip_pool.path + '.lock',
+)
+
+
+def record_answer(session_data, answer):
+    question_index = session_data.question_index
 
     # If the answer is an array, take the first value (as only one answer is expected for each question)
     if isinstance(answer, list):
         answer = answer[0]
 
     # Store the user's response as a string in the session data
-    session_data['user_responses'].append(answer)
-    # Increment the question index to move to the next question
-    session_data['question_index'] += 1
+    session_data.add_response(answer)
+    # Increment the question index to move to the next question (begin_answer saves the session)
+    session_data.question_index += 1
+
+    logging.debug("Recorded answer %d of user %s", question_index, session_data.user_id)
+    return question_index, answer
+
+
+def resolve_final_recommendation(session_data):
+    # Returns (main_recommendation, systembolaget_recommendation, None) or (None, None, (error payload, status))
+    recommended_drinks = recommend_drinks(session_data.user_responses)
+
+    # Check if the recommendation returned an error or warning
+    if 'error' in recommended_drinks:
+        return None, None, ({
+            'response': recommended_drinks['error']
+        }, 400)
+    elif 'warning' in recommended_drinks:
+        return None, None, ({
+            'response': recommended_drinks['warning']
+        }, 200)
+
+    # Get the two drinks
+    main_recommendation = recommended_drinks.get('main_recommendation')
+    systembolaget_recommendation = recommended_drinks.get('systembolaget_recommendation')
+
+    # Ensure both 'Style_Name' exists in the recommendations
+    if not main_recommendation or not systembolaget_recommendation:
+        return None, None, ({'error': 'No matching drinks found.'}, 400)
+
+    logging.debug("Recommended %s and %s from Systembolaget", main_recommendation['Style_Name'],
+                  systembolaget_recommendation['Style_Name'],
+                  extra={'main_drink': main_recommendation, 'systembolaget_drink': systembolaget_recommendation})
+
+    return main_recommendation, systembolaget_recommendation, None
+
+
+def begin_answer(user_data):
+    """
+    Records the user's answer and works out what GPT has to say about it.
+
+    Returns (pending, None) or (None, (error payload, status)). `pending` holds the
+    final drinks (if this was the last question), the completion request for GPT and,
+    when the final text is already cached, the response itself. With `with_question`
+    set in the request it also holds the next question, so the client doesn't need to
+    call /api/question.
+    """
+    started = time.perf_counter()
+    user_id = user_data.get('user_id')
+    answer = user_data.get('answer')
 
-    print(f"User responses so far: {session_data['user_responses']}")  # Debugging line
+    session_data = get_session(user_id)  # Fetch the session data
+    if session_data is None:
+        return None, ({'error': 'Invalid session or user_id'}, 400)
+
+    question_index, answer = record_answer(session_data, answer)
+    # What finish_answer puts in the analytics record
+    step = {'started': started, 'user_id': user_id, 'step': question_index, 'answer': answer}
 
     # Determine whether the user selected beer, red wine, or white wine
-    drink_type = session_data['user_responses'][0].lower()
+    drink_type = session_data.user_responses[0].lower()
 
     # Check if the current question index indicates the last question based on the drink type
     is_beer = drink_type == "beer"
     last_question_index = 3 
 
+    # Resolve the next question on the same session object, then save the answer and it together
+    next_question_payload = None
+    if user_data.get('with_question') and question_index < last_question_index:
+        question = resolve_question(session_data)
+        next_question_payload = question[0] if question else None
+    user_sessions.save(session_data)
+
     if question_index == last_question_index:  # Trigger the recommendation at the correct index
         # Call the function to get the recommendations
-        recommended_drinks = recommend_drinks(session_data['user_responses'])
-
-        # Check if the recommendation returned an error or warning
-        if 'error' in recommended_drinks:
-            return jsonify({
-                'response': recommended_drinks['error']
-            }), 400
-        elif 'warning' in recommended_drinks:
-            return jsonify({
-                'response': recommended_drinks['warning']
-            }), 200
-
-        # Get the two drinks
-        main_recommendation = recommended_drinks.get('main_recommendation')
-        systembolaget_recommendation = recommended_drinks.get('systembolaget_recommendation')
-
-        # Ensure both 'Style_Name' exists in the recommendations
-        if not main_recommendation or not systembolaget_recommendation:
-            return jsonify({'error': 'No matching drinks found.'}), 400
-
-        # Log full details for the main drink
-        logging.info(f"""
-        Main Drink Recommendation:
-        Name: {main_recommendation['Style_Name']}
-        Description: {main_recommendation['description']}
-        Flavor Profile: {main_recommendation['flavor_profile']}
-        Alcohol Content: {main_recommendation.get('alcohol_content', 'N/A')}
-        Pairing: {main_recommendation['pairing']}
-        Occasion: {main_recommendation['occasion']}
-        Category: {main_recommendation['category']}
-        Image Name: {main_recommendation.get('Image_name', 'N/A')}
-        Image Icon: {main_recommendation.get('Image_Icon', 'N/A')}
-        """)
-
-        # Log full details for the systembolaget drink
-        logging.info(f"""
-        Systembolaget Drink Recommendation:
-        Name: {systembolaget_recommendation['Style_Name']}
-        Description: {systembolaget_recommendation['description']}
-        Flavor Profile: {systembolaget_recommendation['flavor_profile']}
-        Alcohol Content: {systembolaget_recommendation.get('alcohol_content', 'N/A')}
-        Pairing: {systembolaget_recommendation['pairing']}
-        Occasion: {systembolaget_recommendation['occasion']}
-        Category: {systembolaget_recommendation['category']}
-        Image Name: {systembolaget_recommendation.get('Image_name', 'N/A')}
-        Image Icon: {systembolaget_recommendation.get('Image_Icon', 'N/A')}
-        """)
-
-        # TextExpo drink recommendation details
-        drink_details = f"""
-            <strong>Main Drink Name:</strong> {main_recommendation['Style_Name']}<br>
-            <strong>Description:</strong> {main_recommendation['description']}<br>
-            <strong>Flavor Profile:</strong> {main_recommendation['flavor_profile']}<br>
-            <strong>Alcohol Content:</strong> {main_recommendation.get('alcohol_content', 'N/A')}<br>
-            <strong>Pairing:</strong> {main_recommendation['pairing']}<br>
-            <strong>Occasion:</strong> {main_recommendation['occasion']}<br>
-            <strong>Category:</strong> {main_recommendation['category']}<br>
-        """
-
-        systembolaget_drink_details = f"""
-            <strong>Systembolaget Drink Name:</strong> {systembolaget_recommendation['Style_Name']}<br>
-            <strong>Description:</strong> {systembolaget_recommendation['description']}<br>
-            <strong>Flavor Profile:</strong> {systembolaget_recommendation['flavor_profile']}<br>
-            <strong>Alcohol Content:</strong> {systembolaget_recommendation.get('alcohol_content', 'N/A')}<br>
-            <strong>Pairing:</strong> {systembolaget_recommendation['pairing']}<br>
-            <strong>Occasion:</strong> {systembolaget_recommendation['occasion']}<br>
-            <strong>Category:</strong> {systembolaget_recommendation['category']}<br>
-        """
+        main_recommendation, systembolaget_recommendation, error_response = resolve_final_recommendation(session_data)
+        if error_response:
+            return None, error_response
 
         # Generate GPT response based on the occasion
-        occasion_preference = session_data['user_responses'][-1]  # Last user response is the occasion
+        occasion_preference = session_data.user_responses[-1]  # Last user response is the occasion
 
         gpt_prompt = generate_gpt_prompt(main_recommendation, occasion_preference)
+        speculator.record_choice(occasion_preference)
 
+        return {
+            **step,
+            'answers': list(session_data.user_responses),
+            'drink': with_images(main_recommendation),  # Return the main drink recommendation
+            'systembolaget_drink': with_images(systembolaget_recommendation),  # Return the systembolaget recommendation
+            'kind': 'final',
+            'fallback': fallback_final_text(main_recommendation, occasion_preference),
+            'cache': final_response_cache,
+            'cache_key': gpt_prompt,
+            # Generate the final chatbot response using GPT based on user preferences and the recommended drink
+            'completion_request': final_completion_request(gpt_prompt),
+            'response': final_response_cache.get(gpt_prompt),
+            'speculation': speculator.collect(user_id, gpt_prompt),
+        }, None
 
+    # If there are still more questions, generate a fun GPT response based on the user's answer so far
+    prompt = generate_quip_prompt(question_index, canonical_quip_answer(question_index, answer, drink_type), drink_type)
+    pooled = prompt in QUIP_PROMPT_SET
+
+    if question_index == last_question_index - 1:
+        speculate_final_responses(session_data)
+
+    return {
+        **step,
+        'kind': 'quip',
+        'fallback': fallback_quip_text(question_index, answer),
+        'next_question': next_question_payload,
+        # Served from the pool when stocked; a live text for a pooled prompt is added to it
+        'cache': quip_pool if pooled else None,
+        'cache_key': prompt if pooled else None,
+        'completion_request': quip_completion_request(prompt),
+        'response': quip_pool.get(prompt) if pooled else None,
+        'speculation': None,
+    }, None
+
+
+def speculate_final_responses(session_data):
+    # The recommendation only depends on the first three answers; the occasion only changes the prompt
+    recommended_drinks = recommend_drinks(session_data.user_responses)
+    main_recommendation = recommended_drinks.get('main_recommendation')
+    if not main_recommendation or 'Style_Name' not in main_recommendation:
+        return
+    if openai_guard.breaker.state != 'closed':
+        return
+
+    for occasion in speculator.likely(questions_with_answers[3]['answers'], speculate_occasions):
+        gpt_prompt = generate_gpt_prompt(main_recommendation, occasion)
+        if final_response_cache.has(gpt_prompt):
+            continue
+        speculator.submit(session_data.user_id, gpt_prompt,
+                          lambda request=final_completion_request(gpt_prompt): create_completion('speculation', request))
+
+
+def complete_answer(pending):
+    # GPT text for a pending answer: cached, speculated ahead of time, or generated now.
+    # Takes at most OPENAI_DEADLINE seconds, after which the templated fallback is used.
+    if pending['response'] is not None:
+        return pending['response']
+    started = time.monotonic()
+    if pending['speculation'] is not None:
+        gpt_response = speculator.result(pending['speculation'], timeout=OPENAI_DEADLINE)
+        if gpt_response is not None:
+            pending['source'] = 'speculation'
+            return gpt_response
+
+    remaining = OPENAI_DEADLINE - (time.monotonic() - started)
+    if remaining > 0:
+        leader, flight = join_flight(pending)
+        if not leader:
+            ok, result = wait_for_flight(flight, remaining)
+        else:
+            outcome = (False, 'error')
+            try:
+                outcome = call_openai(pending, started)
+            finally:
+                if flight is not None:
+                    single_flight.finish(pending['flight_key'], flight, outcome)
+            ok, result = outcome
+        if ok:
+            return result
+    return use_fallback(pending)
+
+
+def call_openai(pending, started):
+    # The live GPT call of complete_answer, once the gate has a slot: (ok, text or reason)
+    remaining = OPENAI_DEADLINE - (time.monotonic() - started)
+    admitted, reason = openai_gate.acquire(timeout=min(remaining, OPENAI_QUEUE_TIMEOUT))
+    if not admitted:
+        shed.inc(reason)
+        return False, reason
+    try:
+        return openai_guard.call(pending['kind'], lambda: create_completion(pending['kind'], pending['completion_request']),
+                                 deadline=OPENAI_DEADLINE - (time.monotonic() - started))
+    finally:
+        openai_gate.release()
+
+
+def join_flight(pending):
+    # (True, None) when the answer makes its own GPT call, (True, flight) when it makes one that
+    # identical prompts may share and must finish the flight, (False, flight) when such a call is
+    # already in flight and its (ok, text or reason) is to be waited for
+    if pending['kind'] not in COALESCE_KINDS:
+        return True, None
+    pending['flight_key'] = json.dumps(pending['completion_request'], sort_keys=True)
+    leader, flight = single_flight.join(pending['kind'], pending['flight_key'])
+    if not leader:
+        # The leader's answer already caches the text
+        pending['coalesced'] = True
+        pending['source'] = 'coalesced'
+        coalesced.inc(pending['kind'])
+    return leader, flight
+
+
+def wait_for_flight(flight, timeout):
+    try:
+        return flight.result(timeout=timeout)
+    except TimeoutError:
+        return False, 'timeout'
 
-        # Generate the final chatbot response using GPT based on user preferences and the recommended drink
-        chat_completion = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a professional friendly and fun bartender who loves recommending drinks."},
-                {"role": "user", "content": gpt_prompt}
-            ],
-            temperature=0.7,
-            max_tokens=300
-        )
 
-        gpt_response = chat_completion.choices[0].message.content
+def use_fallback(pending):
+    pending['degraded'] = True
+    pending['source'] = 'fallback'
+    fallbacks.inc(pending['kind'])
+    return pending['fallback']
 
-        # Combine the GPT response with the full drink recommendation
 
-        #full_response = f"{gpt_response}<br><br>Here are the full details of the recommended drink:<br>{drink_details}<br>{systembolaget_drink_details}"
+def finish_answer(pending, gpt_response):
+    # Templated fallbacks are never cached
+    if pending['response'] is None and pending['cache_key'] and not pending.get('degraded') and not pending.get('coalesced'):
+        pending['cache'].put(pending['cache_key'], gpt_response)
+    if analytics:
+        analytics.record(answer_record(pending))
 
-        full_response = f"{gpt_response}"
-        #full_response = f"{gpt_response}<br><br><br>{drink_details}<br>{systembolaget_drink_details}"
+    if 'drink' not in pending:
+        if pending['next_question'] is not None:
+            return {'response': gpt_response, 'next_question': pending['next_question']}
+        return {'response': gpt_response}
 
-        # Return the GPT response along with the full drink recommendation details
-        return jsonify({
-            'drink': main_recommendation,  # Return the main drink recommendation
-            'systembolaget_drink': systembolaget_recommendation,  # Return the systembolaget recommendation
-            'response': full_response  # Include GPT-generated message and drink details
-        }), 200
+    # Combine the GPT response with the full drink recommendation
 
+    full_response = f"{gpt_response}"
 
-    # If there are still more questions, generate a fun GPT response based on the user's answer so far
-    if question_index == 0:
-        prompt = f"Be a cheeky sarcastic intelligent bartender and respond to the user's {answer} drink preference. Make it fun and intelligent! Don't provide a recommendation yet. no more than two lines of response"
-    elif question_index == 1:
-        prompt = f"The user prefers flavor profile {answer}. Give a sarcastic and naugthy response. but don't provide a recommendation yet. no more than two lines of response"
-    elif question_index == 2:
-        if drink_type == "beer":
-            prompt = f"The user prefers a beer with {answer} alcohol content. Give a sarcastic response but don't provide a recommendation yet. Don't ask any further questions.  no more than two lines of response"
-        elif drink_type in ["red wine", "white wine"]:
-            prompt = f"The user selected wine, and they prefer {answer} wine. Be charming and fun but don't recommend a specific drink yet. Don't ask any further questions.  no more than two lines of response"
-#    elif question_index == 3:
-#        prompt = f"The user prefers to drink at {answer}. Respond with a witty and engaging comment!"
+    # Return the GPT response along with the full drink recommendation details
+    return {
+        'drink': pending['drink'],
+        'systembolaget_drink': pending['systembolaget_drink'],
+        'response': full_response  # Include GPT-generated message and drink details
+    }
 
-    # Generate GPT response for non-final questions
-    chat_completion = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {"role": "system", "content": "You are a friendly bartender."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.7,
-        max_tokens=100
-    )
-    gpt_response = chat_completion.choices[0].message.content
 
-    return jsonify({'response': gpt_response})
+def answer_record(pending):
+    record = {
+        't': round(time.time(), 3),
+        'e': 'answer',
+        's': pending['user_id'],
+        'i': pending['step'],
+        'a': pending['answer'],
+        'ms': round((time.perf_counter() - pending['started']) * 1000, 1),
+        'src': pending.get('source') or ('cache' if pending['response'] is not None else 'live'),
+    }
+    if 'drink' in pending:
+        record.update(answers=pending['answers'], drink=pending['drink'].get('Style_Name'),
+                      sb_drink=pending['systembolaget_drink'].get('Style_Name'))
+    return record
+
+
+@app.route('/api/answer', methods=['POST'])
+def post_answer():
+    pending, error_response = begin_answer(request.json)
+    if error_response:
+        payload, status = error_response
+        return jsonify(payload), status
+
+    return jsonify(finish_answer(pending, complete_answer(pending))), 200
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+# Streaming variant of /api/answer: same session handling, but the response is a
+# text/event-stream. On the last question the drink recommendation is sent first as a
+# "recommendation" event (with `with_question`, earlier steps send the next question as a
+# "question" event), then GPT text arrives as "token" events and ends with "done".
+@app.route('/api/answer/stream', methods=['POST'])
+def post_answer_stream():
+    pending, error_response = begin_answer(request.json)
+    if error_response:
+        payload, status = error_response
+        return jsonify(payload), status
+
+    def events():
+        if 'drink' in pending:
+            yield sse_event('recommendation', {'drink': pending['drink'], 'systembolaget_drink': pending['systembolaget_drink']})
+        elif pending['next_question'] is not None:
+            # The next question can be shown right away, the quip follows as tokens
+            yield sse_event('question', pending['next_question'])
+
+        if pending['response'] is not None or pending['speculation'] is not None:
+            gpt_response = complete_answer(pending)
+            yield sse_event('token', {'text': gpt_response})
+            yield sse_event('done', finish_answer(pending, gpt_response))
+            return
+
+        parts = []
+        leader, flight = join_flight(pending)
+        if not leader:
+            # An identical prompt is being answered; its text arrives as one token
+            ok, result = wait_for_flight(flight, OPENAI_DEADLINE)
+            if ok:
+                parts.append(result)
+                yield sse_event('token', {'text': result})
+        else:
+            outcome = None
+            try:
+                # The slot is held until the last token
+                admitted, reason = openai_gate.acquire(timeout=OPENAI_QUEUE_TIMEOUT)
+                if not admitted:
+                    shed.inc(reason)
+                elif not openai_guard.breaker.allow():
+                    openai_gate.release()
+                else:
+                    started = time.perf_counter()
+                    usage = None
+                    try:
+                        # The client timeout bounds the wait for every chunk, the first one included.
+                        # With include_usage the last chunk carries the token counts and no choices.
+                        for chunk in client.chat.completions.create(stream=True, stream_options={'include_usage': True}, **pending['completion_request']):
+                            usage = chunk.usage or usage
+                            text = chunk.choices[0].delta.content if chunk.choices else None
+                            if text:
+                                parts.append(text)
+                                yield sse_event('token', {'text': text})
+                        outcome = 'ok'
+                    except Exception as e:
+                        outcome = 'error'
+                        errors.inc('openai', type(e).__name__)
+                        logging.error("Error streaming GPT response: %s", e)
+                        if parts:
+                            yield sse_event('error', {'error': 'There was an issue generating the response.'})
+                            return
+                    finally:
+                        openai_gate.release()
+                        # Also settles the breaker when the client goes away mid-stream (outcome None)
+                        if outcome == 'error' or (outcome is None and not parts):
+                            openai_guard.breaker.record_failure()
+                        else:
+                            openai_guard.breaker.record_success()
+                    if outcome == 'ok':
+                        record_completion(pending['kind'], started, usage)
+            finally:
+                if flight is not None:
+                    single_flight.finish(pending['flight_key'], flight, (outcome == 'ok', ''.join(parts)))
+
+        if not parts:
+            fallback = use_fallback(pending)
+            parts.append(fallback)
+            yield sse_event('token', {'text': fallback})
+
+        yield sse_event('done', finish_answer(pending, ''.join(parts)))
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # Tell nginx to pass events through without buffering
+    })
+
 
 def filter_by_category(drinks, category_preference):
     try:
         filtered = [drink for drink in drinks if drink['category'].lower() == category_preference.lower()]
         if not filtered:
-            logging.error(f"No drinks found for category: {category_preference}")
+            logging.error("No drinks found for category: %s", category_preference)
         return filtered
     except Exception as e:
-        logging.error(f"Error filtering by category: {e}")
+        logging.error("Error filtering by category: %s", e)
         return []
 
 
-def recommend_drinks(user_responses):
+@recommend_seconds.timed()
+def recommend_drinks(user_responses, snapshot=None, memo=None):
     try:
         category_preference = user_responses[0].lower().strip()
-        logging.debug(f"User's category preference: {category_preference}")
+        logging.debug("User's category preference: %s", category_preference)
+
+        snapshot = snapshot or catalog
+        main_drinks_engine = snapshot.main_drinks_engine
+        system_bolaget_engine = snapshot.system_bolaget_engine
 
-        # Filter the drinks by the chosen category for both dictionaries
-        drinks_from_main = filter_by_category(main_drinks, category_preference)
-        drinks_from_systembolaget = filter_by_category(system_bolaget_dictionary, category_preference)
+        # Look up the chosen category in the prebuilt indexes for both dictionaries
+        in_main = main_drinks_engine.has_category(category_preference)
+        in_systembolaget = system_bolaget_engine.has_category(category_preference)
+        if not in_main:
+            logging.error("No drinks found for category: %s", category_preference)
+        if not in_systembolaget:
+            logging.error("No drinks found for category: %s", category_preference)
 
-        if not drinks_from_main and not drinks_from_systembolaget:
+        if not in_main and not in_systembolaget:
             return {"error": f"No drinks found in category '{category_preference}'."}
 
         # Determine if the user selected beer or wine
         if category_preference == "beer":
-            main_recommendation = recommend_beer(drinks_from_main, user_responses) if drinks_from_main else None
-            systembolaget_recommendation = recommend_beer(drinks_from_systembolaget, user_responses) if drinks_from_systembolaget else None
+            main_recommendation = main_drinks_engine.recommend_beer(category_preference, user_responses, memo, SEMANTIC_MATCHING) if in_main else None
+            systembolaget_recommendation = system_bolaget_engine.recommend_beer(category_preference, user_responses, memo, SEMANTIC_MATCHING) if in_systembolaget else None
         elif category_preference in ["red wine", "white wine"]:
-            main_recommendation = recommend_wine(drinks_from_main, user_responses) if drinks_from_main else None
-            systembolaget_recommendation = recommend_wine(drinks_from_systembolaget, user_responses) if drinks_from_systembolaget else None
+            main_recommendation = main_drinks_engine.recommend_wine(category_preference, user_responses, memo, SEMANTIC_MATCHING) if in_main else None
+            systembolaget_recommendation = system_bolaget_engine.recommend_wine(category_preference, user_responses, memo, SEMANTIC_MATCHING) if in_systembolaget else None
         else:
             return {"error": "Invalid category preference. Only beer, red wine, and white wine are supported."}
 
@@ -486,10 +1180,51 @@ def recommend_drinks(user_responses):
             'systembolaget_recommendation': systembolaget_recommendation,
         }
     except Exception as e:
-        logging.error(f"Error in recommend_drink: {e}")
+        logging.error("Error in recommend_drink: %s", e)
         return {"error": "There was an issue with your request."}
 
 
+def recommend_drinks_batch(answer_tuples):
+    """
+    Recommendations for many complete answer tuples (drink type, flavors, level, occasion)
+    without sessions or GPT. Every tuple is ranked against the same catalog snapshot, and
+    tuples in the same category and level bucket share their flavor match vectors.
+    """
+    snapshot = catalog
+    memo = {}
+    return [recommend_drinks(list(answers), snapshot, memo) for answers in answer_tuples]
+
+
+def all_answer_tuples():
+    # The whole answer space of the questionnaire, e.g. to precompute recommendations for an event
+    required_flavors = questions_with_answers[1]['requiredSelections']
+    for drink_type in questions_with_answers[0]['answers']:
+        for flavors in itertools.combinations(FLAVOR_ANSWERS[drink_type.lower()], required_flavors):
+            for level in LEVEL_ANSWERS[drink_type.lower()]:
+                for occasion in questions_with_answers[3]['answers']:
+                    yield (drink_type, ', '.join(flavors), level, occasion)
+
+
+# Linear-scan reference implementation of recommend_drinks (MATCHING=exact), kept for comparing against the index
+def recommend_drinks_linear(user_responses):
+    category_preference = user_responses[0].lower().strip()
+    snapshot = catalog
+    drinks_from_main = filter_by_category(snapshot.main_drinks, category_preference)
+    drinks_from_systembolaget = filter_by_category(snapshot.system_bolaget_dictionary, category_preference)
+
+    if category_preference == "beer":
+        recommend = recommend_beer
+    elif category_preference in ["red wine", "white wine"]:
+        recommend = recommend_wine
+    else:
+        return {"error": "Invalid category preference. Only beer, red wine, and white wine are supported."}
+
+    return {
+        'main_recommendation': recommend(drinks_from_main, user_responses) if drinks_from_main else None,
+        'systembolaget_recommendation': recommend(drinks_from_systembolaget, user_responses) if drinks_from_systembolaget else None,
+    }
+
+
 
 # Scoring based on flavor match for beer
 def score_beer(drink, flavor_preferences):
@@ -504,11 +1239,11 @@ def recommend_beer(drinks, user_responses):
         flavor_preferences = [flavor.lower().strip() for flavor in user_responses[1].split(',')]
         alcohol_level = str(user_responses[2]).lower().strip()
 
-        logging.debug(f"Beer flavor preferences: {flavor_preferences}, alcohol level: {alcohol_level}")
+        logging.debug("Beer flavor preferences: %s, alcohol level: %s", flavor_preferences, alcohol_level)
 
         # Treat "low" as "medium"
         if alcohol_level == "low":
-            logging.info(f"User selected 'low', defaulting to 'medium'")
+            logging.info("User selected 'low', defaulting to 'medium'")
             alcohol_level = "medium"
 
         # Filter by alcohol level, adding support for 'non-alcoholic' as level "0"
@@ -520,12 +1255,12 @@ def recommend_beer(drinks, user_responses):
             # Match beers with level "0" or alcohol_content == 0.0
             filtered_by_alcohol = [drink for drink in drinks if str(drink.get('level', '')).lower() == "0" or drink.get('alcohol_content') == 0.0]
         else:
-            logging.error(f"Invalid alcohol level: {alcohol_level}")
+            logging.error("Invalid alcohol level: %s", alcohol_level)
             return {"error": "Invalid alcohol level selected."}
 
         # Check if any drinks matched the alcohol level filter
         if not filtered_by_alcohol:
-            logging.info(f"No beers found with alcohol level: {alcohol_level}")
+            logging.info("No beers found with alcohol level: %s", alcohol_level)
             return {"error": f"No beers found with alcohol level '{alcohol_level}'."}
 
         # Score and filter by flavor
@@ -538,12 +1273,12 @@ def recommend_beer(drinks, user_responses):
         if scored_beers and scored_beers[0][0] > 0:
             return scored_beers[0][1]  # Return the beer with the highest score
         else:
-            logging.info(f"No exact beer match found for flavors: {flavor_preferences}")
+            logging.info("No exact beer match found for flavors: %s", flavor_preferences)
             # Return the first beer matching alcohol level if no exact flavor match is found
             return filtered_by_alcohol[0] if filtered_by_alcohol else {"error": "No beers found."}
 
     except Exception as e:
-        logging.error(f"Error in recommend_beer: {e}")
+        logging.error("Error in recommend_beer: %s", e)
         return {"error": "There was an issue with your beer recommendation."}
 
 
@@ -556,7 +1291,7 @@ def score_wine(drink, flavor_preferences, occasion_preference):
     flavor_profile = drink.get('flavor_profile', '').lower()
     
     if not flavor_profile:
-        logging.error(f"Missing 'flavor_profile' for drink: {drink.get('Style_Name', 'Unknown')}")
+        logging.error("Missing 'flavor_profile' for drink: %s", drink.get('Style_Name', 'Unknown'))
     
     flavor_score = sum(1 for flavor in flavor_preferences if flavor in flavor_profile)
     occasion_match = occasion_preference in drink.get('occasion', '').lower()
@@ -570,7 +1305,7 @@ def recommend_wine(drinks, user_responses):
         flavor_preferences = [flavor.lower().strip() for flavor in user_responses[1].split(',')]
         occasion_preference = user_responses[2].lower().strip()
 
-        logging.debug(f"Wine flavor preferences: {flavor_preferences}, occasion: {occasion_preference}")
+        logging.debug("Wine flavor preferences: %s, occasion: %s", flavor_preferences, occasion_preference)
 
         # Directly return McGuigan Estate Chardonnay if white wine is selected
         for drink in drinks:
@@ -589,36 +1324,265 @@ def recommend_wine(drinks, user_responses):
         # Sort wines by flavor match (higher score) and then occasion match
         scored_wines.sort(key=lambda x: (x[0][0], x[0][1]), reverse=True)
 
-        # Log the filtered and sorted results
-        logging.debug(f"Sorted wine recommendations: {[drink['Style_Name'] for _, drink in scored_wines]}")
+        # Log the filtered and sorted results (the name list is only built when debug logs are on)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("Sorted wine recommendations: %s", [drink['Style_Name'] for _, drink in scored_wines])
 
         # Return the top match (best flavor and occasion match)
         if scored_wines:
             return scored_wines[0][1]
         else:
-            logging.info(f"No exact wine match found for flavors: {flavor_preferences}")
+            logging.info("No exact wine match found for flavors: %s", flavor_preferences)
             return drinks[0]  # Fallback: return first wine if no exact match
 
     except Exception as e:
-        logging.error(f"Error in recommend_wine: {e}")
+        logging.error("Error in recommend_wine: %s", e)
         return {"error": "There was an issue with your wine recommendation."}
 
 
+def batch_answer_tuples(items):
+    # Accepts [drink type, flavors, level, occasion] lists or objects with those keys;
+    # flavors may be a list or an already joined "Fruity, Malty" string
+    answer_tuples = []
+    for item in items:
+        if isinstance(item, dict):
+            item = [item.get('drink_type'), item.get('flavors'), item.get('level'), item.get('occasion')]
+        if not isinstance(item, (list, tuple)) or len(item) != 4:
+            raise ValueError("Every entry needs a drink type, flavors, level and occasion.")
+        drink_type, flavors, level, occasion = item
+        if isinstance(flavors, list):
+            flavors = ', '.join(flavors)
+        if not all(isinstance(value, str) for value in (drink_type, flavors, level, occasion)):
+            raise ValueError("Answers must be strings.")
+        answer_tuples.append((drink_type, flavors, level, occasion))
+    return answer_tuples
+
+
+# The endpoint is public: a batch scoring free-text flavors holds a worker for a while, so
+# batches are small (the whole questionnaire space takes a few of them) and rate limited
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "500"))
+
+
+def recommend_batch(request_data):
+    items = (request_data or {}).get('answers')
+    if not isinstance(items, list):
+        return {'error': "Expected a list of answer tuples in 'answers'."}, 400
+    if len(items) > MAX_BATCH_SIZE:
+        return {'error': f"At most {MAX_BATCH_SIZE} answer tuples per request."}, 400
+    try:
+        answer_tuples = batch_answer_tuples(items)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    return {'results': recommend_drinks_batch(answer_tuples)}, 200
+
+
+@app.route('/api/recommend/batch', methods=['POST'])
+def post_recommend_batch():
+    payload, status = recommend_batch(request.json)
+    return jsonify(payload), status
+
+
+@app.route('/api/cache-stats', methods=['GET'])
+def cache_stats():
+    return jsonify(final_response_cache.stats()), 200
+
+
+@app.route('/api/session-stats', methods=['GET'])
+def session_stats():
+    return jsonify(user_sessions.stats()), 200
+
+
+@app.route('/api/speculation-stats', methods=['GET'])
+def speculation_stats():
+    return jsonify(speculator.stats()), 200
+
+
+@app.route('/api/catalog-stats', methods=['GET'])
+def catalog_stats():
+    return jsonify(catalog_reloader.stats()), 200
+
+@app.route('/api/openai-stats', methods=['GET'])
+def openai_stats():
+    return jsonify({**openai_guard.stats(), 'coalescing': single_flight.stats()}), 200
+
+def admission_stats_payload():
+    return {
+        'openai_gate': openai_gate.stats(),
+        'ip_limiter': ip_limiter.stats(),
+        'session_limiter': session_limiter.stats(),
+    }
+
+@app.route('/api/admission-stats', methods=['GET'])
+def admission_stats():
+    return jsonify(admission_stats_payload()), 200
+
+@app.route('/api/quip-stats', methods=['GET'])
+def quip_stats():
+    return jsonify(quip_warmer.stats()), 200
+
+@app.route('/api/analytics-stats', methods=['GET'])
+def analytics_stats():
+    return jsonify(analytics.stats() if analytics else {'enabled': False}), 200
+
+def profile_stats_payload():
+    return {
+        'sampler': stack_sampler.stats() if stack_sampler else {'sampling': False},
+        'request_profiles': request_profiles.list(),
+    }
+
+def profile_report(profile_id, args):
+    # (pstats text, status) of a saved request profile, ?sort= one of PROFILE_SORTS
+    sort = args.get('sort', 'cumulative')
+    if sort not in PROFILE_SORTS:
+        return f"sort must be one of {', '.join(PROFILE_SORTS)}\n", 400
+    report = request_profiles.report(profile_id, sort=sort, limit=args.get('limit', 40, type=int))
+    if report is None:
+        return "No such profile\n", 404
+    return report, 200
+
+@app.route('/api/profile-stats', methods=['GET'])
+def profile_stats():
+    if not is_admin(request.headers):
+        return jsonify(ADMIN_ONLY), 403
+    return jsonify(profile_stats_payload()), 200
+
+@app.route('/api/profile/stacks', methods=['GET'])
+def profile_stacks():
+    # Collapsed stacks for flame graph tools; ?match= keeps the stacks containing it, ?reset=1 starts over
+    if not is_admin(request.headers):
+        return jsonify(ADMIN_ONLY), 403
+    if stack_sampler is None:
+        return jsonify({'error': 'The sampling profiler is off (PROFILE_SAMPLE_HZ=0)'}), 404
+    stacks = stack_sampler.collapsed(request.args.get('match'))
+    if request.args.get('reset') == '1':
+        stack_sampler.reset()
+    return Response(stacks, content_type='text/plain; charset=utf-8')
+
+@app.route('/api/profile/requests/<profile_id>', methods=['GET'])
+def request_profile(profile_id):
+    # The profile's top functions as text, or with ?format=pstats the file itself (for snakeviz and co.)
+    if not is_admin(request.headers):
+        return jsonify(ADMIN_ONLY), 403
+    if request.args.get('format') == 'pstats':
+        path = request_profiles.path(profile_id)
+        if path is None:
+            return jsonify({'error': 'No such profile'}), 404
+        return send_file(path, mimetype='application/octet-stream', as_attachment=True)
+    report, status = profile_report(profile_id, request.args)
+    return Response(report, status=status, content_type='text/plain; charset=utf-8')
+
+@app.route('/api/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/ready', methods=['GET'])
+def ready():
+    # For load balancers and deploy scripts: 200 once this process has warmed up
+    payload, status = readiness_status()
+    return jsonify(payload), status
+
+
+def reset_answers(user_data):
+    user_id = user_data.get('user_id')
+
+    session_data = get_session(user_id)
+    if session_data is None:
+        return {'error': 'Invalid session or user_id'}, 400
+
+    if analytics and session_data.user_responses:
+        analytics.record({'t': round(time.time(), 3), 'e': 'reset', 's': user_id, 'answers': list(session_data.user_responses)})
+
+    # Clear the user responses and question index when resetting
+    session_data.reset()
+    speculator.cancel(user_id)
+    user_sessions.save(session_data)
+    return {'status': 'Session reset successfully!'}, 200
+
 @app.route('/api/reset', methods=['POST'])
 def reset_session():
-    user_data = request.json
-    user_id = user_data.get('user_id')
+    payload, status = reset_answers(request.json)
+    return jsonify(payload), status
+
 
-    if not user_id or user_id not in user_sessions:
-        return jsonify({'error': 'Invalid session or user_id'}), 400
 
-    # Clear the user responses when resetting
-    user_sessions[user_id]['question_index'] = 0  # Reset the user's question index
-    user_sessions[user_id]['user_responses'] = []  # Clear previous responses
-    return jsonify({'status': 'Session reset successfully!'}), 200
 
+# Background threads and warm-up. The prefork server (gunicorn.conf.py) imports this module
+# once in its master and forks the workers from it; threads don't survive fork, so there
+# they are started by after_fork() in every worker instead of here.
+readiness = {'warmed_up': False, 'sessions': None, 'openai': None, 'warm_up_seconds': None}
 
 
+def warm_up():
+    # Pays up front for what the first requests would otherwise wait on: the scoring
+    # engines (and the pages of a memory-mapped catalog), the session backend and a
+    # connection to OpenAI. OpenAI being unreachable doesn't block readiness, answers
+    # fall back to templated texts then.
+    started = time.perf_counter()
+    recommend_drinks_batch([answers for number, answers in enumerate(all_answer_tuples()) if number % 50 == 0])
+    try:
+        user_sessions.count()
+        readiness['sessions'] = 'ok'
+    except Exception as e:
+        readiness['sessions'] = f"{type(e).__name__}: {e}"
+    try:
+        client.with_options(timeout=3.0).models.list()
+        readiness['openai'] = 'ok'
+    except APIStatusError as e:
+        # It answered, so the connection is open
+        readiness['openai'] = f"HTTP {e.status_code}"
+    except Exception as e:
+        readiness['openai'] = type(e).__name__
+    readiness['warm_up_seconds'] = round(time.perf_counter() - started, 3)
+    readiness['warmed_up'] = True
+    logging.info("Warmed up in %.3fs (sessions: %s, openai: %s)", readiness['warm_up_seconds'],
+                 readiness['sessions'], readiness['openai'])
+
+
+def readiness_status():
+    snapshot = catalog
+    payload = dict(readiness, pid=os.getpid(), main_drinks=len(snapshot.main_drinks),
+                   systembolaget_drinks=len(snapshot.system_bolaget_dictionary))
+    is_ready = (readiness['warmed_up'] and readiness['sessions'] == 'ok'
+                and payload['main_drinks'] > 0 and payload['systembolaget_drinks'] > 0)
+    payload['ready'] = is_ready
+    return payload, 200 if is_ready else 503
+
+
+def start_background_tasks():
+    catalog_reloader.start()
+    metrics.start()
+    if analytics:
+        analytics.start()
+    if stack_sampler:
+        stack_sampler.start()
+    if os.getenv("QUIP_POOL_WARM", "1") == "1":
+        quip_warmer.start()
+
+
+def after_fork():
+    """
+    Sets up a freshly forked worker of the prefork server. Only the forking thread
+    survives fork and SQLite connections can't be shared between processes, so the
+    worker opens its own connections and starts its own threads, then warms up before
+    it takes requests.
+    """
+    if log_pipeline:
+        log_pipeline.after_fork()
+    final_response_cache.reopen()
+    quip_pool.reopen()
+    user_sessions.after_fork()
+    metrics.after_fork()
+    if analytics:
+        analytics.after_fork()
+    if stack_sampler:
+        stack_sampler.after_fork()
+    warm_up()
+    start_background_tasks()
+
+
+if os.getenv("BARTENDER_PREFORK") != "1":
+    start_background_tasks()
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
 
 
 if __name__ == '__main__':
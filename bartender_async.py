@@ -0,0 +1,350 @@
+# Async serving mode for the bartender backend.
+#
+# Same routes and JSON contract as bartender.py, served by Quart on an event loop instead of
+# Flask worker threads, so users waiting on GPT cost a coroutine each rather than a thread.
+# Session handling, recommendations and prompts are the shared functions from bartender.py;
+# those that touch the session store, the GPT cache or the catalog scoring run in worker
+# threads (asyncio.to_thread), so a slow SQLite or Redis write doesn't stall the event loop.
+#
+#   hypercorn bartender_async:app --bind 0.0.0.0:5012
+#
+from quart import Quart, request, jsonify, Response, g, send_file
+from quart_cors import cors
+from openai import AsyncOpenAI
+import asyncio
+import os
+import logging
+import time
+
+import bartender
+
+app = Quart(__name__)
+app = cors(app, allow_origin="*", allow_credentials=False)
+
+# One client for the whole process: its HTTP connection pool is shared by every request
+async_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), timeout=bartender.OPENAI_DEADLINE, max_retries=0)
+
+
+# Same metrics as the Flask app; streamed responses are timed until their headers are sent
+@app.before_request
+async def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+async def record_request_metrics(response):
+    started = g.get('request_started')
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    if response.status_code >= 400:
+        bartender.errors.inc('http', str(response.status_code))
+    if started is not None:
+        bartender.request_seconds.observe(time.perf_counter() - started, request.method, route)
+    if request.path.endswith('-stats'):
+        response.headers['X-Worker-Pid'] = str(os.getpid())
+    return response
+
+@app.teardown_request
+async def record_request_exception(exception):
+    if exception is not None:
+        bartender.errors.inc('exception', type(exception).__name__)
+
+# A profiled request covers everything the event loop runs meanwhile, other requests'
+# coroutines included, and ends when its headers are sent
+@app.before_request
+async def profile_request():
+    g.profile = bartender.start_request_profile(request.method, request.path, request.headers)
+
+@app.after_request
+async def profile_response(response):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        bartender.finish_request_profile(profile)
+        response.headers['X-Profile-Id'] = profile[0]
+    elif request.headers.get('X-Profile') == '1' and bartender.is_admin(request.headers):
+        response.headers['X-Profile-Id'] = 'busy'
+    return response
+
+@app.teardown_request
+async def profile_teardown(exception):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        bartender.finish_request_profile(profile)
+
+@app.before_request
+async def admission_control():
+    if request.path not in bartender.ADMISSION_ROUTES:
+        return None
+    body = await request.get_json(silent=True) if request.method == 'POST' else None
+    user_id = body.get('user_id') if isinstance(body, dict) else None
+    rejected = bartender.admit(bartender.client_ip(request.remote_addr, request.headers), user_id)
+    if rejected:
+        payload, retry_after = rejected
+        return jsonify(payload), 429, bartender.rate_limited_headers(retry_after)
+
+
+@app.route('/api/start', methods=['GET'])
+async def start_session():
+    payload, status = await asyncio.to_thread(bartender.new_session)
+    return jsonify(payload), status
+
+@app.route('/api/toggle-speech', methods=['POST'])
+async def toggle_speech():
+    payload, status = await asyncio.to_thread(bartender.update_speech, await request.get_json())
+    return jsonify(payload), status
+
+def json_response(payload, status):
+    # Precompiled payloads are already serialized
+    if isinstance(payload, bytes):
+        return Response(payload, status=status, mimetype='application/json')
+    return jsonify(payload), status
+
+@app.route('/api/question', methods=['GET'])
+async def get_question():
+    return json_response(*await asyncio.to_thread(bartender.next_question, request.args.get('user_id')))
+
+@app.route('/api/questionnaire', methods=['GET'])
+async def get_questionnaire():
+    return json_response(*bartender.questionnaire(request.args.get('drink_type')))
+
+
+@app.route('/api/answer', methods=['POST'])
+async def post_answer():
+    pending, error_response = await asyncio.to_thread(bartender.begin_answer, await request.get_json())
+    if error_response:
+        payload, status = error_response
+        return jsonify(payload), status
+
+    gpt_response = await complete_answer(pending)
+    return jsonify(await asyncio.to_thread(bartender.finish_answer, pending, gpt_response)), 200
+
+
+async def create_completion(kind, completion_request):
+    # Async counterpart of bartender.create_completion
+    started = time.perf_counter()
+    try:
+        chat_completion = await async_client.chat.completions.create(**completion_request)
+    except Exception as e:
+        bartender.errors.inc('openai', type(e).__name__)
+        raise
+    bartender.record_completion(kind, started, chat_completion.usage)
+    return chat_completion.choices[0].message.content
+
+
+async def complete_answer(pending):
+    # Async counterpart of bartender.complete_answer, with the same time budget and fallback
+    if pending['response'] is not None:
+        return pending['response']
+    started = time.monotonic()
+    if pending['speculation'] is not None:
+        try:
+            gpt_response = await asyncio.wait_for(asyncio.wrap_future(pending['speculation']), bartender.OPENAI_DEADLINE)
+            pending['source'] = 'speculation'
+            return gpt_response
+        except Exception as e:
+            logging.error("Speculative GPT call failed: %r", e)
+
+    remaining = bartender.OPENAI_DEADLINE - (time.monotonic() - started)
+    if remaining > 0:
+        leader, flight = bartender.join_flight(pending)
+        if not leader:
+            ok, result = await wait_for_flight(flight, remaining)
+        else:
+            outcome = (False, 'error')
+            try:
+                outcome = await call_openai(pending, started)
+            finally:
+                if flight is not None:
+                    bartender.single_flight.finish(pending['flight_key'], flight, outcome)
+            ok, result = outcome
+        if ok:
+            return result
+    return bartender.use_fallback(pending)
+
+
+async def call_openai(pending, started):
+    remaining = bartender.OPENAI_DEADLINE - (time.monotonic() - started)
+    gate = bartender.openai_gate
+    admitted, reason = await gate.acquire_async(timeout=min(remaining, bartender.OPENAI_QUEUE_TIMEOUT))
+    if not admitted:
+        bartender.shed.inc(reason)
+        return False, reason
+    try:
+        return await bartender.openai_guard.call_async(
+            pending['kind'], lambda: create_completion(pending['kind'], pending['completion_request']),
+            deadline=bartender.OPENAI_DEADLINE - (time.monotonic() - started))
+    finally:
+        gate.release()
+
+
+async def wait_for_flight(flight, timeout):
+    # Shielded, so a follower giving up doesn't cancel the flight the others wait for
+    try:
+        return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(flight)), timeout)
+    except asyncio.TimeoutError:
+        return False, 'timeout'
+
+
+@app.route('/api/answer/stream', methods=['POST'])
+async def post_answer_stream():
+    pending, error_response = await asyncio.to_thread(bartender.begin_answer, await request.get_json())
+    if error_response:
+        payload, status = error_response
+        return jsonify(payload), status
+
+    async def events():
+        if 'drink' in pending:
+            yield bartender.sse_event('recommendation', {'drink': pending['drink'], 'systembolaget_drink': pending['systembolaget_drink']})
+        elif pending['next_question'] is not None:
+            yield bartender.sse_event('question', pending['next_question'])
+
+        if pending['response'] is not None or pending['speculation'] is not None:
+            gpt_response = await complete_answer(pending)
+            yield bartender.sse_event('token', {'text': gpt_response})
+            yield bartender.sse_event('done', await asyncio.to_thread(bartender.finish_answer, pending, gpt_response))
+            return
+
+        parts = []
+        leader, flight = bartender.join_flight(pending)
+        if not leader:
+            ok, result = await wait_for_flight(flight, bartender.OPENAI_DEADLINE)
+            if ok:
+                parts.append(result)
+                yield bartender.sse_event('token', {'text': result})
+        else:
+            outcome = None
+            try:
+                gate = bartender.openai_gate
+                breaker = bartender.openai_guard.breaker
+                admitted, reason = await gate.acquire_async(timeout=bartender.OPENAI_QUEUE_TIMEOUT)
+                if not admitted:
+                    bartender.shed.inc(reason)
+                elif not breaker.allow():
+                    gate.release()
+                else:
+                    started = time.perf_counter()
+                    usage = None
+                    try:
+                        async for chunk in await async_client.chat.completions.create(stream=True, stream_options={'include_usage': True}, **pending['completion_request']):
+                            usage = chunk.usage or usage
+                            text = chunk.choices[0].delta.content if chunk.choices else None
+                            if text:
+                                parts.append(text)
+                                yield bartender.sse_event('token', {'text': text})
+                        outcome = 'ok'
+                    except Exception as e:
+                        outcome = 'error'
+                        bartender.errors.inc('openai', type(e).__name__)
+                        logging.error("Error streaming GPT response: %s", e)
+                        if parts:
+                            yield bartender.sse_event('error', {'error': 'There was an issue generating the response.'})
+                            return
+                    finally:
+                        gate.release()
+                        if outcome == 'error' or (outcome is None and not parts):
+                            breaker.record_failure()
+                        else:
+                            breaker.record_success()
+                    if outcome == 'ok':
+                        bartender.record_completion(pending['kind'], started, usage)
+            finally:
+                if flight is not None:
+                    bartender.single_flight.finish(pending['flight_key'], flight, (outcome == 'ok', ''.join(parts)))
+
+        if not parts:
+            fallback = bartender.use_fallback(pending)
+            parts.append(fallback)
+            yield bartender.sse_event('token', {'text': fallback})
+
+        yield bartender.sse_event('done', await asyncio.to_thread(bartender.finish_answer, pending, ''.join(parts)))
+
+    return Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+
+@app.route('/api/recommend/batch', methods=['POST'])
+async def post_recommend_batch():
+    payload, status = await asyncio.to_thread(bartender.recommend_batch, await request.get_json())
+    return jsonify(payload), status
+
+
+@app.route('/api/cache-stats', methods=['GET'])
+async def cache_stats():
+    return jsonify(bartender.final_response_cache.stats()), 200
+
+@app.route('/api/session-stats', methods=['GET'])
+async def session_stats():
+    return jsonify(await asyncio.to_thread(bartender.user_sessions.stats)), 200
+
+@app.route('/api/speculation-stats', methods=['GET'])
+async def speculation_stats():
+    return jsonify(bartender.speculator.stats()), 200
+
+@app.route('/api/catalog-stats', methods=['GET'])
+async def catalog_stats():
+    return jsonify(bartender.catalog_reloader.stats()), 200
+
+@app.route('/api/openai-stats', methods=['GET'])
+async def openai_stats():
+    return jsonify({**bartender.openai_guard.stats(), 'coalescing': bartender.single_flight.stats()}), 200
+
+@app.route('/api/admission-stats', methods=['GET'])
+async def admission_stats():
+    return jsonify(bartender.admission_stats_payload()), 200
+
+@app.route('/api/quip-stats', methods=['GET'])
+async def quip_stats():
+    return jsonify(bartender.quip_warmer.stats()), 200
+
+@app.route('/api/ready', methods=['GET'])
+async def ready():
+    payload, status = bartender.readiness_status()
+    return jsonify(payload), status
+
+@app.route('/api/analytics-stats', methods=['GET'])
+async def analytics_stats():
+    analytics = bartender.analytics
+    return jsonify(analytics.stats() if analytics else {'enabled': False}), 200
+
+@app.route('/api/profile-stats', methods=['GET'])
+async def profile_stats():
+    if not bartender.is_admin(request.headers):
+        return jsonify(bartender.ADMIN_ONLY), 403
+    return jsonify(bartender.profile_stats_payload()), 200
+
+@app.route('/api/profile/stacks', methods=['GET'])
+async def profile_stacks():
+    if not bartender.is_admin(request.headers):
+        return jsonify(bartender.ADMIN_ONLY), 403
+    sampler = bartender.stack_sampler
+    if sampler is None:
+        return jsonify({'error': 'The sampling profiler is off (PROFILE_SAMPLE_HZ=0)'}), 404
+    stacks = sampler.collapsed(request.args.get('match'))
+    if request.args.get('reset') == '1':
+        sampler.reset()
+    return Response(stacks, content_type='text/plain; charset=utf-8')
+
+@app.route('/api/profile/requests/<profile_id>', methods=['GET'])
+async def request_profile(profile_id):
+    if not bartender.is_admin(request.headers):
+        return jsonify(bartender.ADMIN_ONLY), 403
+    if request.args.get('format') == 'pstats':
+        path = bartender.request_profiles.path(profile_id)
+        if path is None:
+            return jsonify({'error': 'No such profile'}), 404
+        return await send_file(path, mimetype='application/octet-stream', as_attachment=True)
+    report, status = bartender.profile_report(profile_id, request.args)
+    return Response(report, status=status, content_type='text/plain; charset=utf-8')
+
+@app.route('/api/metrics', methods=['GET'])
+async def prometheus_metrics():
+    return Response(bartender.metrics.render(), content_type=bartender.metrics.CONTENT_TYPE)
+
+@app.route('/api/reset', methods=['POST'])
+async def reset_session():
+    payload, status = await asyncio.to_thread(bartender.reset_answers, await request.get_json())
+    return jsonify(payload), status
+
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=5012)
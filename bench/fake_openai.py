@@ -0,0 +1,159 @@
+# Local stand-in for the OpenAI chat completions API, for benchmarking without network
+# access or token spend. Point the backend at it with OPENAI_BASE_URL=http://host:port/v1.
+#
+#   python bench/fake_openai.py --port 8099 --latency-ms 800 --latency-sigma 0.5 --tokens-per-second 60
+#
+# Time to first token is drawn from a log-normal distribution around --latency-ms, and the
+# completion is then produced at --tokens-per-second (streamed as SSE when stream=true).
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ("cheers", "hoppy", "crisp", "delight", "smooth", "bartender", "perfect", "pairing",
+         "refreshing", "toast", "cozy", "sunset", "malty", "fruity", "bold", "sip")
+
+
+class FakeOpenAI:
+    def __init__(self, latency_ms=800.0, latency_sigma=0.5, tokens_per_second=60.0, error_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def first_token_delay(self):
+        with self.lock:
+            self.requests += 1
+            return self.random.lognormvariate(0, self.latency_sigma) * self.latency_ms / 1000
+
+    def should_fail(self):
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def tokens(self, max_tokens):
+        with self.lock:
+            count = self.random.randint(max(1, max_tokens // 3), max(1, max_tokens // 2))
+            return [self.random.choice(WORDS) + ' ' for _ in range(count)]
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _json(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            # The backend lists the models once at startup to open its connection
+            if not self.path.endswith('/models'):
+                return self._json(404, {'error': {'message': f'Unknown path {self.path}'}})
+            return self._json(200, {'object': 'list', 'data': [
+                {'id': 'gpt-3.5-turbo', 'object': 'model', 'created': 0, 'owned_by': 'fake'}]})
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if not self.path.endswith('/chat/completions'):
+                return self._json(404, {'error': {'message': f'Unknown path {self.path}'}})
+
+            time.sleep(fake.first_token_delay())
+            if fake.should_fail():
+                return self._json(500, {'error': {'message': 'Injected failure', 'type': 'server_error'}})
+
+            tokens = fake.tokens(int(request.get('max_tokens') or 100))
+            completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+            model = request.get('model', 'gpt-3.5-turbo')
+            per_token = 1 / fake.tokens_per_second if fake.tokens_per_second > 0 else 0
+
+            if not request.get('stream'):
+                time.sleep(per_token * len(tokens))
+                return self._json(200, {
+                    'id': completion_id, 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                    'choices': [{'index': 0, 'finish_reason': 'stop',
+                                 'message': {'role': 'assistant', 'content': ''.join(tokens).strip()}}],
+                    'usage': {'prompt_tokens': 40, 'completion_tokens': len(tokens), 'total_tokens': 40 + len(tokens)},
+                })
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+
+            def send(data):
+                chunk = f"data: {data}\n\n".encode()
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                self.wfile.flush()
+
+            for token in tokens:
+                send(json.dumps({'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                                 'model': model, 'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]}))
+                time.sleep(per_token)
+            send(json.dumps({'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                             'model': model, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]}))
+            if (request.get('stream_options') or {}).get('include_usage'):
+                send(json.dumps({'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                                 'model': model, 'choices': [],
+                                 'usage': {'prompt_tokens': 40, 'completion_tokens': len(tokens), 'total_tokens': 40 + len(tokens)}}))
+            send('[DONE]')
+            self.wfile.write(b'0\r\n\r\n')
+
+    return Handler
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients hang up once they have read the [DONE] event, or when a speculation is dropped
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def start_server(fake, host='127.0.0.1', port=0):
+    # Starts the stand-in on a background thread; returns the server (server.server_port has the port)
+    server = FakeServer((host, port), make_handler(fake))
+    threading.Thread(target=server.serve_forever, name='fake-openai', daemon=True).start()
+    return server
+
+
+def add_arguments(parser):
+    parser.add_argument('--latency-ms', type=float, default=800.0, help="median time to first token (default: 800)")
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help="log-normal sigma of the latency (default: 0.5)")
+    parser.add_argument('--tokens-per-second', type=float, default=60.0, help="generation speed (default: 60)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of calls answered with HTTP 500")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI chat completions API.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(args.latency_ms, args.latency_sigma, args.tokens_per_second, args.error_rate)
+    server = start_server(fake, args.host, args.port)
+    print(f"Fake OpenAI listening on http://{args.host}:{server.server_port}/v1")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
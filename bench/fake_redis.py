@@ -0,0 +1,161 @@
+# Local stand-in for Redis, for running the redis session backend (sessions.py) without a
+# Redis server. Speaks RESP2 and knows just the commands RedisSessionStore sends, with key
+# expiry; everything is kept in memory.
+#
+#   python bench/fake_redis.py --port 6399
+#   SESSION_BACKEND=redis SESSION_REDIS_URL=redis://127.0.0.1:6399/1 python bartender.py
+import argparse
+import socketserver
+import threading
+import time
+
+
+def _encode(value):
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, list):
+        return b'*%d\r\n' % len(value) + b''.join(_encode(item) for item in value)
+    value = value.encode() if isinstance(value, str) else value
+    return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+class FakeRedis:
+    """Databases of {key: (value, expires at or None)}, shared by every connection."""
+
+    def __init__(self):
+        self.databases = {}
+        self.lock = threading.Lock()
+        self.commands = 0
+
+    def _live(self, db, key, now):
+        entry = db.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= now:
+            del db[key]
+            return None
+        return entry
+
+    def execute(self, number, args):
+        # Returns (reply, database number for the connection from now on)
+        command = args[0].decode().upper()
+        now = time.time()
+        with self.lock:
+            self.commands += 1
+            db = self.databases.setdefault(number, {})
+            if command == 'SELECT':
+                return b'+OK\r\n', int(args[1])
+            if command == 'PING':
+                return b'+PONG\r\n', number
+            if command == 'SET':
+                expires = None
+                options = [arg.decode().upper() for arg in args[3:]]
+                if 'EX' in options:
+                    expires = now + int(options[options.index('EX') + 1])
+                db[args[1]] = (args[2], expires)
+                return b'+OK\r\n', number
+            if command == 'GET':
+                entry = self._live(db, args[1], now)
+                return _encode(entry and entry[0]), number
+            if command == 'MGET':
+                return _encode([(self._live(db, key, now) or (None,))[0] for key in args[1:]]), number
+            if command == 'EXPIRE':
+                entry = self._live(db, args[1], now)
+                if entry is None:
+                    return _encode(0), number
+                db[args[1]] = (entry[0], now + int(args[2]))
+                return _encode(1), number
+            if command == 'ZADD':
+                # Sorted sets are {member: score} values; of the options only XX is known
+                options = []
+                index = 2
+                while args[index].decode().upper() in ('XX', 'NX', 'GT', 'LT', 'CH'):
+                    options.append(args[index].decode().upper())
+                    index += 1
+                entry = self._live(db, args[1], now)
+                scores = entry[0] if entry is not None else {}
+                added = 0
+                for score, member in zip(args[index::2], args[index + 1::2]):
+                    if member in scores or 'XX' not in options:
+                        added += member not in scores
+                        scores[member] = float(score)
+                if scores:
+                    db[args[1]] = (scores, entry[1] if entry is not None else None)
+                return _encode(added), number
+            if command == 'ZREMRANGEBYSCORE':
+                entry = self._live(db, args[1], now)
+                if entry is None:
+                    return _encode(0), number
+                low, high = float(args[2]), float(args[3])
+                removed = [member for member, score in entry[0].items() if low <= score <= high]
+                for member in removed:
+                    del entry[0][member]
+                if not entry[0]:
+                    del db[args[1]]
+                return _encode(len(removed)), number
+            if command == 'ZREM':
+                entry = self._live(db, args[1], now)
+                if entry is None:
+                    return _encode(0), number
+                removed = [member for member in args[2:] if entry[0].pop(member, None) is not None]
+                if not entry[0]:
+                    del db[args[1]]
+                return _encode(len(removed)), number
+            if command == 'ZCARD':
+                entry = self._live(db, args[1], now)
+                return _encode(len(entry[0]) if entry is not None else 0), number
+            if command == 'DBSIZE':
+                return _encode(sum(1 for key in list(db) if self._live(db, key, now))), number
+            return b'-ERR unknown command \'%s\'\r\n' % command.encode(), number
+
+
+def make_handler(fake):
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            number = 0
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                if not line.startswith(b'*'):
+                    self.wfile.write(b'-ERR expected an array of bulk strings\r\n')
+                    return
+                args = []
+                for _ in range(int(line[1:-2])):
+                    length = int(self.rfile.readline()[1:-2])
+                    args.append(self.rfile.read(length + 2)[:-2])
+                reply, number = fake.execute(number, args)
+                self.wfile.write(reply)
+
+    return Handler
+
+
+class FakeServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start_server(fake, host='127.0.0.1', port=0):
+    # Starts the stand-in on a background thread; returns the server (server.server_address[1] has the port)
+    server = FakeServer((host, port), make_handler(fake))
+    threading.Thread(target=server.serve_forever, name='fake-redis', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for Redis, enough for the redis session backend.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6399)
+    args = parser.parse_args()
+
+    server = start_server(FakeRedis(), args.host, args.port)
+    print(f"Fake Redis listening on redis://{args.host}:{server.server_address[1]}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+# End-to-end load test: starts the backend against bench/fake_openai.py and replays full
+# session flows (/api/start, the /api/question + /api/answer loop, /api/reset) from
+# --concurrency simulated users, then reports throughput and p50/p95/p99 latency per
+# endpoint and per question step.
+#
+#   python bench/load_test.py --sessions 200 --concurrency 20 --latency-ms 800 --tokens-per-second 60
+#   python bench/load_test.py --server hypercorn          # the async app in bartender_async.py
+#   python bench/load_test.py --url http://127.0.0.1:5012 # an already running backend
+#
+# Without --url the backend runs with a throwaway GPT cache and in-memory sessions, and
+# reads the drinks dictionaries from the repository root.
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from fake_openai import FakeOpenAI, add_arguments, start_server
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return float('nan')
+    rank = max(1, int(round(fraction * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(values):
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values) if values else float('nan'),
+        'p50': percentile(values, 0.50),
+        'p95': percentile(values, 0.95),
+        'p99': percentile(values, 0.99),
+        'max': values[-1] if values else float('nan'),
+    }
+
+
+def print_table(title, rows):
+    # rows: {label: summary in seconds}
+    print(f"\n{title}")
+    print(f"  {'':<28}{'count':>8}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for label, summary in rows.items():
+        print(f"  {label:<28}{summary['count']:>8}" + ''.join(
+            f"{summary[key] * 1000:>10.1f}" for key in ('mean', 'p50', 'p95', 'p99', 'max')))
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = {}   # label -> [seconds]
+        self.errors = {}    # label -> count
+
+    def add(self, label, seconds):
+        with self.lock:
+            self.timings.setdefault(label, []).append(seconds)
+
+    def error(self, label):
+        with self.lock:
+            self.errors[label] = self.errors.get(label, 0) + 1
+
+
+class SessionFlow:
+    """One simulated user clicking through the questionnaire."""
+
+    def __init__(self, base_url, recorder, rng, stream=False, combined=False, timeout=120):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.rng = rng
+        self.stream = stream
+        self.combined = combined
+        self.timeout = timeout
+
+    def call(self, method, path, labels, payload=None):
+        data = json.dumps(payload).encode() if payload is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                         headers={'Content-Type': 'application/json'} if data else {})
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                body = response.read()
+        except (urllib.error.URLError, OSError) as e:
+            for label in labels:
+                self.recorder.error(label)
+            raise RuntimeError(f"{method} {path} failed: {e}")
+        elapsed = time.perf_counter() - started
+        for label in labels:
+            self.recorder.add(label, elapsed)
+        return body
+
+    @staticmethod
+    def next_question(body, stream):
+        # The next question from a combined-mode answer response
+        if not stream:
+            return json.loads(body).get('next_question')
+        event = None
+        for line in body.decode().splitlines():
+            if line.startswith('event: '):
+                event = line[len('event: '):]
+            elif line.startswith('data: ') and event == 'question':
+                return json.loads(line[len('data: '):])
+        return None
+
+    def run(self):
+        user_id = json.loads(self.call('GET', '/api/start', ['GET /api/start']))['user_id']
+        answer_path = '/api/answer/stream' if self.stream else '/api/answer'
+        step = 0
+        question = None
+        while True:
+            if question is None:
+                question = json.loads(self.call('GET', f'/api/question?user_id={user_id}', [
+                    'GET /api/question', f'step {step} question']))
+            if 'error' in question:
+                raise RuntimeError(f"Question {step} failed: {question['error']}")
+            picks = self.rng.sample(question['answers'], question.get('requiredSelections', 1))
+            payload = {'user_id': user_id, 'answer': ', '.join(picks)}
+            if self.combined:
+                payload['with_question'] = True
+            body = self.call('POST', answer_path, [f'POST {answer_path}', f'step {step} answer'], payload)
+            if question.get('last'):
+                break
+            question = self.next_question(body, self.stream) if self.combined else None
+            step += 1
+        self.call('POST', '/api/reset', ['POST /api/reset'], {'user_id': user_id})
+
+
+def start_backend(server, port, openai_url, workdir):
+    env = dict(os.environ)
+    env.update({
+        'OPENAI_BASE_URL': openai_url,
+        'OPENAI_API_KEY': 'bench',
+        'GPT_CACHE_PATH': os.path.join(workdir, 'gpt_cache.sqlite3'),
+        'QUIP_POOL_PATH': os.path.join(workdir, 'quip_pool.sqlite3'),
+        'SESSION_BACKEND': 'memory',
+        'CATALOG_DIR': env.get('CATALOG_DIR', REPO_ROOT),
+        'CATALOG_RELOAD_INTERVAL': '0',
+        # Every simulated user comes from 127.0.0.1: the per-client limits would turn most of them away
+        'IP_RATE_LIMIT': '0',
+        'SESSION_RATE_LIMIT': '0',
+        'ANALYTICS_DIR': os.path.join(workdir, 'analytics'),
+    })
+    if server == 'hypercorn':
+        command = [sys.executable, '-m', 'hypercorn', 'bartender_async:app', '--bind', f'127.0.0.1:{port}']
+    else:
+        command = [sys.executable, '-c',
+                   f"import bartender; bartender.app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    log = open(os.path.join(workdir, 'backend.log'), 'w')
+    process = subprocess.Popen(command, cwd=REPO_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Backend exited with {process.returncode}, see {log.name}")
+        try:
+            urllib.request.urlopen(url + '/api/catalog-stats', timeout=1).read()
+            return process, url
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"Backend did not come up on {url}, see {log.name}")
+
+
+def run_load(base_url, sessions, concurrency, stream, seed, combined=False):
+    recorder = Recorder()
+    failures = []
+    rng = random.Random(seed)
+    seeds = [rng.random() for _ in range(sessions)]
+
+    def one(session_seed):
+        try:
+            SessionFlow(base_url, recorder, random.Random(session_seed), stream, combined).run()
+        except Exception as e:
+            failures.append(str(e))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, seeds))
+    return recorder, failures, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay concurrent session flows against the backend.")
+    parser.add_argument('--sessions', type=int, default=100, help="session flows to replay (default: 100)")
+    parser.add_argument('--concurrency', type=int, default=10, help="simultaneous users (default: 10)")
+    parser.add_argument('--stream', action='store_true', help="answer through /api/answer/stream")
+    parser.add_argument('--combined', action='store_true', help="get the next question with each answer (with_question)")
+    parser.add_argument('--server', choices=('flask', 'hypercorn'), default='flask', help="backend to start")
+    parser.add_argument('--port', type=int, default=5099, help="port for the started backend (default: 5099)")
+    parser.add_argument('--url', help="benchmark an already running backend instead of starting one")
+    parser.add_argument('--seed', type=int, default=1, help="seed for the simulated answers")
+    parser.add_argument('--json', help="also write the results to this file")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    process = None
+    with tempfile.TemporaryDirectory(prefix='bartender-bench-') as workdir:
+        fake = FakeOpenAI(args.latency_ms, args.latency_sigma, args.tokens_per_second, args.error_rate, seed=args.seed)
+        fake_server = None
+        base_url = args.url
+        if base_url is None:
+            fake_server = start_server(fake)
+            process, base_url = start_backend(args.server, args.port, f'http://127.0.0.1:{fake_server.server_port}/v1', workdir)
+        try:
+            recorder, failures, elapsed = run_load(base_url, args.sessions, args.concurrency, args.stream, args.seed, args.combined)
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait(timeout=10)
+            if fake_server is not None:
+                fake_server.shutdown()
+
+    endpoints = {label: summarize(values) for label, values in sorted(recorder.timings.items()) if label[0] in 'GP'}
+    steps = {label: summarize(values) for label, values in sorted(recorder.timings.items()) if label.startswith('step')}
+    completed = args.sessions - len(failures)
+    requests = sum(len(values) for label, values in recorder.timings.items() if label[0] in 'GP')
+
+    print(f"{completed}/{args.sessions} sessions in {elapsed:.2f}s at concurrency {args.concurrency}: "
+          f"{completed / elapsed:.2f} sessions/s, {requests / elapsed:.1f} requests/s"
+          + (f", {fake.requests} OpenAI calls" if args.url is None else ''))
+    print_table("Per endpoint", endpoints)
+    print_table("Per question step", steps)
+    if recorder.errors:
+        print(f"\nErrors: {recorder.errors}")
+    for failure in failures[:5]:
+        print(f"  {failure}")
+
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump({'sessions': args.sessions, 'completed': completed, 'concurrency': args.concurrency,
+                       'seconds': elapsed, 'openai_calls': fake.requests, 'endpoints': endpoints, 'steps': steps,
+                       'errors': recorder.errors}, out, indent=2)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,140 @@
+# Microbenchmarks for recommend_drinks over synthetic catalogs, built by resampling the
+# real drinks dictionaries into 1k, 10k and 100k entries per dictionary.
+#
+#   python bench/recommend_bench.py                        # 1k, 10k and 100k drinks
+#   python bench/recommend_bench.py --sizes 10000 --queries 2000 --fail-above-ms 5
+#
+# Reports the catalog build time and per-query latency of the indexed recommend_drinks,
+# the batch path and the linear reference; --fail-above-ms makes the run exit non-zero
+# when the indexed p99 of any size goes over the budget.
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+# bartender builds its OpenAI client, GPT cache and catalog at import
+os.environ.setdefault('OPENAI_API_KEY', 'bench')
+BENCH_DIR = tempfile.mkdtemp(prefix='bartender-bench-')
+os.environ.setdefault('GPT_CACHE_PATH', os.path.join(BENCH_DIR, 'gpt_cache.sqlite3'))
+os.environ.setdefault('QUIP_POOL_PATH', os.path.join(BENCH_DIR, 'quip_pool.sqlite3'))
+os.environ.setdefault('QUIP_POOL_WARM', '0')
+os.environ.setdefault('CATALOG_DIR', REPO_ROOT)
+os.environ.setdefault('CATALOG_RELOAD_INTERVAL', '0')
+os.environ.setdefault('ANALYTICS_DIR', '')
+# No network: skip the background threads and warm-up (its models.list call), and point any
+# stray OpenAI call at a closed local port
+os.environ['BARTENDER_PREFORK'] = '1'
+os.environ['OPENAI_BASE_URL'] = 'http://127.0.0.1:9/v1'
+# The import-time, per-query debug and "no drinks found" logging would dominate the timings
+os.environ['LOG_MODE'] = 'text'
+os.environ['LOG_LEVEL'] = 'CRITICAL'
+logging.basicConfig(level=logging.CRITICAL)
+
+import bartender  # noqa: E402
+from catalog import normalize_flavor_tokens  # noqa: E402
+from catalog_snapshot import CatalogSnapshot  # noqa: E402
+from load_test import print_table, summarize  # noqa: E402
+
+
+def synthetic_catalog(templates, size, rng):
+    # Drinks copied from the real ones, with flavors, level and occasion reshuffled within their category
+    by_category = {}
+    for drink in templates:
+        by_category.setdefault(str(drink.get('category')).lower(), []).append(drink)
+    vocab = {category: sorted({token for drink in drinks for token in normalize_flavor_tokens(drink.get('flavor_profile', ''))})
+             for category, drinks in by_category.items()}
+    levels = {category: [drink.get('level') for drink in drinks] for category, drinks in by_category.items()}
+    occasions = [drink.get('occasion') for drink in templates]
+
+    drinks = []
+    for number in range(size):
+        drink = dict(rng.choice(templates))
+        category = str(drink.get('category')).lower()
+        drink['Style_Name'] = f"{drink['Style_Name']} #{number}"
+        drink['flavor_profile'] = ', '.join(rng.sample(vocab[category], min(3, len(vocab[category])))).title()
+        drink['level'] = rng.choice(levels[category])
+        drink['occasion'] = rng.choice(occasions)
+        drinks.append(drink)
+    return drinks
+
+
+def time_queries(function, queries):
+    timings = []
+    for answers in queries:
+        started = time.perf_counter()
+        function(list(answers))
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def bench_size(size, queries, linear_queries, rng):
+    main = synthetic_catalog(list(bartender.catalog.main_drinks), size, rng)
+    systembolaget = synthetic_catalog(list(bartender.catalog.system_bolaget_dictionary), size, rng)
+
+    started = time.perf_counter()
+    snapshot = CatalogSnapshot(main, systembolaget)
+    build_seconds = time.perf_counter() - started
+
+    previous = bartender.catalog
+    bartender.swap_catalog(snapshot)
+    try:
+        indexed = time_queries(lambda answers: bartender.recommend_drinks(answers, snapshot), queries)
+        linear = time_queries(bartender.recommend_drinks_linear, queries[:linear_queries])
+
+        started = time.perf_counter()
+        bartender.recommend_drinks_batch(queries)
+        batch_seconds = time.perf_counter() - started
+    finally:
+        bartender.swap_catalog(previous)
+
+    return build_seconds, indexed, linear, batch_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark recommend_drinks over synthetic catalogs.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="drinks per dictionary (default: 1000 10000 100000)")
+    parser.add_argument('--queries', type=int, default=1000, help="random answer tuples per size (default: 1000)")
+    parser.add_argument('--linear-queries', type=int, default=100,
+                        help="how many of them also go through the linear reference (default: 100)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--fail-above-ms', type=float, help="exit non-zero if an indexed p99 exceeds this")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    answer_space = list(bartender.all_answer_tuples())
+    queries = [rng.choice(answer_space) for _ in range(args.queries)]
+
+    results = {}
+    over_budget = []
+    for size in args.sizes:
+        build_seconds, indexed, linear, batch_seconds = bench_size(size, queries, args.linear_queries, rng)
+        rows = {
+            'recommend_drinks': summarize(indexed),
+            'recommend_drinks_linear': summarize(linear),
+            'batch (per tuple)': summarize([batch_seconds / len(queries)]),
+        }
+        print_table(f"{size} drinks per dictionary (catalog built in {build_seconds:.2f}s)", rows)
+        results[size] = {'build_seconds': build_seconds, **rows}
+        if args.fail_above_ms is not None and rows['recommend_drinks']['p99'] * 1000 > args.fail_above_ms:
+            over_budget.append(size)
+
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(results, out, indent=2)
+    if over_budget:
+        print(f"\nrecommend_drinks p99 over {args.fail_above_ms} ms for sizes: {over_budget}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+# Checks that the indexed recommend_drinks (and the batch path) pick exactly what the linear
+# reference recommend_drinks_linear picks, for every answer tuple of the questionnaire
+# (bartender.all_answer_tuples). Runs over the real drinks dictionaries and over synthetic
+# catalogs resampled from them (see recommend_bench.py), each both as parsed JSON and as
+# a compiled, memory-mapped catalog (catalog_compiler.py).
+#
+#   python bench/recommend_check.py
+#   python bench/recommend_check.py --sizes 1000 20000 --seed 7
+#
+# Exits non-zero if any pick differs. Only exact matching has a linear reference.
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+
+from recommend_bench import synthetic_catalog  # sets up the environment bartender imports with
+
+import bartender  # noqa: E402
+from catalog_compiler import compile_catalogs  # noqa: E402
+from catalog_snapshot import CatalogSnapshot  # noqa: E402
+
+
+def compiled_snapshot(main, systembolaget, workdir):
+    paths = []
+    for name, drinks in (('main', main), ('systembolaget', systembolaget)):
+        path = os.path.join(workdir, f'{name}.json')
+        with open(path, 'w') as file:
+            json.dump(drinks, file)
+        paths.append(path)
+    out_path = os.path.join(workdir, 'catalog.mmcat')
+    compile_catalogs(*paths, out_path)
+    return CatalogSnapshot.from_compiled(out_path)
+
+
+def linear_picks(snapshot, answer_space):
+    previous = bartender.catalog
+    bartender.swap_catalog(snapshot)
+    try:
+        return [bartender.recommend_drinks_linear(list(answers)) for answers in answer_space]
+    finally:
+        bartender.swap_catalog(previous)
+
+
+def mismatches(snapshot, answer_space, expected):
+    # Answer tuples whose indexed or batch picks differ from the linear ones
+    previous = bartender.catalog
+    bartender.swap_catalog(snapshot)
+    try:
+        batch = bartender.recommend_drinks_batch(answer_space)
+        return [answers for answers, batched, linear in zip(answer_space, batch, expected)
+                if bartender.recommend_drinks(list(answers), snapshot) != linear or batched != linear]
+    finally:
+        bartender.swap_catalog(previous)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks the indexed recommendations against the linear reference.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000],
+                        help="synthetic catalog sizes to check besides the real one (default: 1000 5000)")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if bartender.SEMANTIC_MATCHING:
+        print("MATCHING=semantic has no linear reference; run with exact matching")
+        return 2
+
+    rng = random.Random(args.seed)
+    answer_space = list(bartender.all_answer_tuples())
+    main_drinks = list(bartender.catalog.main_drinks)
+    systembolaget = list(bartender.catalog.system_bolaget_dictionary)
+    catalogs = [('real', main_drinks, systembolaget)]
+    for size in args.sizes:
+        catalogs.append((f'{size:,} drinks', synthetic_catalog(main_drinks, size, rng), synthetic_catalog(systembolaget, size, rng)))
+
+    failed = False
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, main, systembolaget in catalogs:
+            snapshot = CatalogSnapshot(main, systembolaget)
+            # The linear scan runs over the parsed drinks; the compiled catalog must pick the same
+            expected = linear_picks(snapshot, answer_space)
+            for kind, snapshot in (('json', snapshot), ('compiled', compiled_snapshot(main, systembolaget, workdir))):
+                different = mismatches(snapshot, answer_space, expected)
+                if different:
+                    failed = True
+                    print(f"{name} ({kind}): {len(different)} of {len(answer_space)} answer tuples differ, e.g. {different[:3]}")
+                else:
+                    print(f"{name} ({kind}): all {len(answer_space)} answer tuples match")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
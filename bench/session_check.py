@@ -0,0 +1,111 @@
+# Drives every session backend in sessions.py through the same create/get/save/count/
+# get_many steps and checks what comes back; the redis backend runs against
+# bench/fake_redis.py unless --redis-url points at a real server (use a scratch database,
+# it is written to).
+#
+#   python bench/session_check.py
+#   python bench/session_check.py --redis-url redis://127.0.0.1:6379/15
+#
+# Exits non-zero if any backend fails a step.
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sessions  # noqa: E402
+from fake_redis import FakeRedis, start_server  # noqa: E402
+
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+def check_store(store, ttl):
+    before = store.count()
+    user_id, session = store.create()
+    check(store.get(user_id) is not None, "a new session can be read back")
+    check(store.count() == before + 1, f"count went from {before} to {store.count()} after one create")
+
+    session = store.get(user_id)
+    session.question_index = 3
+    session.enable_speech = False
+    session.add_response('Beer')
+    session.add_response(['Hoppy', 'Citrus'])
+    store.save(session)
+    again = store.get(user_id)
+    check(again.question_index == 3 and again.enable_speech is False, "saved fields survive a get")
+    check(again.user_responses == ['Beer', ['Hoppy', 'Citrus']], f"saved answers survive a get: {again.user_responses}")
+
+    other_id, _ = store.create()
+    found = store.get_many([user_id, 'no-such-session', other_id])
+    check(sorted(found) == sorted([user_id, other_id]), f"get_many finds the live sessions only: {sorted(found)}")
+    check(found[user_id].user_responses == again.user_responses, "get_many returns the saved state")
+    check(store.get_many([]) == {}, "get_many of nothing is empty")
+    check(store.get('no-such-session') is None and store.get('') is None, "unknown ids read as None")
+    check(store.count() == before + 2, f"count is {store.count()} after two creates, expected {before + 2}")
+
+    # Idle sessions expire; saving one refreshes its expiry (the sqlite store only counts saves)
+    time.sleep(ttl * 0.6)
+    session = store.get(user_id)
+    check(session is not None, "a session is live before its ttl")
+    store.save(session)
+    time.sleep(ttl * 0.6)
+    check(store.get(user_id) is not None, "a save refreshes the ttl")
+    check(store.get(other_id) is None, "an idle session expires after its ttl")
+    check(store.count() == before + 1, f"count is {store.count()} after one of two sessions expired, expected {before + 1}")
+
+
+def check_redis(store):
+    # An error reply in the middle of a pipeline must not leave the connection out of step
+    user_id, _ = store.create()
+    try:
+        store._pipeline(('GET', store.prefix + user_id), ('NO-SUCH-COMMAND',), ('GET', store.prefix + user_id))
+    except sessions.RespError:
+        pass
+    else:
+        raise AssertionError("an error reply raises RespError")
+    check(store.get(user_id) is not None and store.get(user_id).user_id == user_id, "the connection is usable after an error reply")
+
+    # Other keys in the same database don't count as sessions
+    before = store.count()
+    store._pipeline(('SET', 'someone-else:key', 'value'))
+    check(store.count() == before, f"count went from {before} to {store.count()} after writing a key that isn't a session")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks the session backends against each other.")
+    parser.add_argument('--redis-url', help="a Redis server to check instead of the fake one")
+    parser.add_argument('--ttl', type=int, default=2, help="session ttl for the checks, in whole seconds")
+    args = parser.parse_args()
+
+    url = args.redis_url
+    if url is None:
+        server = start_server(FakeRedis())
+        url = f"redis://127.0.0.1:{server.server_address[1]}/1"
+
+    with tempfile.TemporaryDirectory() as workdir:
+        stores = {
+            'memory': sessions.make_session_store('memory', ttl=args.ttl),
+            'sqlite': sessions.make_session_store('sqlite', ttl=args.ttl, path=os.path.join(workdir, 'sessions.sqlite3')),
+            'redis': sessions.make_session_store('redis', ttl=args.ttl, url=url),
+        }
+        failed = False
+        for name, store in stores.items():
+            try:
+                check_store(store, args.ttl)
+                if name == 'redis':
+                    check_redis(store)
+            except AssertionError as e:
+                print(f"{name}: FAILED: {e}")
+                failed = True
+            else:
+                print(f"{name}: ok ({store.stats()})")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import logging
+
+
+# Alcohol levels the beer question can produce, mapped to the catalog level they select.
+# "low" is treated as "medium" (there are too few low-alcohol beers to recommend from).
+BEER_LEVEL_ALIASES = {
+    "low": "medium",
+    "medium": "medium",
+    "high": "high",
+    "non-alcoholic": "non-alcoholic",
+}
+
+
+def normalize_flavor_tokens(flavor_profile):
+    # "Light, Fruity, Malty" -> ("light", "fruity", "malty")
+    return tuple(token.strip() for token in str(flavor_profile).lower().split(',') if token.strip())
+
+
+class CatalogIndex:
+    """
+    Read-only index over one drinks dictionary, built once when the catalog is loaded.
+
+    Entries are kept in file order and referred to by position, so ties are broken the
+    same way as the linear scans in bartender.py (first drink in the file wins).
+    Layout: category -> positions, (category, level) -> positions and category ->
+    occasion -> positions, plus the flavor tokens of every drink; scoring.py builds its
+    columns from these.
+    """
+
+    def __init__(self, drinks):
+        self.drinks = drinks
+        self.categories = {}        # category -> [positions]
+        self.levels = {}            # (category, level) -> [positions]
+        self.occasion_postings = {} # category -> {occasion: set(positions)}
+        self.flavor_tokens = []     # position -> tuple of normalized flavor tokens
+
+        for position, drink in enumerate(drinks):
+            tokens = normalize_flavor_tokens(drink.get('flavor_profile', ''))
+            self.flavor_tokens.append(tokens)
+
+            category = drink.get('category')
+            if not isinstance(category, str):
+                logging.error("Drink without category skipped by index: %s", drink.get('Style_Name', 'Unknown'))
+                continue
+            category = category.lower()
+            level = str(drink.get('level', '')).lower()
+
+            self.categories.setdefault(category, []).append(position)
+            self.levels.setdefault((category, level), []).append(position)
+            # Non-alcoholic beers are tagged with level 0 or simply have no alcohol at all
+            if level == "0" or drink.get('alcohol_content') == 0.0:
+                self.levels.setdefault((category, "non-alcoholic"), []).append(position)
+
+            occasion = str(drink.get('occasion', '')).lower()
+            self.occasion_postings.setdefault(category, {}).setdefault(occasion, set()).add(position)
@@ -0,0 +1,189 @@
+# Compiles main_drinks.json and systembolagetdict.json into one binary catalog artifact
+# that the backend memory-maps read-only (CATALOG_COMPILED=<path>): no JSON parsing or
+# index building at startup, and every worker process shares the same physical pages.
+#
+#   python catalog_compiler.py main_drinks.json systembolagetdict.json -o catalog.mmcat
+#
+# Layout: 8-byte magic, uint32 format version, uint32 header length, JSON header, then
+# 64-byte aligned sections. The header lists every section (dtype, shape, offset) and the
+# per-category vocabularies as ids into the string table. The string table holds every
+# string once (the drinks' JSON, flavor tokens, occasions, levels, categories). Numeric
+# columns are fixed width: flavor token bitmasks, level rows, occasion codes,
+# and the postings of the text index used for semantic matching.
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+from catalog import CatalogIndex
+from scoring import CategoryFeatures, ScoringEngine
+from text_index import TextIndex
+
+MAGIC = b'MMCATLG\0'
+FORMAT_VERSION = 3
+ALIGNMENT = 64
+CATALOGS = ('main', 'systembolaget')
+
+
+class StringTable:
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def add(self, string):
+        if string not in self.ids:
+            self.ids[string] = len(self.strings)
+            self.strings.append(string)
+        return self.ids[string]
+
+    def arrays(self):
+        encoded = [string.encode('utf-8') for string in self.strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+        offsets[1:] = np.cumsum([len(data) for data in encoded], dtype=np.uint64)
+        return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+
+def compile_catalogs(main_path, systembolaget_path, out_path):
+    strings = StringTable()
+    sections = {}
+    catalogs = {}
+
+    for name, path in zip(CATALOGS, (main_path, systembolaget_path)):
+        with open(path, 'r') as file:
+            drinks = json.load(file)
+        engine = ScoringEngine(CatalogIndex(drinks))
+
+        sections[f'{name}/drinks'] = np.array(
+            [strings.add(json.dumps(drink, ensure_ascii=False, separators=(',', ':'))) for drink in drinks], dtype=np.uint32)
+        for array_name, array in TextIndex.build(drinks).arrays().items():
+            sections[f'{name}/text/{array_name}'] = array
+        categories = []
+        for number, (category, features) in enumerate(engine.features.items()):
+            prefix = f'{name}/{number}'
+            sections[f'{prefix}/positions'] = features.positions
+            sections[f'{prefix}/flavor_bits'] = features.flavor_bits
+            sections[f'{prefix}/occasion_codes'] = features.occasion_codes
+            levels = []
+            for level_number, (level, rows) in enumerate(features.level_rows.items()):
+                sections[f'{prefix}/level/{level_number}'] = rows
+                levels.append(strings.add(level))
+            categories.append({
+                'name': strings.add(category),
+                'flavor_vocab': [strings.add(token) for token in features.flavor_vocab],
+                'occasion_vocab': [strings.add(occasion) for occasion in features.occasion_vocab],
+                'levels': levels,
+            })
+        catalogs[name] = {'source': os.path.basename(path), 'count': len(drinks), 'categories': categories}
+
+    sections['strings/offsets'], sections['strings/blob'] = strings.arrays()
+
+    # Section offsets are relative to the first aligned byte after the header
+    layout = {}
+    offset = 0
+    for section, array in sections.items():
+        layout[section] = [array.dtype.str, list(array.shape), offset]
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    header = {'format': FORMAT_VERSION, 'created': time.time(), 'catalogs': catalogs, 'sections': layout}
+    header_bytes = json.dumps(header, separators=(',', ':')).encode()
+    data_start = -(-(len(MAGIC) + 8 + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+
+    tmp_path = out_path + '.tmp'
+    with open(tmp_path, 'wb') as out:
+        out.write(MAGIC + struct.pack('<II', FORMAT_VERSION, len(header_bytes)) + header_bytes)
+        for section, array in sections.items():
+            out.seek(data_start + layout[section][2])
+            out.write(np.ascontiguousarray(array).tobytes())
+        out.truncate(data_start + offset)
+    # Atomic replace, so a running reloader never maps a half-written file
+    os.replace(tmp_path, out_path)
+    return header
+
+
+class CompiledDrinks:
+    """Read-only sequence of drink dicts, decoded from the string table on access."""
+
+    def __init__(self, compiled, ids):
+        self.compiled = compiled
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, position):
+        return json.loads(self.compiled.string(int(self.ids[position])))
+
+    def __iter__(self):
+        return (self[position] for position in range(len(self)))
+
+
+class CompiledCatalog:
+    """A memory-mapped catalog artifact written by compile_catalogs."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self.mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a compiled catalog")
+        version, header_length = struct.unpack_from('<II', self.mm, len(MAGIC))
+        if version != FORMAT_VERSION:
+            raise ValueError(f"{path} has catalog format {version}, expected {FORMAT_VERSION}; recompile it")
+        header_end = len(MAGIC) + 8 + header_length
+        self.header = json.loads(self.mm[len(MAGIC) + 8:header_end])
+        self.data_start = -(-header_end // ALIGNMENT) * ALIGNMENT
+
+        self.string_offsets = self.array('strings/offsets')
+        self.string_blob = self.array('strings/blob')
+
+    def array(self, section):
+        dtype, shape, offset = self.header['sections'][section]
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape)) if shape else 1
+        return np.frombuffer(self.mm, dtype=dtype, count=count, offset=self.data_start + offset).reshape(shape)
+
+    def string(self, string_id):
+        start, end = self.string_offsets[string_id], self.string_offsets[string_id + 1]
+        return self.string_blob[start:end].tobytes().decode('utf-8')
+
+    def engine(self, name):
+        # (drinks, ScoringEngine) for one of the two catalogs, backed by the memory map
+        meta = self.header['catalogs'][name]
+        drinks = CompiledDrinks(self, self.array(f'{name}/drinks'))
+        features = {}
+        for number, category in enumerate(meta['categories']):
+            prefix = f'{name}/{number}'
+            features[self.string(category['name'])] = CategoryFeatures.from_arrays(
+                positions=self.array(f'{prefix}/positions'),
+                flavor_vocab=[self.string(token) for token in category['flavor_vocab']],
+                flavor_bits=self.array(f'{prefix}/flavor_bits'),
+                level_rows={self.string(level): self.array(f'{prefix}/level/{level_number}')
+                            for level_number, level in enumerate(category['levels'])},
+                occasion_vocab=[self.string(occasion) for occasion in category['occasion_vocab']],
+                occasion_codes=self.array(f'{prefix}/occasion_codes'),
+            )
+        text_index = TextIndex(size=len(drinks), **{array_name: self.array(f'{name}/text/{array_name}')
+                                                    for array_name in ('features', 'idf', 'indptr', 'documents', 'weights')})
+        return drinks, ScoringEngine.from_features(drinks, features, text_index)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile the drinks dictionaries into a memory-mappable catalog.")
+    parser.add_argument('main_drinks', help="path to main_drinks.json")
+    parser.add_argument('systembolaget', help="path to systembolagetdict.json")
+    parser.add_argument('-o', '--out', default='catalog.mmcat', help="output file (default: catalog.mmcat)")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    header = compile_catalogs(args.main_drinks, args.systembolaget, args.out)
+    counts = ', '.join(f"{name}: {meta['count']} drinks" for name, meta in header['catalogs'].items())
+    print(f"Wrote {args.out} ({os.path.getsize(args.out)} bytes, {counts}) in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
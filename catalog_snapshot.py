@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from catalog import CatalogIndex
+from scoring import ScoringEngine
+
+
+class CatalogSnapshot:
+    """
+    Both drinks dictionaries with everything derived from them, built in one go.
+
+    A snapshot is never modified after it is built. Requests read the current snapshot
+    once and keep using it, so a reload swapping in a new one can't be seen half-done.
+    """
+
+    __slots__ = ('main_drinks', 'system_bolaget_dictionary', 'main_drinks_engine', 'system_bolaget_engine',
+                 'versions', 'loaded_at', 'load_seconds')
+
+    def __init__(self, main_drinks, system_bolaget_dictionary, versions=None):
+        started = time.perf_counter()
+        self.main_drinks = tuple(main_drinks)
+        self.system_bolaget_dictionary = tuple(system_bolaget_dictionary)
+        self.main_drinks_engine = ScoringEngine(CatalogIndex(self.main_drinks))
+        self.system_bolaget_engine = ScoringEngine(CatalogIndex(self.system_bolaget_dictionary))
+        self.versions = versions or {}
+        self.loaded_at = time.time()
+        self.load_seconds = time.perf_counter() - started
+
+    @classmethod
+    def from_compiled(cls, path):
+        # Snapshot over a memory-mapped artifact from catalog_compiler.py, nothing is parsed up front
+        from catalog_compiler import CompiledCatalog
+
+        started = time.perf_counter()
+        compiled = CompiledCatalog(path)
+        snapshot = cls.__new__(cls)
+        snapshot.main_drinks, snapshot.main_drinks_engine = compiled.engine('main')
+        snapshot.system_bolaget_dictionary, snapshot.system_bolaget_engine = compiled.engine('systembolaget')
+        snapshot.versions = {path: file_version(path)}
+        snapshot.loaded_at = time.time()
+        snapshot.load_seconds = time.perf_counter() - started
+        return snapshot
+
+    def stats(self):
+        return {
+            'main_drinks': len(self.main_drinks),
+            'systembolaget_drinks': len(self.system_bolaget_dictionary),
+            'loaded_at': self.loaded_at,
+            'load_seconds': self.load_seconds,
+        }
+
+
+def file_version(path):
+    # (mtime, size) changes whenever the file is rewritten; None if it is missing
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def read_catalog(path):
+    """Strict loader for reloads: raises instead of returning an empty catalog."""
+    with open(path, 'r') as file:
+        data = json.load(file)
+
+    if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
+        raise ValueError(f"{path} must contain a list of drinks")
+    valid = 0
+    for item in data:
+        if 'Style_Name' not in item or not item['Style_Name'] or not isinstance(item.get('category'), str):
+            logging.error("Invalid entry found in %s: %s", path, item)
+        else:
+            valid += 1
+    if not valid:
+        raise ValueError(f"{path} contains no valid drinks")
+    return data
+
+
+class CatalogReloader:
+    """
+    Rebuilds the catalog snapshot in a background thread when a watched file changes
+    (polled every `interval` seconds) or when `request_reload` is called, e.g. from a
+    SIGHUP handler. A file that fails to load leaves the current snapshot in place.
+    """
+
+    def __init__(self, paths, build, swap, current, interval=5.0):
+        self.paths = paths
+        self.build = build        # () -> CatalogSnapshot, raises on invalid files
+        self.swap = swap          # (CatalogSnapshot) -> None
+        self.current = current    # () -> CatalogSnapshot
+        self.interval = interval
+        self.wakeup = threading.Event()
+        self.forced = False
+        self.thread = None
+        self.reloads = 0
+        self.failures = 0
+        self.last_error = None
+        self.rejected = None  # file versions that failed to load, not retried until they change
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, name='catalog-reloader', daemon=True)
+            self.thread.start()
+
+    def request_reload(self):
+        # Only sets a flag and an event, so it is safe to call from a signal handler
+        self.forced = True
+        self.wakeup.set()
+
+    def changed(self):
+        versions = {path: file_version(path) for path in self.paths}
+        current = self.current().versions
+        return versions != self.rejected and any(versions[path] != current.get(path) for path in self.paths)
+
+    def reload(self):
+        started = time.perf_counter()
+        try:
+            snapshot = self.build()
+        except Exception as e:
+            self.failures += 1
+            self.rejected = {path: file_version(path) for path in self.paths}
+            self.last_error = f"{type(e).__name__}: {e}"
+            logging.error("Catalog reload failed, keeping the current catalog: %s", self.last_error)
+            return False
+        self.swap(snapshot)
+        self.reloads += 1
+        self.last_error = None
+        logging.info("Catalog reloaded in %.3fs: %d main drinks, %d systembolaget drinks", time.perf_counter() - started,
+                     len(snapshot.main_drinks), len(snapshot.system_bolaget_dictionary))
+        return True
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.interval or None)
+            self.wakeup.clear()
+            forced, self.forced = self.forced, False
+            if forced or (self.interval and self.changed()):
+                self.reload()
+
+    def stats(self):
+        return {
+            **self.current().stats(),
+            'reloads': self.reloads,
+            'failures': self.failures,
+            'last_error': self.last_error,
+            'watching': self.thread is not None and self.thread.is_alive(),
+        }
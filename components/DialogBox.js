@@ -6,6 +6,22 @@ import Button from '@mui/material/Button';
 import DialogContent from '@mui/material/DialogContent';
 import Typewriter from 'typewriter-effect';
 
+// Drink photo or icon: the built derivatives from the image manifest (AVIF/WebP, immutable
+// URLs) when the backend sent them, otherwise the original image fetched from /api/images
+function DrinkImage({ image, url, ...props }) {
+  if (!image) {
+    return <img src={url} {...props} />;
+  }
+  return (
+    <picture>
+      {image.sources.map(source => (
+        <source key={source.type} type={source.type} srcSet={source.srcset} />
+      ))}
+      <img src={image.src} {...props} />
+    </picture>
+  );
+}
+
 function DialogBox({ dialogHistory, showSummary, userAnswers, selectedDrinks, children, onReset, isTyping }) {
   const [showModal, setShowModal] = useState(false);
   const [imageRecommendedUrl, setimageRecommendedUrl] = useState('');
@@ -30,10 +46,11 @@ function DialogBox({ dialogHistory, showSummary, userAnswers, selectedDrinks, ch
     if (showModal && drink && systemBolagetDrink) {
       const fetchImages = async () => {
         try {
-          const drinkRecommendedName = drink.Image_name;
-          const iconRecommendedName = drink.Image_Icon;
-          const drinkSystemName = systemBolagetDrink.Image_name;
-          const iconSystemName = systemBolagetDrink.Image_Icon;
+          // Images with built derivatives need no fetch, the browser loads them from their URLs
+          const drinkRecommendedName = !drink.images?.image && drink.Image_name;
+          const iconRecommendedName = !drink.images?.icon && drink.Image_Icon;
+          const drinkSystemName = !systemBolagetDrink.images?.image && systemBolagetDrink.Image_name;
+          const iconSystemName = !systemBolagetDrink.images?.icon && systemBolagetDrink.Image_Icon;
 
           const imageRecommendedUrls = [];
           const imageRecommendedIconUrls = [];
@@ -253,18 +270,20 @@ function DialogBox({ dialogHistory, showSummary, userAnswers, selectedDrinks, ch
                     <p className={`testexpo-info ${showInfo ? 'show' : ''}`}>
                       Best match available at Sogeti Quarterly Mingle
                     </p>
-                    {drink && imageRecommendedIconUrl && (
-                      <img
-                        src={imageRecommendedIconUrl}
+                    {drink && (drink.images?.icon || imageRecommendedIconUrl) && (
+                      <DrinkImage
+                        image={drink.images?.icon}
+                        url={imageRecommendedIconUrl}
                         alt="Selected Icon"
                         className={`result-left-icon ${showInfo ? 'show' : ''}`}
                       />
                     )}
                   </DialogContent>
                   <DialogContent className="drink-left-image">
-                    {drink && imageRecommendedUrl && (
-                      <img
-                        src={imageRecommendedUrl}
+                    {drink && (drink.images?.image || imageRecommendedUrl) && (
+                      <DrinkImage
+                        image={drink.images?.image}
+                        url={imageRecommendedUrl}
                         alt="Selected Drink"
                         className={`result-left-image ${showInfo ? 'show' : ''}`}
                       />
@@ -293,9 +312,10 @@ function DialogBox({ dialogHistory, showSummary, userAnswers, selectedDrinks, ch
                 <div className="right-result-upper">
                   <div className="right-filler" />
                   <DialogContent className="drink-right-image">
-                    {systemBolagetDrink && imageSystemUrl && (
-                      <img
-                        src={imageSystemUrl}
+                    {systemBolagetDrink && (systemBolagetDrink.images?.image || imageSystemUrl) && (
+                      <DrinkImage
+                        image={systemBolagetDrink.images?.image}
+                        url={imageSystemUrl}
                         alt="Selected Drink"
                         className={`result-right-image ${showInfo ? 'show' : ''}`}
                       />
@@ -306,9 +326,10 @@ function DialogBox({ dialogHistory, showSummary, userAnswers, selectedDrinks, ch
                     <p className={`systembolaget-info ${showInfo ? 'show' : ''}`}>
                       Best match available at Systembolaget
                     </p>
-                    {systemBolagetDrink && imageSystemIconUrl && (
-                      <img
-                        src={imageSystemIconUrl}
+                    {systemBolagetDrink && (systemBolagetDrink.images?.icon || imageSystemIconUrl) && (
+                      <DrinkImage
+                        image={systemBolagetDrink.images?.icon}
+                        url={imageSystemIconUrl}
                         alt="Selected Icon"
                         className={`result-right-icon ${showInfo ? 'show' : ''}`}
                       />
@@ -0,0 +1,147 @@
+import logging
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache of GPT texts, persisted to SQLite so it survives restarts.
+
+    Every key keeps up to `variants` different texts. Until a key has `min_variants` of
+    them (all of them by default) a lookup counts as a miss, so the caller asks GPT and
+    adds another variant; after that a random variant is served. Variants expire `ttl`
+    seconds after they were generated and the least recently used key is evicted past
+    `max_keys`.
+
+    Worker processes of the prefork server share the SQLite file but each keeps its own
+    copy of the entries, so a lookup that misses in memory and every put first reload
+    the key from SQLite: texts another worker stored are served here too.
+    """
+
+    def __init__(self, path, max_keys=2000, ttl=7 * 24 * 3600, variants=3, min_variants=None):
+        self.path = path
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self.variants = variants
+        self.min_variants = variants if min_variants is None else min_variants
+        self.entries = OrderedDict()  # key -> [(created, text)], least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reloads = 0
+        self.lock = threading.Lock()
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT NOT NULL, created REAL NOT NULL, text TEXT NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_key ON responses (key)")
+        self.db.execute("DELETE FROM responses WHERE created < ?", (time.time() - ttl,))
+        self.db.commit()
+        self._load()
+
+    def reopen(self):
+        # For a forked worker process: the parent's SQLite connection must not be shared
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+
+    def _reload(self, key, now):
+        # The key's fresh variants as stored in SQLite, where other processes may have added some
+        variants = self.db.execute("SELECT created, text FROM responses WHERE key = ? AND created >= ? ORDER BY created",
+                                   (key, now - self.ttl)).fetchall()
+        if not variants:
+            self.entries.pop(key, None)
+            return []
+        if key not in self.entries:
+            self.reloads += 1
+        self.entries[key] = variants
+        if len(self.entries) > self.max_keys:
+            while len(self.entries) > self.max_keys:
+                self._evict()
+            self.db.commit()
+        return variants
+
+    def _load(self):
+        rows = self.db.execute("SELECT key, created, text FROM responses ORDER BY created").fetchall()
+        for key, created, text in rows:
+            self.entries.setdefault(key, []).append((created, text))
+            self.entries.move_to_end(key)
+        while len(self.entries) > self.max_keys:
+            self._evict()
+        self.db.commit()
+        logging.info("Loaded %s cached GPT responses for %s prompts from %s", len(rows), len(self.entries), self.path)
+
+    def _evict(self):
+        key, _ = self.entries.popitem(last=False)
+        self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+        self.evictions += 1
+
+    def _fresh(self, key, now):
+        variants = [(created, text) for created, text in self.entries.get(key, []) if now - created < self.ttl]
+        if key in self.entries and len(variants) < len(self.entries[key]):
+            self.db.execute("DELETE FROM responses WHERE key = ? AND created < ?", (key, now - self.ttl))
+            self.db.commit()
+            self.entries[key] = variants
+        return variants
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            variants = self._fresh(key, now)
+            if len(variants) < self.min_variants:
+                variants = self._reload(key, now)
+            if not variants or len(variants) < self.min_variants:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return random.choice(variants)[1]
+
+    def has(self, key):
+        # True when a lookup would hit, without counting it as one
+        now = time.time()
+        with self.lock:
+            variants = self._fresh(key, now)
+            if len(variants) < self.min_variants:
+                variants = self._reload(key, now)
+            return bool(variants) and len(variants) >= self.min_variants
+
+    def created_times(self, key):
+        # When each fresh variant of `key` was generated, oldest first
+        now = time.time()
+        with self.lock:
+            variants = self._fresh(key, now)
+            if len(variants) < self.variants:
+                variants = self._reload(key, now)
+            return [created for created, _ in variants]
+
+    def put(self, key, text):
+        now = time.time()
+        with self.lock:
+            self._fresh(key, now)
+            variants = self._reload(key, now)
+            if len(variants) >= self.variants:
+                # Replace the oldest variant so texts keep rotating
+                oldest = variants.pop(0)
+                self.db.execute("DELETE FROM responses WHERE key = ? AND created = ?", (key, oldest[0]))
+            variants.append((now, text))
+            self.entries[key] = variants
+            self.entries.move_to_end(key)
+            self.db.execute("INSERT INTO responses (key, created, text) VALUES (?, ?, ?)", (key, now, text))
+            while len(self.entries) > self.max_keys:
+                self._evict()
+            self.db.commit()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'keys': len(self.entries),
+                'responses': sum(len(variants) for variants in self.entries.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'reloads': self.reloads,  # keys first found in SQLite, e.g. stored by another worker
+            }
@@ -0,0 +1,63 @@
+# Production serving of bartender.py: preforked gunicorn workers behind nginx.
+#
+#   gunicorn -c gunicorn.conf.py bartender:app
+#
+# The app is imported once in the master, so the catalog, its scoring engines, the question
+# payloads and the caches are built before forking and the workers share those pages
+# copy-on-write. Threads and database connections don't survive fork: every worker sets up
+# its own in post_fork (bartender.after_fork) and warms up before it takes requests.
+#
+# Zero-downtime deploy of new code or dictionaries: `kill -USR2 <master pid>` starts a new
+# master (which preloads everything again) next to the old one; once /api/ready answers
+# 200 from the new workers, `kill -TERM <old master pid>` lets the old workers finish their
+# requests and exit. `kill -HUP <master pid>` only replaces the workers, with the master's
+# old catalog (until their polling picks up the files again).
+#
+# New dictionaries alone are picked up by every worker polling the files (every
+# CATALOG_RELOAD_INTERVAL seconds); `kill -HUP <worker pid>` makes that one worker reload
+# right away, see post_worker_init.
+import glob
+import multiprocessing
+import os
+import tempfile
+
+# Tells bartender.py not to start its background threads in the master
+os.environ["BARTENDER_PREFORK"] = "1"
+# Where the workers leave their metrics for each other, so a scrape of any one of them covers all
+os.environ.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(), f"bartender-metrics-{os.getuid()}"))
+
+bind = os.getenv("BIND", "127.0.0.1:5012")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+# Threaded workers: requests mostly wait on OpenAI, a streamed answer holds its thread
+# until the last token, and unlike sync workers they keep connections alive
+worker_class = "gthread"
+threads = int(os.getenv("WORKER_THREADS", "16"))
+# Longer than nginx keeps idle upstream connections, so nginx is the one closing them
+keepalive = int(os.getenv("KEEPALIVE", "75"))
+preload_app = True
+timeout = 60
+graceful_timeout = 30
+
+# In-memory sessions would be split between the workers
+if os.environ.setdefault("SESSION_BACKEND", "sqlite") == "memory" and workers > 1:
+    raise SystemExit("SESSION_BACKEND=memory keeps sessions per process; use sqlite or redis with several workers")
+
+
+def on_starting(server):
+    # Counters start over with a new master, not with the last run's files
+    for path in glob.glob(os.path.join(os.environ["METRICS_DIR"], "*.json")):
+        os.remove(path)
+
+
+def post_fork(server, worker):
+    import bartender
+
+    bartender.after_fork()
+
+
+def post_worker_init(worker):
+    # The worker resets every signal handler after post_fork (SIGHUP back to the default,
+    # which would end it), so put the catalog reload back
+    import bartender
+
+    bartender.install_reload_signal()
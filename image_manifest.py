@@ -0,0 +1,298 @@
+# Builds the drink images for the web and a manifest the backend puts in the recommendations.
+#
+#   python image_manifest.py main_drinks.json systembolagetdict.json --images images -o /var/www/html/images/dist
+#
+# Every Image_name / Image_Icon of the drinks dictionaries is resolved to a file in the
+# images directory, also when the names don't match exactly (other extension, case,
+# spaces vs underscores, or the mangled Swedish letters of files that went through a zip
+# tool). Each file is resized to a few widths and written as WebP, and AVIF when Pillow
+# supports it, under content-hashed names that never change, so they can be cached for a
+# year. manifest.json maps every catalog image name to its derivatives; sources that did
+# not change since the last build are not encoded again. Needs Pillow (build time only).
+import argparse
+import concurrent.futures
+import difflib
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import sys
+import time
+import unicodedata
+
+MANIFEST_VERSION = 1
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.gif')
+# Widths of the derivatives: drink photos fill half the result dialog, icons are small badges
+PHOTO_WIDTHS = (480, 960)
+ICON_WIDTHS = (128, 256)
+QUALITY = {'webp': 80, 'avif': 55}
+# Encoder effort: WebP method 6 and AVIF's default speed take 5-20x longer for a few percent less
+EFFORT = {'webp': {'method': 4}, 'avif': {'speed': 8}}
+MIME_TYPES = {'webp': 'image/webp', 'avif': 'image/avif'}
+
+
+def _stem(name):
+    base, extension = os.path.splitext(name)
+    return base if extension.lower() in IMAGE_EXTENSIONS else name
+
+
+def match_key(name):
+    # Case, extension, spaces and punctuation don't matter
+    name = unicodedata.normalize('NFC', _stem(name)).casefold()
+    return re.sub(r'[\W_]+', '', name)
+
+
+def ascii_key(name):
+    # Only the ASCII letters and digits; the last resort for names with mangled non-ASCII letters
+    return re.sub(r'[^a-z0-9]+', '', _stem(name).casefold())
+
+
+def zip_mangled(name):
+    # How the file names of the images directory came out of a zip tool: UTF-8 read as
+    # cp437, with the box drawing characters turned into '+'
+    mangled = unicodedata.normalize('NFC', name).encode('utf-8').decode('cp437')
+    return re.sub('[─-╿]', '+', mangled)
+
+
+def decode_filename(raw):
+    try:
+        return raw.decode('utf-8')
+    except UnicodeDecodeError:
+        return raw.decode('latin-1')
+
+
+class ImageResolver:
+    """Finds the file in `directory` a catalog image name refers to."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.by_name = {}
+        self.by_key = {}
+        self.by_ascii_key = {}
+        for raw in sorted(os.listdir(os.fsencode(directory))):
+            name = decode_filename(raw)
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            path = os.path.join(os.fsencode(directory), raw)
+            self.by_name[unicodedata.normalize('NFC', name)] = path
+            self.by_key.setdefault(match_key(name), []).append(path)
+            self.by_ascii_key.setdefault(ascii_key(name), []).append(path)
+
+    def resolve(self, reference):
+        """
+        Returns (path, how) with how one of 'exact', 'normalized', 'mangled', 'ascii' or
+        'fuzzy', or (None, None) when no file matches.
+        """
+        reference = unicodedata.normalize('NFC', reference)
+        if reference in self.by_name:
+            return self.by_name[reference], 'exact'
+        for candidate, how in ((reference, 'normalized'), (zip_mangled(reference), 'mangled')):
+            paths = self.by_key.get(match_key(candidate))
+            if paths:
+                return paths[0], how
+        paths = self.by_ascii_key.get(ascii_key(reference), [])
+        if len(paths) == 1:
+            return paths[0], 'ascii'
+        # Typos, but an icon must not end up as the photo or the other way around
+        key = match_key(reference)
+        candidates = [other for other in self.by_key if other.endswith('icon') == key.endswith('icon')]
+        close = difflib.get_close_matches(key, candidates, n=1, cutoff=0.92)
+        if close:
+            return self.by_key[close[0]][0], 'fuzzy'
+        return None, None
+
+
+def catalog_references(catalog_paths):
+    # {image name: 'icon' or 'photo'} for every image the drinks dictionaries mention
+    references = {}
+    for path in catalog_paths:
+        with open(path, 'r') as file:
+            for drink in json.load(file):
+                if drink.get('Image_name'):
+                    references.setdefault(drink['Image_name'], 'photo')
+                if drink.get('Image_Icon'):
+                    references[drink['Image_Icon']] = 'icon'
+    return references
+
+
+def slug(path):
+    return ascii_key(decode_filename(os.path.basename(path)))[:40] or 'image'
+
+
+def encode(image, width, image_format):
+    from PIL import Image
+
+    if image.width > width:
+        image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, image_format.upper(), quality=QUALITY[image_format], **EFFORT[image_format])
+    return buffer.getvalue()
+
+
+def build_derivatives(source, digest, kind, out_dir, url_prefix, formats):
+    # Manifest entry for one source file, writing its derivatives to out_dir
+    from PIL import Image
+
+    with Image.open(source) as opened:
+        image = opened.convert('RGBA' if opened.mode in ('RGBA', 'LA', 'P') else 'RGB')
+    wanted = PHOTO_WIDTHS if kind == 'photo' else ICON_WIDTHS
+    widths = [width for width in wanted if width < image.width] + [min(image.width, wanted[-1])]
+
+    entry = {'width': min(image.width, wanted[-1]),
+             'height': round(image.height * min(image.width, wanted[-1]) / image.width),
+             'sources': []}
+    for image_format in formats:
+        srcset = []
+        for width in sorted(set(widths)):
+            data = encode(image, width, image_format)
+            name = f"{slug(source)}-{width}.{hashlib.sha256(data).hexdigest()[:12]}.{image_format}"
+            with open(os.path.join(out_dir, name), 'wb') as out:
+                out.write(data)
+            srcset.append((width, url_prefix + name))
+        entry['sources'].append({'type': MIME_TYPES[image_format],
+                                 'srcset': ', '.join(f"{url} {width}w" for width, url in srcset)})
+        if image_format == 'webp':
+            entry['src'] = srcset[-1][1]
+    entry.update(source=decode_filename(os.path.basename(source)), source_sha256=digest, kind=kind)
+    return entry
+
+
+def derivative_files(entry):
+    return [url.rsplit('/', 1)[-1] for source in entry['sources']
+            for url, _ in (item.rsplit(' ', 1) for item in source['srcset'].split(', '))]
+
+
+def build_manifest(catalog_paths, images_dir, out_dir, url_prefix='/api/images/dist/', prune=False, jobs=None):
+    from PIL import features
+
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, 'manifest.json')
+    formats = ['avif', 'webp'] if features.check('avif') else ['webp']
+    settings = {'formats': formats, 'photo_widths': PHOTO_WIDTHS, 'icon_widths': ICON_WIDTHS,
+                'quality': QUALITY, 'effort': EFFORT, 'url_prefix': url_prefix}
+    settings = json.loads(json.dumps(settings))
+
+    # Entries of the previous build, reused when the source and the settings are the same
+    previous = {}
+    try:
+        with open(manifest_path, 'r') as file:
+            old = json.load(file)
+        if old.get('settings') == settings:
+            previous = {(entry['source_sha256'], entry['kind']): entry for entry in old['images'].values()}
+    except (OSError, ValueError, KeyError):
+        pass
+
+    resolver = ImageResolver(images_dir)
+    sources, unresolved, inexact = {}, [], {}
+    for reference, kind in sorted(catalog_references(catalog_paths).items()):
+        path, how = resolver.resolve(reference)
+        if path is None:
+            unresolved.append(reference)
+            continue
+        if how not in ('exact', 'normalized'):
+            inexact[reference] = decode_filename(os.path.basename(path))
+        with open(path, 'rb') as file:
+            digest = hashlib.sha256(file.read()).hexdigest()
+        sources[reference] = (path, digest, kind)
+
+    built = {}
+    to_build = {}
+    for path, digest, kind in sources.values():
+        entry = previous.get((digest, kind))
+        if entry is not None and all(os.path.exists(os.path.join(out_dir, name)) for name in derivative_files(entry)):
+            built[digest, kind] = entry
+        else:
+            to_build[digest, kind] = path
+    # Encoding is CPU bound, so the sources are spread over processes
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {key: executor.submit(build_derivatives, path, key[0], key[1], out_dir, url_prefix, formats)
+                   for key, path in to_build.items()}
+        for key, future in futures.items():
+            built[key] = future.result()
+    images = {reference: built[digest, kind] for reference, (_, digest, kind) in sources.items()}
+
+    manifest = {'version': MANIFEST_VERSION, 'settings': settings, 'images': images,
+                'unresolved': unresolved, 'inexact_matches': inexact, 'encoded': len(to_build)}
+    # Written next to the old one and renamed, so the backend never reads half a manifest
+    with open(manifest_path + '.tmp', 'w') as out:
+        json.dump(manifest, out, indent=1, ensure_ascii=False)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+    if prune:
+        # Only once no deployed manifest refers to the old files any more
+        keep = {name for entry in images.values() for name in derivative_files(entry)} | {'manifest.json'}
+        for name in os.listdir(out_dir):
+            if name not in keep:
+                os.remove(os.path.join(out_dir, name))
+    return manifest
+
+
+class ImageManifest:
+    """
+    The manifest written by build_manifest, as read by the backend.
+
+    `images_for(drink)` gives the derivatives of a drink's photo and icon. A missing
+    manifest is not an error: drinks then just come without them. `refresh` re-reads
+    the file when it changed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.version = None
+        self.images = {}
+        self.refresh()
+
+    def refresh(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        version = (stat.st_mtime_ns, stat.st_size)
+        if version == self.version:
+            return False
+        try:
+            with open(self.path, 'r') as file:
+                self.images = json.load(file)['images']
+        except (OSError, ValueError, KeyError) as e:
+            logging.error("Could not read image manifest %s: %s", self.path, e)
+            return False
+        self.version = version
+        logging.info("Loaded image manifest %s with %d images", self.path, len(self.images))
+        return True
+
+    def images_for(self, drink):
+        images = self.images
+        return {
+            'image': images.get(drink.get('Image_name')),
+            'icon': images.get(drink.get('Image_Icon')),
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build resized, content-hashed drink images and their manifest.")
+    parser.add_argument('catalogs', nargs='+', help="drinks dictionaries (main_drinks.json, systembolagetdict.json)")
+    parser.add_argument('--images', default='images', help="directory with the source images (default: images)")
+    parser.add_argument('-o', '--out', default='images/dist', help="output directory (default: images/dist)")
+    parser.add_argument('--url-prefix', default='/api/images/dist/', help="URL the output directory is served at")
+    parser.add_argument('--prune', action='store_true', help="delete output files the new manifest doesn't use")
+    parser.add_argument('--jobs', type=int, help="encoding processes (default: one per CPU)")
+    parser.add_argument('--strict', action='store_true', help="exit non-zero when an image can't be resolved")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    manifest = build_manifest(args.catalogs, args.images, args.out, args.url_prefix, args.prune, args.jobs)
+    for reference, source in sorted(manifest['inexact_matches'].items()):
+        print(f"  {reference} -> {source}")
+    for reference in manifest['unresolved']:
+        print(f"  {reference}: no matching file")
+    print(f"Wrote {os.path.join(args.out, 'manifest.json')} ({len(manifest['images'])} images, "
+          f"{len(manifest['unresolved'])} unresolved, {manifest['encoded']} encoded, "
+          f"formats: {', '.join(manifest['settings']['formats'])}) "
+          f"in {time.perf_counter() - started:.2f}s")
+    return 1 if args.strict and manifest['unresolved'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,140 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+
+# Attributes every LogRecord has; anything else came in through `extra=` and goes into the JSON
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, the `extra=` fields and any traceback."""
+
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Lets through every record above `level` and a `rate` fraction of the ones at or below it."""
+
+    def __init__(self, rate, level=logging.DEBUG):
+        super().__init__()
+        self.rate = rate
+        self.level = level
+        self.dropped = 0
+
+    def filter(self, record):
+        if record.levelno > self.level or self.rate >= 1 or random.random() < self.rate:
+            return True
+        self.dropped += 1
+        return False
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to a bounded queue without formatting them; the listener thread does that.
+
+    When the queue is full the record is dropped and counted instead of making the request
+    wait for the log writer. Arguments are formatted later, so they should not be objects
+    the request goes on to change.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """The queued JSON logging of one process: a queue handler on the root logger and its writer thread."""
+
+    def __init__(self, level=logging.INFO, sample_rate=1.0, queue_size=10000, stream=None):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.handler = NonBlockingQueueHandler(self.queue)
+        self.sampler = SamplingFilter(sample_rate)
+        self.handler.addFilter(self.sampler)
+        writer = logging.StreamHandler(stream or sys.stderr)
+        writer.setFormatter(JsonFormatter())
+        self.listener = logging.handlers.QueueListener(self.queue, writer)
+        self.level = level
+        self.running = False
+
+    def install(self):
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        root.setLevel(self.level)
+        self.listener.start()
+        self.running = True
+        atexit.register(self.stop)
+
+    def stop(self):
+        # Writes out what is still queued
+        if self.running:
+            self.running = False
+            try:
+                self.listener.stop()
+            except queue.Full:
+                pass
+
+    def after_fork(self):
+        # Only the forking thread survives fork: a new queue and writer thread for the child
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self.handler.queue = self.queue
+        self.listener = logging.handlers.QueueListener(self.queue, *self.listener.handlers)
+        self.listener.start()
+        self.running = True
+
+    def stats(self):
+        return {
+            'queued': self.queue.qsize(),
+            'dropped_queue_full': self.handler.dropped,
+            'dropped_sampled': self.sampler.dropped,
+        }
+
+
+def configure_logging():
+    """
+    Sets up logging from LOG_MODE, LOG_LEVEL and LOG_DEBUG_SAMPLE_RATE.
+
+    LOG_MODE=text (the default) logs plain lines from the calling thread. LOG_MODE=json
+    queues records and writes them as JSON lines on a background thread, keeping only a
+    LOG_DEBUG_SAMPLE_RATE fraction of the debug records. Returns the LogPipeline in json
+    mode, None otherwise.
+    """
+    level = getattr(logging, os.getenv("LOG_LEVEL", "DEBUG").upper(), logging.DEBUG)
+    if os.getenv("LOG_MODE", "text") != "json":
+        logging.basicConfig(level=level, format='%(levelname)s:%(name)s:%(message)s')
+        logging.getLogger().setLevel(level)
+        return None
+
+    pipeline = LogPipeline(level, sample_rate=float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1")))
+    pipeline.install()
+    return pipeline
@@ -0,0 +1,252 @@
+import bisect
+import functools
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+# Seconds, from a cached answer to a slow GPT completion
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Histogram:
+    """
+    Prometheus histogram. `observe` only does a bisect and a few additions under a lock;
+    counts are kept per bucket and only made cumulative when the metrics are rendered.
+    """
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}  # label values -> [count per bucket..., +Inf count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        slot = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.series.get(label_values)
+            if counts is None:
+                counts = self.series[label_values] = [0] * (len(self.buckets) + 2)
+            counts[slot] += 1
+            counts[-1] += value
+
+    def timed(self, *label_values):
+        # Decorator recording how long every call of the function takes
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - started, *label_values)
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        with self.lock:
+            return [(values, list(counts)) for values, counts in self.series.items()]
+
+    @staticmethod
+    def merge(snapshots):
+        merged = {}
+        for series in snapshots:
+            for values, counts in series:
+                total = merged.setdefault(tuple(values), [0] * len(counts))
+                for slot, count in enumerate(counts):
+                    total[slot] += count
+        return list(merged.items())
+
+    def render(self, series=None):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        if series is None:
+            series = self.snapshot()
+        for values, counts in sorted(series):
+            total = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                total += count
+                le = '+Inf' if bound == float('inf') else _number(bound)
+                lines.append(f'{self.name}_bucket{_labels(self.label_names + ("le",), values + (le,))} {total}')
+            lines.append(f'{self.name}_sum{_labels(self.label_names, values)} {_number(counts[-1])}')
+            lines.append(f'{self.name}_count{_labels(self.label_names, values)} {total}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.series.items())
+
+    @staticmethod
+    def merge(snapshots):
+        merged = {}
+        for series in snapshots:
+            for values, value in series:
+                merged[tuple(values)] = merged.get(tuple(values), 0) + value
+        return list(merged.items())
+
+    def render(self, series=None):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        series = sorted(self.snapshot() if series is None else series)
+        lines.extend(f'{self.name}{_labels(self.label_names, values)} {_number(value)}' for values, value in series)
+        return lines
+
+
+class Gauge:
+    """A gauge whose value is read from `function` when the metrics are rendered."""
+
+    def __init__(self, name, help, function):
+        self.name = name
+        self.help = help
+        self.function = function
+
+    def snapshot(self):
+        return self.function()
+
+    def render(self, series=None):
+        # `series` is [(pid, value)] of the live processes, each rendered with a pid label
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        if series is None:
+            value = self.function()
+            if value is not None:
+                lines.append(f'{self.name} {_number(value)}')
+            return lines
+        lines.extend(f'{self.name}{_labels(("pid",), (pid,))} {_number(value)}'
+                     for pid, value in sorted(series) if value is not None)
+        return lines
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Registry:
+    """
+    The metrics of one process, rendered in the Prometheus text exposition format.
+
+    With a `directory`, the processes of the prefork server add up: each one writes its
+    samples to <directory>/<pid>.json every `dump_interval` seconds (and when it is
+    scraped), and a scrape of any of them renders counters and histograms summed over
+    every file, those of exited workers included, and the gauges of the live processes
+    with a pid label.
+    """
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, directory=None, dump_interval=5.0):
+        self.metrics = []
+        self.directory = directory
+        self.dump_interval = dump_interval
+        self.thread = None
+        self.stopping = threading.Event()
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name, help, function):
+        return self._add(Gauge(name, help, function))
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def snapshot(self):
+        samples = {}
+        for metric in self.metrics:
+            try:
+                samples[metric.name] = metric.snapshot()
+            except Exception:
+                samples[metric.name] = None  # a gauge that can't be read right now
+        return samples
+
+    def dump(self):
+        # Written under a temporary name and renamed, so readers never see half a file
+        samples = self.snapshot()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        with open(path + '.tmp', 'w') as out:
+            json.dump(samples, out, separators=(',', ':'))
+        os.replace(path + '.tmp', path)
+        return samples
+
+    def _run(self):
+        while not self.stopping.wait(self.dump_interval):
+            try:
+                self.dump()
+            except Exception as e:
+                logging.error("Could not write metrics to %s: %s", self.directory, e)
+
+    def start(self):
+        if self.directory and (self.thread is None or not self.thread.is_alive()):
+            self.thread = threading.Thread(target=self._run, name='metrics-dump', daemon=True)
+            self.thread.start()
+
+    def after_fork(self):
+        self.thread = None
+
+    def _processes(self):
+        # {pid: samples} of every process that wrote to the directory, this one freshly dumped
+        processes = {os.getpid(): self.dump()}
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                pid = int(os.path.basename(path)[:-len('.json')])
+                if pid not in processes:
+                    with open(path) as file:
+                        processes[pid] = json.load(file)
+            except (OSError, ValueError):
+                continue
+        return processes
+
+    def render(self):
+        processes = self._processes() if self.directory else None
+        lines = []
+        for metric in self.metrics:
+            try:
+                if processes is None:
+                    lines.extend(metric.render())
+                elif isinstance(metric, Gauge):
+                    lines.extend(metric.render([(pid, samples.get(metric.name)) for pid, samples in processes.items()
+                                                if _alive(pid)]))
+                else:
+                    lines.extend(metric.render(metric.merge(samples.get(metric.name) or [] for samples in processes.values())))
+            except Exception as e:
+                # A failing gauge (e.g. the session server is down) shouldn't break the whole scrape
+                lines.append(f'# {metric.name} unavailable: {type(e).__name__}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,199 @@
+# Profiling of the running backend, for when answers get slow in production.
+#
+# StackSampler looks at the stack of every thread a few dozen times a second and counts
+# them, cheap enough to leave on; its dump is in the collapsed-stack format flame graph
+# tools read (flamegraph.pl, speedscope, ...):
+#
+#   curl -H "X-Admin-Key: $ADMIN_KEY" localhost:5012/api/profile/stacks > stacks.txt
+#   flamegraph.pl stacks.txt > stacks.svg
+#
+# RequestProfiles runs cProfile over single requests that ask for it with an X-Profile
+# header, and keeps the newest profiles as pstats files next to each other, so every
+# worker process can serve them.
+import cProfile
+import io
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+
+def frame_label(code):
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class StackSampler:
+    """
+    Counts the stacks of all threads, sampled every `interval` seconds by a background thread.
+
+    A stack is folded into "thread;outermost frame;...;innermost frame", the thread
+    named without its numbers so the threads of a pool add up. At most `max_stacks`
+    distinct stacks are kept; samples of new stacks past that are only counted as
+    dropped. Idle threads are sampled too (a worker thread waiting for a request sits
+    in queue.get), so they show up as towers of their own next to the busy ones.
+    """
+
+    def __init__(self, interval=0.02, max_stacks=20000, max_depth=100):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.labels = {}  # code object -> frame label
+        self.samples = 0
+        self.dropped = 0
+        self.sampling_seconds = 0.0
+        self.started_at = None
+        self.thread = None
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+
+    def _label(self, code):
+        label = self.labels.get(code)
+        if label is None:
+            label = self.labels[code] = frame_label(code)
+        return label
+
+    def sample(self):
+        started = time.perf_counter()
+        names = {thread.ident: re.sub(r'[-_]?\d+', '', thread.name) for thread in threading.enumerate()}
+        own = threading.get_ident()
+        folded = []
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            frames = []
+            while frame is not None and len(frames) < self.max_depth:
+                frames.append(self._label(frame.f_code))
+                frame = frame.f_back
+            frames.append(names.get(ident, 'thread'))
+            folded.append(';'.join(reversed(frames)))
+        with self.lock:
+            for stack in folded:
+                if stack in self.stacks or len(self.stacks) < self.max_stacks:
+                    self.stacks[stack] += 1
+                else:
+                    self.dropped += 1
+            self.samples += 1
+            self.sampling_seconds += time.perf_counter() - started
+
+    def _run(self):
+        while not self.stopping.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stopping.clear()
+            self.started_at = time.monotonic()
+            self.thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+
+    def reset(self):
+        with self.lock:
+            self.stacks.clear()
+            self.samples = 0
+            self.dropped = 0
+            self.sampling_seconds = 0.0
+            self.started_at = time.monotonic()
+
+    def after_fork(self):
+        # The parent's samples are the parent's
+        self.thread = None
+        self.reset()
+
+    def collapsed(self, match=None):
+        """The counted stacks as "frame;frame;... count" lines, optionally only those containing `match`."""
+        with self.lock:
+            stacks = self.stacks.most_common()
+        return ''.join(f"{stack} {count}\n" for stack, count in stacks if match is None or match in stack)
+
+    def stats(self):
+        with self.lock:
+            elapsed = time.monotonic() - self.started_at if self.started_at is not None else 0.0
+            return {
+                'sampling': self.thread is not None and self.thread.is_alive(),
+                'interval_seconds': self.interval,
+                'samples': self.samples,
+                'stacks': len(self.stacks),
+                'dropped': self.dropped,
+                'seconds': round(elapsed, 3),
+                # Share of wall time the sampler thread spent sampling
+                'overhead': round(self.sampling_seconds / elapsed, 5) if elapsed else 0.0,
+            }
+
+
+class RequestProfiles:
+    """
+    cProfile runs over single requests, saved as pstats files in `directory`.
+
+    One request is profiled at a time: `start` returns None while another profile is
+    running. Only the thread that started a profile is profiled, so the time a request
+    waits on OpenAI calls made in other threads shows up as waiting on their futures.
+    The newest `keep` profiles are kept.
+    """
+
+    def __init__(self, directory, keep=50):
+        self.directory = directory
+        self.keep = keep
+        self.running = threading.Lock()
+        self.count = 0
+
+    def start(self, label):
+        # (profile id, profiler) of a new profile, None while another one is running
+        if not self.running.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Some other profiler is active in this process
+            self.running.release()
+            return None
+        self.count += 1
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.gmtime())
+        label = re.sub(r'[^A-Za-z0-9]+', '_', label).strip('_')
+        return f"{stamp}-{os.getpid()}-{self.count}-{label}", profiler
+
+    def finish(self, profile_id, profiler):
+        # Stops the profile (from the thread that started it) and saves it
+        try:
+            profiler.disable()
+        finally:
+            self.running.release()
+        os.makedirs(self.directory, exist_ok=True)
+        profiler.dump_stats(os.path.join(self.directory, profile_id + '.prof'))
+        self._prune()
+
+    def _prune(self):
+        paths = sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith('.prof'))
+        for path in paths[:-self.keep]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # another worker pruned it first
+
+    def list(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted((name[:-len('.prof')] for name in os.listdir(self.directory) if name.endswith('.prof')), reverse=True)
+
+    def path(self, profile_id):
+        # None for ids that aren't a saved profile (including anything trying to leave the directory)
+        if not re.fullmatch(r'[A-Za-z0-9_-]+', profile_id):
+            return None
+        path = os.path.join(self.directory, profile_id + '.prof')
+        return os.path.abspath(path) if os.path.isfile(path) else None
+
+    def report(self, profile_id, sort='cumulative', limit=40):
+        path = self.path(profile_id)
+        if path is None:
+            return None
+        out = io.StringIO()
+        stats = pstats.Stats(path, stream=out)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        return out.getvalue()
@@ -0,0 +1,118 @@
+import logging
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: no prefork server there, every process warms
+    fcntl = None
+
+
+class QuipWarmer:
+    """
+    Keeps a ResponseCache stocked with GPT texts for a fixed set of prompts.
+
+    A background thread goes over the prompts, those with the fewest variants first, and
+    generates one more text for every prompt that has fewer than `cache.variants` of them
+    or whose oldest variant is older than `refresh_after` seconds. Adding to a full prompt
+    replaces its oldest variant, so the texts keep rotating. Calls are spaced out to stay
+    under `calls_per_minute`, and a pass is skipped while `paused()` is true (e.g. while
+    the OpenAI circuit breaker is open).
+
+    With a `lock_path`, only the process holding an exclusive lock on that file warms, so
+    the worker processes sharing the cache don't each pay for the same texts; the others
+    retry the lock every `interval` and take over when the warming process exits.
+    """
+
+    def __init__(self, cache, prompts, generate, refresh_after=6 * 3600, calls_per_minute=30,
+                 interval=60.0, paused=lambda: False, lock_path=None):
+        self.cache = cache
+        self.prompts = prompts    # () -> iterable of prompts
+        self.generate = generate  # (prompt) -> text, raises on failure
+        self.refresh_after = refresh_after
+        self.calls_per_minute = calls_per_minute
+        self.interval = interval
+        self.paused = paused
+        self.lock_path = lock_path
+        self.lock_file = None
+        self.leader = False
+        self.thread = None
+        self.stopping = threading.Event()
+        self.passes = 0
+        self.generated = 0
+        self.failures = 0
+        self.last_error = None
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, name='quip-warmer', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+
+    def due(self, now=None):
+        # Prompts that need another variant, the emptiest first
+        now = now or time.time()
+        due = []
+        for prompt in self.prompts():
+            created = self.cache.created_times(prompt)
+            if len(created) < self.cache.variants or now - created[0] >= self.refresh_after:
+                due.append((len(created), prompt))
+        return [prompt for _, prompt in sorted(due, key=lambda item: item[0])]
+
+    def warm_once(self):
+        # One pass over the due prompts; returns the number of texts generated
+        generated = 0
+        spacing = 60.0 / self.calls_per_minute if self.calls_per_minute else 0
+        for prompt in self.due():
+            if self.stopping.is_set() or self.paused():
+                break
+            started = time.monotonic()
+            try:
+                self.cache.put(prompt, self.generate(prompt))
+                self.generated += 1
+                generated += 1
+            except Exception as e:
+                self.failures += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                logging.error("Quip warmer call failed: %s", self.last_error)
+            self.stopping.wait(max(0.0, spacing - (time.monotonic() - started)))
+        self.passes += 1
+        return generated
+
+    def leading(self):
+        # Whether this process is the one warming the cache
+        if not self.leader:
+            if self.lock_path is None or fcntl is None:
+                self.leader = True
+            else:
+                lock_file = open(self.lock_path, 'a')
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    self.lock_file = lock_file  # held until the process exits
+                    self.leader = True
+                except OSError:
+                    lock_file.close()
+        return self.leader
+
+    def _run(self):
+        while not self.stopping.is_set():
+            if self.leading() and not self.paused():
+                self.warm_once()
+            self.stopping.wait(self.interval)
+
+    def stats(self):
+        prompts = list(self.prompts())
+        stocked = sum(1 for prompt in prompts if self.cache.created_times(prompt))
+        return {
+            **self.cache.stats(),
+            'prompts': len(prompts),
+            'stocked_prompts': stocked,
+            'passes': self.passes,
+            'generated': self.generated,
+            'failures': self.failures,
+            'last_error': self.last_error,
+            # Only in the process holding the lock
+            'warming': self.thread is not None and self.thread.is_alive() and self.leader,
+        }
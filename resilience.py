@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing service for a while.
+
+    After `failure_threshold` failures in a row the breaker opens and refuses calls
+    for `reset_timeout` seconds. Then a single trial call is let through (half-open):
+    if it succeeds the breaker closes again, if it fails it stays open another period.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.trips = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if not self.trial_running and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.trial_running = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or (self.opened_at is None and self.failures >= self.failure_threshold):
+                if self.opened_at is None:
+                    self.trips += 1
+                    logging.error("Circuit breaker opened after %s failures in a row", self.failures)
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half-open' if self.trial_running else 'open'
+
+    def stats(self):
+        with self.lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'trips': self.trips,
+                'rejected': self.rejected,
+            }
+
+
+class ResilientCaller:
+    """
+    Runs calls to a slow, flaky service within a fixed time budget.
+
+    Every call gets `deadline` seconds. Once enough latencies of a kind of call have
+    been seen, a second (hedged) request is sent when the first one is slower than the
+    `hedge_percentile` of recent calls, and whichever answers first wins. Calls are
+    refused while the circuit breaker is open. `call` and `call_async` return
+    (True, result), or (False, reason) when the caller should fall back.
+    """
+
+    def __init__(self, executor, deadline=8.0, hedge_percentile=0.95, min_samples=20, window=200, breaker=None):
+        self.executor = executor
+        self.deadline = deadline
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.window = window
+        self.breaker = breaker or CircuitBreaker()
+        self.latencies = {}  # kind -> deque of recent successful call durations
+        self.outcomes = {}   # outcome -> count
+        self.lock = threading.Lock()
+
+    def _count(self, outcome):
+        with self.lock:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def hedge_delay(self, kind):
+        # Seconds after which a hedged request goes out, or None when hedging is off or still learning
+        if not self.hedge_percentile:
+            return None
+        with self.lock:
+            latencies = sorted(self.latencies.get(kind, ()))
+        if len(latencies) < self.min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(self.hedge_percentile * len(latencies)))]
+
+    def _succeeded(self, kind, started, hedged):
+        with self.lock:
+            self.latencies.setdefault(kind, deque(maxlen=self.window)).append(time.monotonic() - started)
+        self.breaker.record_success()
+        self._count('hedged_ok' if hedged else 'ok')
+
+    def _gave_up(self, kind, error):
+        self.breaker.record_failure()
+        reason = 'timeout' if error is None else f"{type(error).__name__}: {error}"
+        self._count('timeout' if error is None else 'error')
+        logging.error("Giving up on %s call: %s", kind, reason)
+        return False, reason
+
+    def call(self, kind, fn, deadline=None):
+        if not self.breaker.allow():
+            self._count('rejected')
+            return False, 'circuit open'
+
+        started = time.monotonic()
+        give_up_at = started + (self.deadline if deadline is None else deadline)
+        hedge_delay = self.hedge_delay(kind)
+        hedge_at = None if hedge_delay is None else started + hedge_delay
+        futures = {self.executor.submit(fn)}
+        hedged = False
+        error = None
+
+        while futures:
+            now = time.monotonic()
+            if now >= give_up_at:
+                break
+            wake_at = give_up_at if hedged or hedge_at is None else min(give_up_at, hedge_at)
+            done, futures = wait(futures, timeout=max(0, wake_at - now), return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                for other in futures:
+                    other.cancel()
+                self._succeeded(kind, started, hedged)
+                return True, result
+            if not done and not hedged and hedge_at is not None and time.monotonic() >= hedge_at:
+                hedged = True
+                self._count('hedges')
+                futures.add(self.executor.submit(fn))
+
+        # Calls still running finish on their own: the client timeout bounds them
+        for future in futures:
+            future.cancel()
+        return self._gave_up(kind, None if futures else error)
+
+    async def call_async(self, kind, coroutine_function, deadline=None):
+        if not self.breaker.allow():
+            self._count('rejected')
+            return False, 'circuit open'
+
+        started = time.monotonic()
+        give_up_at = started + (self.deadline if deadline is None else deadline)
+        hedge_delay = self.hedge_delay(kind)
+        hedge_at = None if hedge_delay is None else started + hedge_delay
+        tasks = {asyncio.ensure_future(coroutine_function())}
+        hedged = False
+        error = None
+
+        try:
+            while tasks:
+                now = time.monotonic()
+                if now >= give_up_at:
+                    break
+                wake_at = give_up_at if hedged or hedge_at is None else min(give_up_at, hedge_at)
+                done, tasks = await asyncio.wait(tasks, timeout=max(0, wake_at - now), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    self._succeeded(kind, started, hedged)
+                    return True, task.result()
+                if not done and not hedged and hedge_at is not None and time.monotonic() >= hedge_at:
+                    hedged = True
+                    self._count('hedges')
+                    tasks.add(asyncio.ensure_future(coroutine_function()))
+        finally:
+            for task in tasks:
+                task.cancel()
+        return self._gave_up(kind, None if tasks else error)
+
+    def stats(self):
+        with self.lock:
+            outcomes = dict(self.outcomes)
+            hedge_delays = {kind: None for kind in self.latencies}
+        for kind in hedge_delays:
+            hedge_delays[kind] = self.hedge_delay(kind)
+        return {
+            'deadline_seconds': self.deadline,
+            'hedge_percentile': self.hedge_percentile,
+            'hedge_after_seconds': hedge_delays,
+            'outcomes': outcomes,
+            'breaker': self.breaker.stats(),
+        }
@@ -0,0 +1,203 @@
+import logging
+import threading
+
+import numpy as np
+
+from catalog import BEER_LEVEL_ALIASES
+from text_index import TextIndex
+
+# Cosine similarities are ranked as integers, with this resolution
+SIMILARITY_SCALE = 1_000_000
+
+
+class CategoryFeatures:
+    """
+    Column arrays for every drink of one category of a CatalogIndex.
+
+    Each drink's flavor tokens are packed into a bitmask (one bit per token in the
+    category's vocabulary, 64 tokens per uint64 word), next to the rows of every level
+    and small-int codes for the occasion.
+    """
+
+    def __init__(self, index, category):
+        self.positions = np.array(index.categories[category], dtype=np.int64)
+        rows = {position: row for row, position in enumerate(index.categories[category])}
+        n = len(self.positions)
+
+        self.flavor_vocab = sorted({token for position in self.positions for token in index.flavor_tokens[position]})
+        columns = {token: column for column, token in enumerate(self.flavor_vocab)}
+        words = max(1, (len(self.flavor_vocab) + 63) // 64)
+        self.flavor_bits = np.zeros((n, words), dtype=np.uint64)
+        for row, position in enumerate(self.positions):
+            for token in index.flavor_tokens[position]:
+                column = columns[token]
+                self.flavor_bits[row, column // 64] |= np.uint64(1 << (column % 64))
+
+        # Row numbers per level, in file order
+        self.level_rows = {}
+        for (level_category, level), positions in index.levels.items():
+            if level_category == category:
+                self.level_rows[level] = np.array([rows[position] for position in positions], dtype=np.int64)
+
+        self.occasion_vocab = sorted(index.occasion_postings[category])
+        self.occasion_codes = np.zeros(n, dtype=np.int16)
+        for code, occasion in enumerate(self.occasion_vocab):
+            for position in index.occasion_postings[category][occasion]:
+                self.occasion_codes[rows[position]] = code
+
+    @classmethod
+    def from_arrays(cls, positions, flavor_vocab, flavor_bits, level_rows, occasion_vocab, occasion_codes):
+        # Rebuild from columns stored by catalog_compiler (which may be read-only memory maps)
+        features = cls.__new__(cls)
+        features.positions = positions
+        features.flavor_vocab = flavor_vocab
+        features.flavor_bits = flavor_bits
+        features.level_rows = level_rows
+        features.occasion_vocab = occasion_vocab
+        features.occasion_codes = occasion_codes
+        return features
+
+    def flavor_mask(self, flavor):
+        # Bits of every vocabulary token the preference is a substring of
+        mask = np.zeros(self.flavor_bits.shape[1], dtype=np.uint64)
+        for column, token in enumerate(self.flavor_vocab):
+            if flavor in token:
+                mask[column // 64] |= np.uint64(1 << (column % 64))
+        return mask
+
+    def flavor_scores(self, rows, flavor_preferences, memo=None, bucket=None):
+        # `memo` shares the per-flavor match vectors of one bucket between the tuples of a batch
+        bits = None
+        scores = np.zeros(len(rows), dtype=np.int32)
+        for flavor in flavor_preferences:
+            key = (self, bucket, flavor)
+            matches = memo.get(key) if memo is not None else None
+            if matches is None:
+                if not flavor:
+                    matches = np.ones(len(rows), dtype=bool)
+                else:
+                    if bits is None:
+                        bits = self.flavor_bits[rows]
+                    matches = (bits & self.flavor_mask(flavor)).any(axis=1)
+                if memo is not None:
+                    memo[key] = matches
+            scores += matches
+        return scores
+
+    def occasion_matches(self, rows, occasion, memo=None, bucket=None):
+        key = (self, bucket, 'occasion', occasion)
+        matches = memo.get(key) if memo is not None else None
+        if matches is None:
+            codes = [code for code, drink_occasion in enumerate(self.occasion_vocab) if occasion in drink_occasion]
+            matches = np.isin(self.occasion_codes[rows], codes)
+            if memo is not None:
+                memo[key] = matches
+        return matches
+
+
+def top_k_rows(rows, keys, k):
+    """Rows with the highest keys, best first; ties go to the row that comes first in the file."""
+    if len(rows) == 0:
+        return rows
+    # Fold the file order into the key so argpartition never has to break ties
+    ranked = keys.astype(np.int64) * len(rows) + np.arange(len(rows) - 1, -1, -1, dtype=np.int64)
+    if k < len(rows):
+        top = np.argpartition(-ranked, k - 1)[:k]
+    else:
+        top = np.arange(len(rows))
+    top = top[np.argsort(-ranked[top])]
+    return rows[top]
+
+
+class ScoringEngine:
+    """
+    Vectorized counterpart of score_beer/score_wine over a whole CatalogIndex.
+
+    Preferences are scored against every candidate of a category in one pass and the
+    winners picked with argpartition. Returns the same drinks as the list-based
+    recommend_beer/recommend_wine in bartender.py, which remain the reference path
+    (bench/recommend_check.py compares the two over every answer tuple).
+    With `semantic`, drinks are ranked by the cosine similarity of their text to the
+    flavors instead (see text_index.py), within the same level and occasion filters. The
+    text index is only built (and warmed) on the first semantic query, so exact matching
+    never pays for it.
+    """
+
+    def __init__(self, index):
+        self.drinks = index.drinks
+        self.features = {category: CategoryFeatures(index, category) for category in index.categories}
+        self._make_text_index = lambda: TextIndex.build(index.drinks)
+        self._text_index = None
+        self._text_index_lock = threading.Lock()
+
+    @classmethod
+    def from_features(cls, drinks, features, text_index=None):
+        engine = cls.__new__(cls)
+        engine.drinks = drinks
+        engine.features = features
+        engine._make_text_index = (lambda: text_index) if text_index is not None else None
+        engine._text_index = None
+        engine._text_index_lock = threading.Lock()
+        return engine
+
+    @property
+    def text_index(self):
+        # None when the engine has no text to match against
+        if self._text_index is None and self._make_text_index is not None:
+            with self._text_index_lock:
+                if self._text_index is None:
+                    self._text_index = self._make_text_index().warm()
+        return self._text_index
+
+    def has_category(self, category):
+        return category in self.features
+
+    def top_k(self, category, flavor_preferences, level=None, occasion=None, k=1, memo=None, semantic=False):
+        features = self.features.get(category)
+        if features is None:
+            return []
+
+        if level is None:
+            rows = np.arange(len(features.positions), dtype=np.int64)
+        else:
+            rows = features.level_rows.get(level, np.empty(0, dtype=np.int64))
+        bucket = level
+
+        if semantic and self.text_index is not None:
+            # The occasion filters, unless no drink is meant for it
+            if occasion is not None and len(rows):
+                matches = features.occasion_matches(rows, occasion, memo, bucket)
+                if matches.any():
+                    rows = rows[matches]
+            similarity = self.text_index.preference_similarity(flavor_preferences, features.positions[rows])
+            keys = np.rint(similarity * SIMILARITY_SCALE).astype(np.int64)
+            return [self.drinks[position] for position in features.positions[top_k_rows(rows, keys, k)]]
+
+        # Flavor count first, occasion match breaks ties
+        keys = features.flavor_scores(rows, flavor_preferences, memo, bucket) * 2
+        if occasion is not None:
+            keys += features.occasion_matches(rows, occasion, memo, bucket)
+
+        return [self.drinks[position] for position in features.positions[top_k_rows(rows, keys, k)]]
+
+    def recommend_beer(self, category, user_responses, memo=None, semantic=False):
+        flavor_preferences = [flavor.lower().strip() for flavor in user_responses[1].split(',')]
+        alcohol_level = str(user_responses[2]).lower().strip()
+
+        level = BEER_LEVEL_ALIASES.get(alcohol_level)
+        if level is None:
+            logging.error("Invalid alcohol level: %s", alcohol_level)
+            return {"error": "Invalid alcohol level selected."}
+
+        top = self.top_k(category, flavor_preferences, level=level, memo=memo, semantic=semantic)
+        if not top:
+            logging.info("No beers found with alcohol level: %s", level)
+            return {"error": f"No beers found with alcohol level '{level}'."}
+        return top[0]
+
+    def recommend_wine(self, category, user_responses, memo=None, semantic=False):
+        flavor_preferences = [flavor.lower().strip() for flavor in user_responses[1].split(',')]
+        occasion_preference = user_responses[2].lower().strip()
+
+        top = self.top_k(category, flavor_preferences, occasion=occasion_preference, memo=memo, semantic=semantic)
+        return top[0] if top else None
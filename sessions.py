@@ -0,0 +1,430 @@
+import json
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+
+class Session:
+    """State of one user's way through the questionnaire."""
+
+    __slots__ = ('user_id', 'question_index', 'enable_speech', 'user_responses', 'last_seen')
+
+    def __init__(self, user_id, question_index=0, enable_speech=True, user_responses=None, last_seen=None):
+        self.user_id = user_id
+        self.question_index = question_index
+        self.enable_speech = enable_speech
+        self.user_responses = user_responses if user_responses is not None else []
+        self.last_seen = last_seen if last_seen is not None else time.time()
+
+    def add_response(self, answer):
+        # The same handful of answers repeat across every session, so keep one copy of each
+        self.user_responses.append(sys.intern(answer) if isinstance(answer, str) else answer)
+
+    def reset(self):
+        self.question_index = 0
+        self.user_responses = []
+
+    def dumps(self):
+        # Compact wire format for the shared backends: [question_index, enable_speech, responses]
+        return json.dumps([self.question_index, self.enable_speech, self.user_responses], separators=(',', ':'))
+
+    @classmethod
+    def loads(cls, user_id, data, last_seen=None):
+        question_index, enable_speech, user_responses = json.loads(data)
+        session = cls(user_id, question_index, enable_speech, last_seen=last_seen)
+        for answer in user_responses:
+            session.add_response(answer)
+        return session
+
+
+class SessionBackend(ABC):
+    """
+    Interface of the session stores bartender.py can run on.
+
+    `get` returns a Session (or None when unknown or expired). Changes made to it are
+    only guaranteed to be visible to other worker processes after `save`.
+    """
+
+    @abstractmethod
+    def create(self):
+        """Returns (user_id, Session) of a new session."""
+
+    @abstractmethod
+    def get(self, user_id):
+        pass
+
+    @abstractmethod
+    def save(self, session):
+        pass
+
+    @abstractmethod
+    def count(self):
+        """Number of live sessions, cheap enough to read on every metrics scrape."""
+
+    @abstractmethod
+    def stats(self):
+        pass
+
+    def get_many(self, user_ids):
+        """{user_id: Session} of those of `user_ids` that are live, e.g. for admin tooling."""
+        sessions = {}
+        for user_id in user_ids:
+            session = self.get(user_id)
+            if session is not None:
+                sessions[user_id] = session
+        return sessions
+
+    def after_fork(self):
+        # Called in a forked worker process before it uses the store
+        pass
+
+
+class SessionStore(SessionBackend):
+    """
+    In-process session store with a hard size limit and idle expiry.
+
+    Sessions are kept in least-recently-used order, so expired sessions always sit at
+    the front: every `sweep_every` operations those are dropped, and when the store is
+    full the least recently used session makes room for the new one.
+    """
+
+    def __init__(self, max_sessions=10000, ttl=2 * 3600, sweep_every=100):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.sweep_every = sweep_every
+        self.sessions = OrderedDict()  # user_id -> Session, least recently used first
+        self.evictions = 0
+        self.expirations = 0
+        self.operations = 0
+        self.lock = threading.Lock()
+
+    def _sweep(self, now):
+        while self.sessions:
+            user_id, session = next(iter(self.sessions.items()))
+            if now - session.last_seen < self.ttl:
+                break
+            del self.sessions[user_id]
+            self.expirations += 1
+
+    def _tick(self, now):
+        self.operations += 1
+        if self.operations % self.sweep_every == 0:
+            self._sweep(now)
+
+    def create(self):
+        now = time.time()
+        user_id = str(uuid.uuid4())
+        with self.lock:
+            self._tick(now)
+            while len(self.sessions) >= self.max_sessions:
+                self.sessions.popitem(last=False)
+                self.evictions += 1
+            session = self.sessions[user_id] = Session(user_id, last_seen=now)
+        return user_id, session
+
+    def get(self, user_id):
+        # Returns the session, or None if it never existed, expired or was evicted
+        if not user_id:
+            return None
+        now = time.time()
+        with self.lock:
+            self._tick(now)
+            session = self.sessions.get(user_id)
+            if session is None:
+                return None
+            if now - session.last_seen >= self.ttl:
+                del self.sessions[user_id]
+                self.expirations += 1
+                return None
+            session.last_seen = now
+            self.sessions.move_to_end(user_id)
+            return session
+
+    def save(self, session):
+        # Sessions are live objects in this process, there is nothing to write back
+        pass
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def count(self):
+        # Expired sessions not swept yet are included
+        return len(self.sessions)
+
+    def stats(self):
+        with self.lock:
+            approx_bytes = sum(
+                sys.getsizeof(session) + sys.getsizeof(session.user_responses)
+                for session in self.sessions.values()
+            ) + sys.getsizeof(self.sessions)
+            return {
+                'backend': 'memory',
+                'sessions': len(self.sessions),
+                'max_sessions': self.max_sessions,
+                'ttl_seconds': self.ttl,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'approx_bytes': approx_bytes,
+            }
+
+
+class SqliteSessionStore(SessionBackend):
+    """
+    Sessions in a local SQLite database in WAL mode, shared by every worker process on
+    the machine. Readers never block the writer, and each thread keeps its own connection.
+    Expired sessions and the least recently saved ones past `max_sessions` are deleted
+    in one statement every `sweep_every` operations.
+    """
+
+    def __init__(self, path, max_sessions=10000, ttl=2 * 3600, sweep_every=100):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.sweep_every = sweep_every
+        self.operations = 0
+        self.local = threading.local()
+
+        db = self._db()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("CREATE TABLE IF NOT EXISTS sessions (user_id TEXT PRIMARY KEY, data TEXT NOT NULL, last_seen REAL NOT NULL)")
+        db.execute("CREATE INDEX IF NOT EXISTS sessions_last_seen ON sessions (last_seen)")
+        db.commit()
+
+    def after_fork(self):
+        # The connections of the parent process must not be used in the child
+        self.local = threading.local()
+
+    def _db(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = self.local.db = sqlite3.connect(self.path, timeout=5)
+            db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def _tick(self, db, now):
+        self.operations += 1
+        if self.operations % self.sweep_every == 0:
+            db.execute("DELETE FROM sessions WHERE last_seen < ?", (now - self.ttl,))
+            db.execute("DELETE FROM sessions WHERE user_id IN "
+                       "(SELECT user_id FROM sessions ORDER BY last_seen DESC LIMIT -1 OFFSET ?)", (self.max_sessions,))
+
+    def create(self):
+        now = time.time()
+        session = Session(str(uuid.uuid4()), last_seen=now)
+        db = self._db()
+        with db:
+            self._tick(db, now)
+            db.execute("INSERT INTO sessions (user_id, data, last_seen) VALUES (?, ?, ?)",
+                       (session.user_id, session.dumps(), now))
+        return session.user_id, session
+
+    def get(self, user_id):
+        if not user_id:
+            return None
+        now = time.time()
+        row = self._db().execute("SELECT data, last_seen FROM sessions WHERE user_id = ? AND last_seen >= ?",
+                                 (user_id, now - self.ttl)).fetchone()
+        if row is None:
+            return None
+        return Session.loads(user_id, row[0], last_seen=row[1])
+
+    def save(self, session):
+        now = time.time()
+        session.last_seen = now
+        db = self._db()
+        with db:
+            self._tick(db, now)
+            db.execute("INSERT OR REPLACE INTO sessions (user_id, data, last_seen) VALUES (?, ?, ?)",
+                       (session.user_id, session.dumps(), now))
+
+    def count(self):
+        count, = self._db().execute("SELECT COUNT(*) FROM sessions WHERE last_seen >= ?", (time.time() - self.ttl,)).fetchone()
+        return count
+
+    def stats(self):
+        return {
+            'backend': 'sqlite',
+            'sessions': self.count(),
+            'max_sessions': self.max_sessions,
+            'ttl_seconds': self.ttl,
+        }
+
+
+class RespError(RuntimeError):
+    """An error reply of the session server; the connection is still usable."""
+
+
+class RespConnection:
+    """Minimal Redis protocol (RESP2) client. Commands sent together go out in one write."""
+
+    def __init__(self, host, port, db=0, timeout=2.0):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.reader = self.sock.makefile('rb')
+        if db:
+            self.execute('SELECT', db)
+
+    @staticmethod
+    def _encode(args):
+        out = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            arg = arg if isinstance(arg, bytes) else str(arg).encode()
+            out.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(out)
+
+    def _read(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by session server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode()
+        if kind == b'-':
+            return RespError(rest.decode())
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length == -1:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2].decode()
+        if kind == b'*':
+            length = int(rest)
+            return None if length == -1 else [self._read() for _ in range(length)]
+        raise RuntimeError(f"Unexpected reply from session server: {line!r}")
+
+    def pipeline(self, *commands):
+        self.sock.sendall(b''.join(self._encode(command) for command in commands))
+        # Every reply is read before an error one is raised, so the next pipeline on this
+        # connection doesn't get the rest of this one's replies
+        replies = [self._read() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    def execute(self, *args):
+        return self.pipeline(args)[0]
+
+
+class RedisSessionStore(SessionBackend):
+    """
+    Sessions in Redis (or anything speaking its protocol), shared by workers on any host.
+
+    Expiry is left to the server: every write sets the key TTL, and reads refresh it in
+    the same round trip. The size limit is Redis' own `maxmemory` eviction policy.
+
+    Next to the sessions a sorted set (`prefix + 'live'`) holds every session id scored by
+    when it expires, updated in the same round trips, so `count` doesn't depend on what
+    else shares the database. Ids past their expiry are trimmed on create and count, and
+    a read that finds the session gone drops its id.
+    Sessions evicted by `maxmemory` are still counted until they would have expired.
+    """
+
+    def __init__(self, url, ttl=2 * 3600, prefix='matchmaker:session:'):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.live_key = prefix + 'live'  # session ids are uuids, so this can't be a session key
+        self.local = threading.local()
+        self.hits = 0
+        self.misses = 0
+
+    def after_fork(self):
+        # The parent's sockets stay with the parent; the child connects on first use
+        self.local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = RespConnection(self.host, self.port, self.db)
+        return conn
+
+    def _pipeline(self, *commands):
+        try:
+            return self._conn().pipeline(*commands)
+        except RespError:
+            raise
+        except (OSError, ConnectionError):
+            # Reconnect once, e.g. after the server closed an idle connection
+            self.local.conn = None
+            return self._conn().pipeline(*commands)
+        except Exception:
+            # A reply we couldn't parse leaves the connection out of step with the server
+            self.local.conn = None
+            raise
+
+    def create(self):
+        session = Session(str(uuid.uuid4()))
+        now = time.time()
+        self._pipeline(('SET', self.prefix + session.user_id, session.dumps(), 'EX', int(self.ttl)),
+                       ('ZADD', self.live_key, now + self.ttl, session.user_id),
+                       ('ZREMRANGEBYSCORE', self.live_key, '-inf', now))
+        return session.user_id, session
+
+    def get(self, user_id):
+        if not user_id:
+            return None
+        key = self.prefix + user_id
+        # XX: an unknown id must not be added to the live set
+        data, _, _ = self._pipeline(('GET', key), ('EXPIRE', key, int(self.ttl)),
+                                    ('ZADD', self.live_key, 'XX', time.time() + self.ttl, user_id))
+        if data is None:
+            # An expired session's id may not have been trimmed yet, and was just refreshed
+            self._pipeline(('ZREM', self.live_key, user_id))
+            self.misses += 1
+            return None
+        self.hits += 1
+        return Session.loads(user_id, data)
+
+    def get_many(self, user_ids):
+        # One MGET for the whole batch, and the TTLs refreshed in the same round trip
+        user_ids = [user_id for user_id in user_ids if user_id]
+        if not user_ids:
+            return {}
+        keys = [self.prefix + user_id for user_id in user_ids]
+        expires = time.time() + self.ttl
+        replies = self._pipeline(('MGET', *keys), *[('EXPIRE', key, int(self.ttl)) for key in keys],
+                                 ('ZADD', self.live_key, 'XX', *[part for user_id in user_ids for part in (expires, user_id)]))
+        sessions = {user_id: Session.loads(user_id, data) for user_id, data in zip(user_ids, replies[0]) if data is not None}
+        if len(sessions) < len(user_ids):
+            self._pipeline(('ZREM', self.live_key, *[user_id for user_id in user_ids if user_id not in sessions]))
+        self.hits += len(sessions)
+        self.misses += len(user_ids) - len(sessions)
+        return sessions
+
+    def save(self, session):
+        session.last_seen = time.time()
+        self._pipeline(('SET', self.prefix + session.user_id, session.dumps(), 'EX', int(self.ttl)),
+                       ('ZADD', self.live_key, session.last_seen + self.ttl, session.user_id))
+
+    def count(self):
+        # O(log n) plus the ids that expired since the last trim
+        return self._pipeline(('ZREMRANGEBYSCORE', self.live_key, '-inf', time.time()), ('ZCARD', self.live_key))[1]
+
+    def stats(self):
+        return {
+            'backend': 'redis',
+            'ttl_seconds': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+def make_session_store(backend='memory', max_sessions=10000, ttl=2 * 3600, path='sessions.sqlite3', url='redis://localhost:6379/0'):
+    if backend == 'memory':
+        return SessionStore(max_sessions=max_sessions, ttl=ttl)
+    if backend == 'sqlite':
+        return SqliteSessionStore(path, max_sessions=max_sessions, ttl=ttl)
+    if backend == 'redis':
+        return RedisSessionStore(url, ttl=ttl)
+    raise ValueError(f"Unknown session backend: {backend}")
@@ -0,0 +1,52 @@
+import threading
+from collections import Counter
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """
+    Lets concurrent identical calls share one.
+
+    The first caller of a key (the leader) makes the call and hands its result to
+    `finish`; callers of the same key arriving while it is in flight (followers) get
+    the leader's future and wait for that result instead of making their own call.
+    Calls are counted per kind, so `stats` shows how many were coalesced.
+    """
+
+    def __init__(self):
+        self.inflight = {}  # key -> future of the leader's call
+        self.leaders = Counter()
+        self.followers = Counter()
+        self.lock = threading.Lock()
+
+    def join(self, kind, key):
+        # (True, future) for the leader, which must finish the future; (False, future) for a follower
+        with self.lock:
+            future = self.inflight.get(key)
+            if future is not None:
+                self.followers[kind] += 1
+                return False, future
+            future = Future()
+            self.inflight[key] = future
+            self.leaders[kind] += 1
+            return True, future
+
+    def finish(self, key, future, result):
+        with self.lock:
+            if self.inflight.get(key) is future:
+                del self.inflight[key]
+        if not future.done():
+            future.set_result(result)
+
+    def stats(self):
+        with self.lock:
+            stats = {}
+            for kind in self.leaders | self.followers:
+                calls = self.leaders[kind] + self.followers[kind]
+                stats[kind] = {
+                    'calls': calls,
+                    'coalesced': self.followers[kind],
+                    'coalescing_ratio': self.followers[kind] / calls,
+                }
+            stats['inflight'] = len(self.inflight)
+            return stats
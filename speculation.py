@@ -0,0 +1,149 @@
+import logging
+import threading
+import time
+from collections import Counter, deque
+
+
+class Speculator:
+    """
+    Runs likely GPT calls ahead of time on a bounded executor.
+
+    Futures are kept per user and key (the prompt). `collect` hands the matching
+    future to the request that needs it and cancels the rest of that user's
+    speculation. Spend is capped by the number of calls in flight and per minute,
+    and speculation nobody collects within `ttl` seconds is cancelled. Calls that
+    can't be cancelled any more are let finish, and their results are handed to
+    `keep(key, result)` (e.g. a cache put) instead of being thrown away.
+    """
+
+    def __init__(self, executor, max_inflight=8, max_calls_per_minute=60, ttl=600, keep=None):
+        self.executor = executor
+        self.keep = keep
+        self.max_inflight = max_inflight
+        self.max_calls_per_minute = max_calls_per_minute
+        self.ttl = ttl
+        self.pending = {}  # user_id -> (submitted, {key: future})
+        self.recent_calls = deque()
+        self.choices = Counter()
+        # Reentrant: a future that is already done runs its callback right away in the submitting thread
+        self.lock = threading.RLock()
+        self.inflight = 0
+        self.submitted = 0
+        self.skipped = 0
+        self.hits = 0
+        self.misses = 0
+        self.cancelled = 0
+        self.kept = 0
+        self.wasted = 0
+
+    def record_choice(self, choice):
+        # What users actually picked, used to rank the candidates worth speculating on
+        with self.lock:
+            self.choices[choice.lower()] += 1
+
+    def seed_choices(self, counts):
+        # {choice: count} from earlier traffic (analytics.py --popularity), so the ranking is right from the start
+        with self.lock:
+            self.choices.update({choice.lower(): count for choice, count in counts.items()})
+
+    def likely(self, candidates, n):
+        with self.lock:
+            return sorted(candidates, key=lambda choice: -self.choices[choice.lower()])[:n]
+
+    def _finished(self, future):
+        with self.lock:
+            self.inflight -= 1
+
+    def _keep_result(self, key, future):
+        # Done callback of an uncollected call that was already running or finished
+        try:
+            result = future.result()
+        except Exception:
+            result = None
+        if result is not None and self.keep is not None:
+            try:
+                self.keep(key, result)
+                with self.lock:
+                    self.kept += 1
+                return
+            except Exception as e:
+                logging.error("Could not keep a speculative GPT result: %s", e)
+        with self.lock:
+            # The GPT call was paid for and not used
+            self.wasted += 1
+
+    def _discard(self, futures):
+        for key, future in futures.items():
+            if future.cancel():
+                self.cancelled += 1
+            else:
+                future.add_done_callback(lambda future, key=key: self._keep_result(key, future))
+
+    def _sweep(self, now):
+        # Users are kept in order of their first speculation, so abandoned ones are at the front
+        while self.pending:
+            user_id, (submitted, futures) = next(iter(self.pending.items()))
+            if now - submitted < self.ttl:
+                break
+            del self.pending[user_id]
+            self._discard(futures)
+
+    def submit(self, user_id, key, fn):
+        now = time.time()
+        with self.lock:
+            self._sweep(now)
+            while self.recent_calls and now - self.recent_calls[0] >= 60:
+                self.recent_calls.popleft()
+            futures = self.pending.setdefault(user_id, (now, {}))[1]
+            if key in futures:
+                return
+            if len(self.recent_calls) >= self.max_calls_per_minute or self.inflight >= self.max_inflight:
+                self.skipped += 1
+                return
+            self.recent_calls.append(now)
+            self.submitted += 1
+            self.inflight += 1
+            future = futures[key] = self.executor.submit(fn)
+            future.add_done_callback(self._finished)
+
+    def collect(self, user_id, key):
+        # Returns the future speculated for `key`, or None
+        with self.lock:
+            _, futures = self.pending.pop(user_id, (None, {}))
+            if not futures:
+                return None
+            future = futures.pop(key, None)
+            if future is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            self._discard(futures)
+            return future
+
+    def cancel(self, user_id):
+        with self.lock:
+            _, futures = self.pending.pop(user_id, (None, {}))
+            self._discard(futures)
+
+    def result(self, future, timeout=None):
+        # Result of a collected future, or None if the speculative call failed
+        try:
+            return future.result(timeout=timeout)
+        except Exception as e:
+            logging.error("Speculative GPT call failed: %s", e)
+            return None
+
+    def stats(self):
+        with self.lock:
+            collected = self.hits + self.misses
+            return {
+                'submitted': self.submitted,
+                'skipped': self.skipped,
+                'inflight': self.inflight,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / collected if collected else 0.0,
+                'cancelled': self.cancelled,
+                'kept': self.kept,
+                'wasted': self.wasted,
+            }
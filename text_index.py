@@ -0,0 +1,179 @@
+import functools
+import re
+import threading
+import zlib
+
+import numpy as np
+
+# Flavor answers and words drink texts use for them. A preference is matched as the answer
+# itself plus these terms at EXPANSION_WEIGHT, so "Fruity" also finds the drinks that are
+# only described as citrusy or tasting of mango.
+FLAVOR_TERMS = {
+    'fruity': ('fruit', 'citrus', 'tropical', 'mango', 'pineapple', 'passion fruit', 'peach', 'pear', 'apple',
+               'berries', 'raspberries', 'cherries', 'blackcurrant', 'orange', 'grapefruit', 'lime', 'lemon', 'melon'),
+    'light': ('crisp', 'refreshing', 'pale', 'clear', 'lager', 'pilsner', 'fresh'),
+    'malty': ('malt', 'maltiness', 'bread', 'biscuit', 'caramel', 'toffee', 'honey'),
+    'dark': ('roasted', 'chocolate', 'coffee', 'stout', 'porter', 'black'),
+    'sour': ('tart', 'acidity', 'sourness', 'lambic', 'gose'),
+    'wheat beer': ('wheat', 'hefeweizen', 'weissbier', 'witbier', 'banana', 'clove'),
+    'spicy': ('spice', 'spices', 'pepper', 'peppery', 'cinnamon', 'clove', 'ginger'),
+    'oaked': ('oak', 'barrel', 'vanilla', 'aged', 'toasty'),
+    'tannic': ('tannins', 'structure', 'bold', 'firm', 'grip'),
+    'acidic': ('acidity', 'crisp', 'fresh', 'tart', 'zesty', 'citrus'),
+    'earthy': ('earth', 'forest', 'mushroom', 'leather', 'truffle', 'tobacco', 'herbs'),
+    'floral': ('flowers', 'elderflower', 'elderberry', 'blossom', 'aromatic', 'perfumed', 'rose'),
+    'mineral': ('minerality', 'flinty', 'chalky', 'stony', 'saline', 'crisp'),
+    'buttery': ('butter', 'creamy', 'rich', 'vanilla', 'oak', 'smooth'),
+}
+EXPANSION_WEIGHT = 0.5
+# Text fields of a drink and how much they count; the flavor profile is what the user picks from
+TEXT_FIELDS = {'flavor_profile': 3.0, 'flavour_profile': 3.0, 'description': 1.0, 'pairing': 0.5, 'Style_Name': 0.5}
+STOPWORDS = frozenset('a an and as at by for from in is it its of on or the to with well goes pairs notes hints hint'.split())
+# Character 3-grams count less than whole words: they only bridge "fruity", "fruit" and "fruits"
+NGRAM_WEIGHT = 0.3
+HASH_BITS = 20
+
+
+def _hash(key):
+    # Stable across processes (unlike hash()), so compiled catalogs can store the features
+    return zlib.crc32(key.encode('utf-8')) & ((1 << HASH_BITS) - 1)
+
+
+@functools.lru_cache(maxsize=100000)
+def word_features(word):
+    # ((feature, weight), ...) of one word; catalogs repeat the same few thousand words
+    padded = f' {word} '
+    return ((_hash('w ' + word), 1.0),) + tuple((_hash(padded[start:start + 3]), NGRAM_WEIGHT)
+                                                for start in range(len(padded) - 2))
+
+
+def text_features(text, weight=1.0, features=None):
+    """Adds the hashed word and character 3-gram features of `text` to `features` ({feature: weight})."""
+    features = {} if features is None else features
+    for word in re.findall(r'[^\W\d_]+', str(text).lower()):
+        if word in STOPWORDS:
+            continue
+        for feature, feature_weight in word_features(word):
+            features[feature] = features.get(feature, 0.0) + weight * feature_weight
+    return features
+
+
+def _field_postings(drinks, field, weight):
+    # (positions, features, weights) of one text field of every drink. Each distinct text is
+    # only tokenized once: flavor profiles and pairings are shared by many drinks.
+    texts = {}
+    numbers = np.array([texts.setdefault(str(drink.get(field) or ''), len(texts)) for drink in drinks], dtype=np.int64)
+    per_text = [text_features(text) for text in texts]
+    lengths = np.array([len(features) for features in per_text], dtype=np.int64)
+    text_features_ids = np.fromiter((feature for features in per_text for feature in features), dtype=np.uint32,
+                                    count=int(lengths.sum()))
+    text_weights = np.fromiter((value for features in per_text for value in features.values()), dtype=np.float32,
+                               count=int(lengths.sum()))
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+
+    counts = lengths[numbers]
+    positions = np.repeat(np.arange(len(drinks), dtype=np.int64), counts)
+    # Index of every posting into the per-text arrays: its text's start plus its rank within the drink
+    first = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    index = np.repeat(starts[numbers] - first, counts) + np.arange(int(counts.sum()), dtype=np.int64)
+    return positions, text_features_ids[index], text_weights[index] * weight
+
+
+def preference_features(flavor):
+    features = text_features(flavor)
+    for term in FLAVOR_TERMS.get(flavor, ()):
+        text_features(term, EXPANSION_WEIGHT, features)
+    return features
+
+
+class TextIndex:
+    """
+    TF-IDF vectors of the drinks' text (flavor profile, description, pairing and name) over
+    hashed word and character n-gram features, for cosine matching of flavor preferences.
+
+    The vectors are stored by feature (sorted feature ids, their idf and, per feature, the
+    drinks that have it with their L2-normalized weights), so scoring a preference only
+    touches the drinks sharing a feature with it. Cosine similarity is linear in the query,
+    so the similarity of every drink to each flavor is computed once and kept: a query with
+    several flavors is the sum of their vectors, which ranks like the cosine to the sum of
+    the normalized flavor queries (every picked flavor counts the same).
+    """
+
+    def __init__(self, features, idf, indptr, documents, weights, size, max_cached=128):
+        self.features = features    # sorted feature ids
+        self.idf = idf
+        self.indptr = indptr        # postings of features[i] are documents/weights[indptr[i]:indptr[i + 1]]
+        self.documents = documents  # drink positions
+        self.weights = weights
+        self.size = size
+        self.max_cached = max_cached
+        self.cache = {}             # flavor -> similarity of every drink
+        self.lock = threading.Lock()
+
+    @classmethod
+    def build(cls, drinks):
+        size = len(drinks)
+        postings = [_field_postings(drinks, field, weight) for field, weight in TEXT_FIELDS.items()]
+        # Sum the weights of a feature over the fields of a drink; sorting on (feature, position)
+        # also groups the postings by feature
+        keys = np.concatenate([(features.astype(np.int64) << 32) | positions for positions, features, _ in postings])
+        keys, inverse = np.unique(keys, return_inverse=True)
+        counts = np.bincount(inverse, weights=np.concatenate([weights for _, _, weights in postings]))
+        tf = np.log1p(counts).astype(np.float32)
+        positions = (keys & 0xFFFFFFFF).astype(np.int32)
+        feature_ids = (keys >> 32).astype(np.uint32)
+        features, starts, df = np.unique(feature_ids, return_index=True, return_counts=True)
+        idf = (np.log((1 + size) / (1 + df)) + 1).astype(np.float32)
+        weights = tf * np.repeat(idf, df)
+        norms = np.sqrt(np.bincount(positions, weights=weights ** 2, minlength=size)).astype(np.float32)
+        weights = (weights / np.maximum(norms[positions], 1e-12)).astype(np.float32)
+        indptr = np.append(starts, len(feature_ids)).astype(np.int64)
+        return cls(features, idf, indptr, positions, weights, size)
+
+    def arrays(self):
+        # For catalog_compiler; TextIndex(**arrays, size=...) rebuilds the index
+        return {'features': self.features, 'idf': self.idf, 'indptr': self.indptr,
+                'documents': self.documents, 'weights': self.weights}
+
+    def similarity(self, query):
+        """Cosine similarity of every drink to a {feature: weight} query, by drink position."""
+        scores = np.zeros(self.size, dtype=np.float32)
+        if not query or not len(self.features):
+            return scores
+        keys = np.fromiter(query.keys(), dtype=np.uint32, count=len(query))
+        columns = np.minimum(np.searchsorted(self.features, keys), len(self.features) - 1)
+        known = self.features[columns] == keys
+        columns = columns[known]
+        query_weights = np.log1p(np.fromiter(query.values(), dtype=np.float32, count=len(query)))[known] * self.idf[columns]
+        norm = np.linalg.norm(query_weights)
+        if not norm:
+            return scores
+        for column, weight in zip(columns, query_weights / norm):
+            start, end = self.indptr[column], self.indptr[column + 1]
+            scores[self.documents[start:end]] += weight * self.weights[start:end]
+        return scores
+
+    def flavor_similarity(self, flavor):
+        scores = self.cache.get(flavor)
+        if scores is None:
+            scores = self.similarity(preference_features(flavor))
+            with self.lock:
+                self.cache[flavor] = scores
+                while len(self.cache) > self.max_cached:
+                    # Free-text flavors from the batch API must not grow the cache without bound
+                    del self.cache[next(iter(self.cache))]
+        return scores
+
+    def preference_similarity(self, flavor_preferences, positions):
+        # Similarity of the drinks at `positions` to all the picked flavors together
+        scores = np.zeros(len(positions), dtype=np.float32)
+        for flavor in flavor_preferences:
+            if flavor:
+                scores += self.flavor_similarity(flavor)[positions]
+        return scores
+
+    def warm(self, flavors=FLAVOR_TERMS):
+        # Computes the flavor vectors of the questionnaire's answers at load time
+        for flavor in flavors:
+            self.flavor_similarity(flavor)
+        return self